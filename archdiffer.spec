@@ -100,6 +100,7 @@ rm -rf $RPM_BUILD_ROOT
 
 %files backend
 /lib/systemd/system/archdiffer-worker.service
+/lib/systemd/system/archdiffer-worker@.service
 %{python3_sitelib}/archdiffer/backend/*.py
 %{python3_sitelib}/archdiffer/backend/__pycache__/*
 
@@ -107,6 +108,7 @@ rm -rf $RPM_BUILD_ROOT
 
 %files plugin-rpmdiff-common
 %attr(0755, root, root) /usr/libexec/archdiffer/init_db_rpmdiff
+%attr(0755, root, root) /usr/libexec/archdiffer/upgrade_db_rpmdiff
 %{python3_sitelib}/archdiffer/plugins/rpmdiff/*.py
 %{python3_sitelib}/archdiffer/plugins/rpmdiff/__pycache__/*
 
@@ -116,6 +118,7 @@ rm -rf $RPM_BUILD_ROOT
 %{python3_sitelib}/archdiffer/plugins/rpmdiff/flask_frontend/templates/*
 
 %files plugin-rpmdiff-backend
+%attr(0755, root, root) /usr/libexec/archdiffer/archive_rpmdiff
 %{python3_sitelib}/archdiffer/plugins/rpmdiff/worker/*.py
 %{python3_sitelib}/archdiffer/plugins/rpmdiff/worker/__pycache__/*
 
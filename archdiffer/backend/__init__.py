@@ -10,6 +10,7 @@ Created on Tue Apr 18 11:58:24 2017
 """
 
 from .celery_app import celery_app
+from . import exporter, profiling
 from ..repository import load_plugins_workers
 
 load_plugins_workers()
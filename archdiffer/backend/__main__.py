@@ -9,6 +9,13 @@ Created on Mon Jul 17 21:49:00 2017
 @author: Pavla Kratochvilova <pavla.kratochvilova@gmail.com>
 """
 
+import sys
 from . import celery_app
+from ..routing import worker_arguments
+
+try:
+    sys.argv = worker_arguments(sys.argv)
+except ValueError as error:
+    sys.exit(error)
 
 celery_app.start()
@@ -10,6 +10,13 @@ Created on Fri Sep  1 10:22:37 2017
 """
 
 from celery import Celery
+from celery.signals import worker_process_init
 from ..config import config
+from .. import database
 
 celery_app = Celery('backend', broker=config['common']['MESSAGE_BROKER'])
+
+@worker_process_init.connect()
+def new_database_connections(**kwargs):
+    """Don't share database connections with the parent process."""
+    database.SessionSingleton.after_fork()
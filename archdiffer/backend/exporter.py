@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from celery.signals import (worker_ready, worker_shutdown,
+                            worker_process_init, worker_process_shutdown,
+                            task_prerun, task_postrun)
+from ..config import config
+from .. import metrics
+
+# Port of the metrics listener of the worker (0 disables it)
+METRICS_PORT = config.getint('workers', 'METRICS_PORT', fallback=0)
+METRICS_ADDRESS = config.get(
+    'workers', 'METRICS_ADDRESS', fallback='127.0.0.1'
+)
+# Directory where worker processes dump their metrics
+METRICS_DIR = config.get(
+    'workers', 'METRICS_DIR',
+    fallback=os.path.join(
+        tempfile.gettempdir(), 'archdiffer-metrics-%s' % METRICS_PORT
+    ),
+)
+# How often do worker processes dump their metrics, in seconds
+METRICS_DUMP_INTERVAL = config.getfloat(
+    'workers', 'METRICS_DUMP_INTERVAL', fallback=5
+)
+
+tasks_in_flight = metrics.Gauge(
+    'archdiffer_worker_tasks_in_flight',
+    'Count of tasks being executed.',
+)
+task_seconds = metrics.Histogram(
+    'archdiffer_worker_task_seconds',
+    'Duration of tasks by task name and final state.',
+)
+
+_started = {}
+_server = None
+
+def dump():
+    """Dump metrics of this process to METRICS_DIR."""
+    metrics.dump_process(METRICS_DIR)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Handler serving the metrics on any path."""
+    def do_GET(self):
+        body = metrics.render_processes(METRICS_DIR).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(address=METRICS_ADDRESS, port=METRICS_PORT):
+    """Start the metrics listener in a daemon thread.
+
+    :param string address: listening address
+    :param int port: listening port
+    :return ThreadingHTTPServer: server
+    """
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+@worker_ready.connect()
+def start_exporter(**kwargs):
+    """Start the metrics listener in the main worker process; remove dumps
+    of the previous run."""
+    global _server
+    if not METRICS_PORT:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        pid = name.split('.', 1)[0]
+        if pid.isdigit() and int(pid) != os.getpid():
+            os.unlink(os.path.join(METRICS_DIR, name))
+    _server = start_server()
+    print('Metrics exported on http://%s:%s/metrics' % (
+        METRICS_ADDRESS, METRICS_PORT
+    ))
+
+@worker_shutdown.connect()
+def stop_exporter(**kwargs):
+    """Stop the metrics listener."""
+    if _server is not None:
+        _server.shutdown()
+
+@worker_process_init.connect()
+def start_dumping(**kwargs):
+    """Dump metrics of the worker process periodically."""
+    if not METRICS_PORT:
+        return
+    threading.Thread(
+        target=metrics.dump_periodically,
+        args=(METRICS_DIR, METRICS_DUMP_INTERVAL),
+        daemon=True,
+    ).start()
+
+@worker_process_shutdown.connect()
+def final_dump(**kwargs):
+    """Dump metrics of the worker process before it exits."""
+    if METRICS_PORT:
+        dump()
+
+@task_prerun.connect()
+def task_started(task_id=None, **kwargs):
+    """Record start of the task."""
+    _started[task_id] = time.monotonic()
+    tasks_in_flight.inc()
+
+@task_postrun.connect()
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    """Record end of the task and dump metrics of the process."""
+    tasks_in_flight.dec()
+    started = _started.pop(task_id, None)
+    if started is not None:
+        task_seconds.observe(
+            time.monotonic() - started, task=task.name, state=state
+        )
+    if METRICS_PORT:
+        dump()
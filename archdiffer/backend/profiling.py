@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import time
+import random
+import cProfile
+import tempfile
+import tracemalloc
+from celery.signals import task_prerun, task_postrun
+from ..config import config
+
+# Names of tasks that are always profiled (comma-separated)
+PROFILE_TASKS = [
+    name.strip()
+    for name in config.get('workers', 'PROFILE_TASKS', fallback='').split(',')
+    if name.strip()
+]
+# Fraction of the other tasks that are profiled
+PROFILE_SAMPLE_RATE = config.getfloat(
+    'workers', 'PROFILE_SAMPLE_RATE', fallback=0
+)
+# Trace memory allocations of profiled tasks
+PROFILE_MEMORY = config.getboolean(
+    'workers', 'PROFILE_MEMORY', fallback=True
+)
+PROFILE_DIR = config.get(
+    'workers', 'PROFILE_DIR',
+    fallback=os.path.join(tempfile.gettempdir(), 'archdiffer-profiles'),
+)
+# Count of frames stored for each traced memory block
+TRACEMALLOC_FRAMES = 10
+
+_profiles = {}
+
+def should_profile(name, tasks=PROFILE_TASKS,
+                   sample_rate=PROFILE_SAMPLE_RATE):
+    """Decide if the task is profiled.
+
+    :param string name: name of the task
+    :param list tasks: names of tasks that are always profiled
+    :param float sample_rate: fraction of the other tasks that are profiled
+    :return bool: True if the task should be profiled
+    """
+    if name in tasks:
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+def comparison_id(args, kwargs):
+    """Get id of the comparison the task works on. Tasks get it as their
+    first argument.
+
+    :param tuple args: positional arguments of the task
+    :param dict kwargs: keyword arguments of the task
+    :return: id of the comparison or None
+    """
+    if args:
+        return args[0]
+    for key in ('comp_id', 'id_comp'):
+        if key in kwargs:
+            return kwargs[key]
+    return None
+
+class TaskProfile():
+    """cProfile and tracemalloc profile of one task run."""
+    def __init__(self, task_name, task_id, comp_id, memory=PROFILE_MEMORY):
+        """Create the profile.
+
+        :param string task_name: name of the task
+        :param string task_id: id of the task
+        :param comp_id: id of the comparison
+        :param bool memory: trace memory allocations
+        """
+        self.task_name = task_name
+        self.task_id = task_id
+        self.comp_id = comp_id
+        self.memory = memory
+        self.profile = cProfile.Profile()
+        self.tracing = False
+        self.started = None
+
+    def start(self):
+        """Start profiling."""
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.tracing = True
+        elif tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.started = time.monotonic()
+        self.profile.enable()
+
+    def stop(self, directory=PROFILE_DIR, state=None):
+        """Stop profiling and write the results into the directory.
+
+        Files are named '<task name>-<comparison id>-<task id>' with
+        suffixes: '.prof' is the cProfile output (readable by pstats or
+        snakeviz), '.tracemalloc' the tracemalloc snapshot at the end of the
+        task (readable by tracemalloc.Snapshot.load) and '.json' a summary
+        with duration and peak of traced memory.
+
+        :param string directory: output directory
+        :param string state: final state of the task
+        :return string: path of the output files without suffixes
+        """
+        self.profile.disable()
+        duration = time.monotonic() - self.started
+        memory_peak = None
+        snapshot = None
+        if tracemalloc.is_tracing():
+            # Tracing is stopped before anything is written, so that it
+            # doesn't slow down the next tasks if writing fails
+            try:
+                memory_peak = tracemalloc.get_traced_memory()[1]
+                snapshot = tracemalloc.take_snapshot()
+            finally:
+                if self.tracing:
+                    tracemalloc.stop()
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '%s-%s-%s' % (
+            self.task_name, self.comp_id, self.task_id
+        ))
+        self.profile.dump_stats(path + '.prof')
+
+        summary = {
+            'task': self.task_name,
+            'task_id': self.task_id,
+            'comparison': self.comp_id,
+            'state': state,
+            'duration': round(duration, 3),
+        }
+        if snapshot is not None:
+            summary['memory_peak'] = memory_peak
+            snapshot.dump(path + '.tracemalloc')
+        with open(path + '.json', 'w') as summary_file:
+            json.dump(summary, summary_file)
+        return path
+
+@task_prerun.connect()
+def start_profile(task_id=None, task=None, args=(), kwargs=None,
+                  **signal_kwargs):
+    """Start profiling of the task if it is selected."""
+    if not should_profile(task.name):
+        return
+    profile = TaskProfile(
+        task.name, task_id, comparison_id(args, kwargs or {})
+    )
+    _profiles[task_id] = profile
+    profile.start()
+
+@task_postrun.connect()
+def stop_profile(task_id=None, state=None, **signal_kwargs):
+    """Stop profiling of the task and write the results."""
+    profile = _profiles.pop(task_id, None)
+    if profile is None:
+        return
+    try:
+        path = profile.stop(state=state)
+    except OSError as error:
+        print('Profile of task %s not written: %s' % (task_id, error))
+    else:
+        print('Profile of task %s written to %s.*' % (task_id, path))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import tempfile
+import threading
+from .config import config
+from . import metrics
+
+# How long are cached reference data used, in seconds
+CACHE_TTL = config.getfloat('common', 'CACHE_TTL', fallback=60)
+# Directory shared by the processes of one host: invalidation of a cache in
+# one process drops the cache in the others too. If set to empty, each
+# process keeps its entries (for example revoked tokens) until they expire.
+CACHE_SHARED_DIR = config.get(
+    'common', 'CACHE_SHARED_DIR',
+    fallback=os.path.join(tempfile.gettempdir(), 'archdiffer-cache')
+)
+
+cache_lookups = metrics.Counter(
+    'archdiffer_cache_lookups_total',
+    'Count of lookups in reference data caches by cache and result.',
+)
+
+_caches = []
+
+class TTLCache():
+    """Thread-safe cache of reference data of one process. Entries expire
+    after the time to live and can be invalidated explicitly.
+    """
+    def __init__(self, name, ttl=None, shared_dir=None):
+        """Create cache.
+
+        :param string name: name of the cache
+        :param float ttl: time to live of the entries in seconds; defaults
+            to CACHE_TTL
+        :param string shared_dir: directory for sharing invalidations with
+            other processes; defaults to CACHE_SHARED_DIR
+        """
+        self.name = name
+        self.ttl = CACHE_TTL if ttl is None else ttl
+        if shared_dir is None:
+            shared_dir = CACHE_SHARED_DIR
+        self.stamp_path = (
+            os.path.join(shared_dir, name + '.invalidated')
+            if shared_dir else None
+        )
+        self.entries = {}
+        self.lock = threading.Lock()
+        # Incremented by each invalidation; values loaded meanwhile are not
+        # stored
+        self.generation = 0
+        self.stamp = self.shared_stamp()
+        _caches.append(self)
+
+    def shared_stamp(self):
+        """Get time of the last invalidation by any process.
+
+        :return int: modification time of the stamp file in nanoseconds
+            (0 if not shared or never invalidated)
+        """
+        if self.stamp_path is None:
+            return 0
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return 0
+
+    def sync(self):
+        """Drop all entries if another process invalidated the cache. Must
+        be called with the lock held.
+        """
+        stamp = self.shared_stamp()
+        if stamp != self.stamp:
+            self.stamp = stamp
+            self.entries.clear()
+            self.generation += 1
+
+    def get(self, key, load):
+        """Get value of the key; load it if it isn't cached or has expired.
+        None is never cached.
+
+        :param key: key
+        :param callable load: function without arguments loading the value
+        :return: value
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.sync()
+            entry = self.entries.get(key)
+            generation = self.generation
+        if entry is not None and entry[0] > now:
+            cache_lookups.inc(cache=self.name, result='hit')
+            return entry[1]
+        cache_lookups.inc(cache=self.name, result='miss')
+        value = load()
+        if value is not None:
+            with self.lock:
+                if generation == self.generation:
+                    self.entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Remove the key from the cache, or all keys if not given. Other
+        processes sharing the cache drop all their entries.
+
+        :param key: key
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+            self.generation += 1
+            if self.stamp_path is not None:
+                try:
+                    os.makedirs(os.path.dirname(self.stamp_path),
+                                exist_ok=True)
+                    with open(self.stamp_path, 'a'):
+                        pass
+                    os.utime(self.stamp_path)
+                    self.stamp = self.shared_stamp()
+                except OSError as error:
+                    print('Invalidation of cache %s not shared: %s' % (
+                        self.name, error
+                    ))
+
+def clear_all():
+    """Clear all caches of this process, for example when the database
+    changes.
+    """
+    for cache in _caches:
+        with cache.lock:
+            cache.entries.clear()
+            cache.generation += 1
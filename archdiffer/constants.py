@@ -14,8 +14,18 @@ Created on Tue Feb 20 09:27:50 2018
 STATE_NEW = 0
 STATE_DONE = 1
 STATE_ERROR = -1
+STATE_CANCELLED = -2
+# Results of the comparison were moved to an archive and can be restored
+STATE_ARCHIVED = -3
 STATE_STRINGS = {
     STATE_NEW: 'new',
     STATE_DONE: 'done',
     STATE_ERROR: 'error',
+    STATE_CANCELLED: 'cancelled',
+    STATE_ARCHIVED: 'archived',
 }
+
+# Priorities of comparison requests; each priority has its own task queue
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
@@ -10,27 +10,57 @@ Created on Wed Apr  5 19:32:41 2017
 """
 
 import datetime
+import json
+import time
 import random
 import string
+import threading
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import (Column, Integer, String, DateTime, Date, ForeignKey,
-                        func)
-from sqlalchemy import create_engine
+from sqlalchemy import (Column, Integer, String, Text, DateTime, Date,
+                        ForeignKey, func, extract, text, event)
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm.session import Session
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from .config import config
 from .constants import STATE_NEW, STATE_STRINGS
+from . import metrics
+from . import engines
+from . import cache
 
 Base = declarative_base()
 
+def period_of(time):
+    """Get partition period of a time. Comparisons and their results are
+    partitioned by month of the comparison; the period is the year and month
+    as an integer YYYYMM.
+
+    :param datetime.datetime time: time
+    :return int: period
+    """
+    return time.year * 100 + time.month
+
+def current_period():
+    """Get SQL expression of the period of the current time. It is
+    evaluated by the database, so it agrees with times set by func.now().
+
+    :return: SQL expression
+    """
+    return extract('year', func.now()) * 100 + extract('month', func.now())
+
 class Comparison(Base):
     """Database model of comparisons."""
     __tablename__ = 'comparisons'
 
     id = Column(Integer, primary_key=True, nullable=False)
     # time is set when commited
-    time = Column(DateTime, default=func.now())
+    time = Column(DateTime, default=func.now(), index=True)
+    # partition key, see period_of; set from an explicit time before flush
+    # (see period_from_time), otherwise computed by the database together
+    # with the time
+    period = Column(
+        Integer, nullable=False, default=current_period(), index=True
+    )
     comparison_type_id = Column(
         Integer, ForeignKey('comparison_types.id'), nullable=False
     )
@@ -61,19 +91,24 @@ class Comparison(Base):
         ses.commit()
 
     @staticmethod
-    def add(ses, comparison_type_name, state=STATE_NEW):
+    def add(ses, comparison_type_name, state=STATE_NEW, commit=True):
         """Add new Comparison.
 
         :param ses: session for communication with the database
         :type ses: qlalchemy.orm.session.Session
         :param int comparison_type_name: name of its comparison_type
         :param int state: state
+        :param bool commit: if False, the Comparison is only flushed (to get
+            its id) and the caller commits the transaction
         :return Comparison: newly added Comparison
         """
         comp_type_id = ComparisonType.get_cache(ses)[comparison_type_name]
         comparison = Comparison(comparison_type_id=comp_type_id, state=state)
         ses.add(comparison)
-        ses.commit()
+        if commit:
+            ses.commit()
+        else:
+            ses.flush()
         return comparison
 
     @staticmethod
@@ -119,6 +154,20 @@ class Comparison(Base):
         }
         return result_dict
 
+@event.listens_for(Session, 'before_flush')
+def period_from_time(ses, flush_context, instances):
+    """Set partition period of new Comparisons with explicitly set time to
+    the period of that time. Without the time, both the time and the period
+    are evaluated by the database in the insert, so they agree too.
+
+    :param ses: session being flushed
+    :type ses: qlalchemy.orm.session.Session
+    """
+    for instance in ses.new:
+        if (isinstance(instance, Comparison) and instance.period is None and
+                isinstance(instance.time, datetime.datetime)):
+            instance.period = period_of(instance.time)
+
 class ComparisonType(Base):
     """Database model of comparison types."""
     __tablename__ = 'comparison_types'
@@ -128,21 +177,35 @@ class ComparisonType(Base):
 
     comparisons = relationship("Comparison", back_populates="comparison_type")
 
-    _cache = {}
+    _cache = cache.TTLCache('comparison_types')
 
     def __repr__(self):
         return "<ComparisonType(id='%s', name='%s')>" % (self.id, self.name)
 
     @staticmethod
     def make_cache(ses):
-        for comp_type in ComparisonType.query(ses).all():
-            ComparisonType._cache[comp_type.name] = comp_type.id
+        """Load ids of all comparison types.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :return dict: {name: id}
+        """
+        return {
+            comp_type.name: comp_type.id
+            for comp_type in ComparisonType.query(ses).all()
+        }
 
     @staticmethod
     def get_cache(ses):
-        if not ComparisonType._cache:
-            ComparisonType.make_cache(ses)
-        return ComparisonType._cache
+        """Get cached ids of all comparison types.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :return dict: {name: id}
+        """
+        return ComparisonType._cache.get(
+            'all', lambda: ComparisonType.make_cache(ses)
+        )
 
     @staticmethod
     def query(ses):
@@ -184,12 +247,14 @@ class User(Base):
     name = Column(String(255), nullable=False, unique=True)
 
     # For aunthentication in REST
-    api_login = Column(String(40))
+    api_login = Column(String(40), index=True)
     api_token = Column(String(40))
     api_token_expiration = Column(
         Date, nullable=False, default=datetime.date(2000, 1, 1)
     )
 
+    _cache = cache.TTLCache('users')
+
     def __repr__(self):
         return ("<User(openid='%s', name='%s', api_login='%s', "
                 "api_token='%s', api_token_expiration='%s')>") % (
@@ -219,6 +284,7 @@ class User(Base):
         )
         ses.add(self)
         ses.commit()
+        User._cache.invalidate()
 
     @staticmethod
     def query(ses, openid=None, name=None, api_login=None):
@@ -240,6 +306,35 @@ class User(Base):
         else:
             return None
 
+    @staticmethod
+    def cached(ses, openid=None, api_login=None):
+        """Get User by openid or api_login from the cache. The cached User is
+        merged into the session without querying the database.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param string openid: openid
+        :param string api_login: api_login
+        :return User: user or None
+        """
+        if openid is not None:
+            key = ('openid', openid)
+        elif api_login is not None:
+            key = ('api_login', api_login)
+        else:
+            return None
+
+        def load():
+            user = User.query(ses, openid=openid, api_login=api_login)
+            if user is not None:
+                ses.expunge(user)
+            return user
+
+        user = User._cache.get(key, load)
+        if user is None:
+            return None
+        return ses.merge(user, load=False)
+
     @staticmethod
     def add(ses, openid, name):
         """Add user to the database if it doesn't already exist.
@@ -260,9 +355,230 @@ class User(Base):
             user = None
         return user
 
+class RevokedToken(Base):
+    """Database model of revoked REST API tokens. They are kept until their
+    expiration.
+    """
+    __tablename__ = 'revoked_tokens'
+
+    # api_token of the User the token was signed with
+    token_id = Column(String(40), primary_key=True, nullable=False)
+    expiration = Column(Date, nullable=False)
+
+    def __repr__(self):
+        return "<RevokedToken(token_id='%s', expiration='%s')>" % (
+            self.token_id, self.expiration
+        )
+
+    @staticmethod
+    def add(ses, token_id, expiration):
+        """Revoke token and remove expired revoked tokens. The session is not
+        committed.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param string token_id: id of the token
+        :param datetime.date expiration: expiration of the token
+        """
+        ses.query(RevokedToken).filter(
+            RevokedToken.expiration < datetime.date.today()
+        ).delete(synchronize_session=False)
+        ses.merge(RevokedToken(token_id=token_id, expiration=expiration))
+
+    @staticmethod
+    def ids(ses):
+        """Get ids of revoked tokens that haven't expired yet.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :return frozenset: ids
+        """
+        return frozenset(
+            token_id for token_id, in ses.query(RevokedToken.token_id).filter(
+                RevokedToken.expiration >= datetime.date.today()
+            )
+        )
+
+class OutboxTask(Base):
+    """Database model of tasks waiting to be sent to the message broker.
+
+    Tasks are added in the same transaction as the data they refer to and
+    sent by the outbox dispatcher after the transaction is committed.
+    """
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    name = Column(String(255), nullable=False)
+    # JSON encoded task arguments and options of send_task
+    args = Column(Text, nullable=False)
+    options = Column(Text, nullable=False)
+    created = Column(
+        DateTime, nullable=False, default=datetime.datetime.utcnow
+    )
+
+    def __repr__(self):
+        return "<OutboxTask(id='%s', name='%s', args='%s', options='%s')>" % (
+            self.id, self.name, self.args, self.options
+        )
+
+    @staticmethod
+    def add(ses, name, args=(), **options):
+        """Add task to the outbox. The session is not committed.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param string name: task name
+        :param tuple args: task arguments (must be JSON serializable)
+        :param **options: options passed to send_task (for example queue)
+        :return OutboxTask: newly added OutboxTask
+        """
+        task = OutboxTask(
+            name=name, args=json.dumps(list(args)), options=json.dumps(options)
+        )
+        ses.add(task)
+        return task
+
+    def send_task_arguments(self):
+        """Get arguments of send_task for this task.
+
+        :return tuple: tuple (task name, args, options dict)
+        """
+        return (self.name, tuple(json.loads(self.args)),
+                json.loads(self.options))
+
+# Queries of replication lag in seconds by dialect; a replica that has
+# replayed everything it received has no lag
+LAG_QUERIES = {
+    'postgresql': (
+        "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()"
+        " THEN 0 ELSE EXTRACT(EPOCH FROM"
+        " now() - pg_last_xact_replay_timestamp()) END"
+    ),
+    'mysql': "SHOW SLAVE STATUS",
+}
+
+replica_lag_seconds = metrics.Gauge(
+    'archdiffer_replica_lag_seconds',
+    'Replication lag of read replicas (+Inf if unavailable).',
+)
+replica_sessions = metrics.Counter(
+    'archdiffer_replica_sessions_total',
+    'Count of read sessions by database they were bound to.',
+)
+open_sessions = metrics.Gauge(
+    'archdiffer_task_sessions_open',
+    'Count of open sessions of units of work.',
+)
+checkpoints = metrics.Counter(
+    'archdiffer_task_checkpoints_total',
+    'Count of commits at checkpoints of units of work.',
+)
+
+def replica_lag(engine):
+    """Measure replication lag of the replica.
+
+    :param sqlalchemy.engine.Engine engine: engine of the replica
+    :return float: lag in seconds (0 if the database doesn't report it) or
+        None if the replica is unavailable
+    """
+    query = LAG_QUERIES.get(engine.dialect.name)
+    try:
+        with engine.connect() as connection:
+            if query is None:
+                connection.execute(text('SELECT 1'))
+                return 0.0
+            row = connection.execute(text(query)).first()
+    except SQLAlchemyError as error:
+        print('Replica %s unavailable: %s' % (engine.url, error))
+        return None
+    if row is None:
+        return 0.0
+    if engine.dialect.name == 'mysql':
+        lag = row['Seconds_Behind_Master']
+    else:
+        lag = row[0]
+    return float(lag) if lag is not None else 0.0
+
+class ReplicaPool():
+    """Engines of read replicas used in turns. Replicas that are unavailable
+    or lag behind the primary more than max_lag are skipped. The lag is
+    measured by a background thread, so that requests never wait for it."""
+    def __init__(self, urls, max_lag=30, lag_interval=5):
+        """Create engines of the replicas; the thread measuring their lag is
+        started with the first lookup, until then the replicas are not used.
+
+        :param list urls: database URLs of the replicas
+        :param float max_lag: maximal lag of a used replica in seconds
+        :param float lag_interval: how often the lag of each replica is
+            measured in seconds
+        """
+        self.engines = [
+            engines.create(url, name=make_url(url).host or str(index))
+            for index, url in enumerate(urls)
+        ]
+        self.max_lag = max_lag
+        self.lag_interval = lag_interval
+        self.lags = [None] * len(self.engines)
+        self.next = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def refresh(self):
+        """Measure lag of all the replicas."""
+        for index, replica_engine in enumerate(self.engines):
+            lag = replica_lag(replica_engine)
+            with self.lock:
+                self.lags[index] = lag
+            replica_lag_seconds.set(
+                float('inf') if lag is None else lag,
+                replica=replica_engine.url.host or str(index),
+            )
+
+    def run(self):
+        """Measure the lag until the pool is disposed."""
+        while not self.stopped.is_set():
+            self.refresh()
+            self.stopped.wait(self.lag_interval)
+
+    def engine(self):
+        """Get engine of the next usable replica, by the last measured lag.
+
+        :return sqlalchemy.engine.Engine: engine or None if no replica is
+            usable
+        """
+        with self.lock:
+            if self.thread is None and self.engines:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            for _ in range(len(self.engines)):
+                index = self.next
+                self.next = (self.next + 1) % len(self.engines)
+                lag = self.lags[index]
+                if lag is not None and lag <= self.max_lag:
+                    return self.engines[index]
+        return None
+
+    def after_fork(self):
+        """Stop using connections and the thread inherited from the parent
+        process."""
+        for replica_engine in self.engines:
+            engines.dispose_after_fork(replica_engine)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def dispose(self):
+        """Stop measuring the lag and dispose engines of the replicas."""
+        self.stopped.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+        for replica_engine in self.engines:
+            replica_engine.dispose()
+
 class SessionSingleton():
     """Singleton that provides sqlalchemy engine and creates sessions."""
     engine = None
+    replicas = None
 
     @staticmethod
     def init(force_new=False):
@@ -272,14 +588,42 @@ class SessionSingleton():
             engine; this option should only be used for testing purposes
         """
         if SessionSingleton.engine is None or force_new:
-            SessionSingleton.engine = create_engine(
-                config['common']['DATABASE_URL'], echo=True
+            SessionSingleton.engine = engines.create(
+                config['common']['DATABASE_URL']
+            )
+            if SessionSingleton.replicas is not None:
+                SessionSingleton.replicas.dispose()
+            SessionSingleton.replicas = ReplicaPool(
+                [
+                    url.strip() for url in config.get(
+                        'common', 'READ_REPLICA_URLS', fallback=''
+                    ).split(',') if url.strip()
+                ],
+                max_lag=config.getfloat(
+                    'common', 'REPLICA_MAX_LAG', fallback=30
+                ),
+                lag_interval=config.getfloat(
+                    'common', 'REPLICA_LAG_INTERVAL', fallback=5
+                ),
             )
+            # Cached data may belong to another database
+            cache.clear_all()
 
     @staticmethod
     def deinit():
         """Force reloading engine."""
+        if SessionSingleton.replicas is not None:
+            SessionSingleton.replicas.dispose()
         SessionSingleton.engine = None
+        SessionSingleton.replicas = None
+
+    @staticmethod
+    def after_fork():
+        """Stop using connections inherited from the parent process."""
+        if SessionSingleton.engine is None:
+            return
+        engines.dispose_after_fork(SessionSingleton.engine)
+        SessionSingleton.replicas.after_fork()
 
     @staticmethod
     def get_engine(force_new=False):
@@ -302,6 +646,24 @@ class SessionSingleton():
         """
         return Session(*args, bind=SessionSingleton.get_engine(), **kwargs)
 
+    @staticmethod
+    def get_read_session(*args, **kwargs):
+        """Create new session bound to a read replica, or to the primary if
+        no replica is usable.
+
+        :param *args: arguments to be passed when creating session
+        :param **kwargs: keyword arguments to be passed when creating session
+        :return sqlalchemy.orm.session.Session: session
+        """
+        SessionSingleton.init()
+        bind = SessionSingleton.replicas.engine()
+        if bind is None:
+            replica_sessions.inc(database='primary')
+            bind = SessionSingleton.engine
+        else:
+            replica_sessions.inc(database='replica')
+        return Session(*args, bind=bind, **kwargs)
+
 def engine(force_new=False):
     """Get the engine.
 
@@ -320,6 +682,53 @@ def session(*args, **kwargs):
     """
     return SessionSingleton.get_session(*args, **kwargs)
 
+def read_session(*args, **kwargs):
+    """Get new session for reading only; it may see data a few seconds old.
+
+    :param *args: arguments to be passed when creating session
+    :param **kwargs: keyword arguments to be passed when creating session
+    :return sqlalchemy.orm.session.Session: session
+    """
+    return SessionSingleton.get_read_session(*args, **kwargs)
+
+class UnitOfWork():
+    """Session of one task, used as context manager. Work is committed at
+    checkpoints; on failure the uncommitted work is rolled back. The session
+    is always closed at the end, so that a worker process running many tasks
+    doesn't keep their connections and objects.
+    """
+    def __init__(self, *args, **kwargs):
+        """Save arguments of the session.
+
+        :param *args: arguments to be passed when creating session
+        :param **kwargs: keyword arguments to be passed when creating session
+        """
+        self.args = args
+        self.kwargs = kwargs
+        self.session = None
+
+    def __enter__(self):
+        self.session = session(*self.args, **self.kwargs)
+        open_sessions.inc()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None:
+                self.session.rollback()
+        finally:
+            self.session.close()
+            self.session = None
+            open_sessions.dec()
+
+    def checkpoint(self):
+        """Commit the work done so far and remove all objects from the
+        session; objects loaded before the checkpoint can't be used after it.
+        """
+        self.session.commit()
+        self.session.expunge_all()
+        checkpoints.inc()
+
 def modify_query(query, modifiers):
     """Modify query according to the modifiers.
 
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .config import config
+from . import metrics
+
+# Embedded single-node mode: tasks sent by the frontend are run by a local
+# pool of processes instead of being sent to the broker, so neither the
+# broker nor a separate worker is needed.
+EMBEDDED = config.getboolean('common', 'EMBEDDED', fallback=False)
+# Count of processes of the pool
+EMBEDDED_WORKERS = config.getint('common', 'EMBEDDED_WORKERS', fallback=2)
+
+embedded_tasks = metrics.Counter(
+    'archdiffer_embedded_tasks_total',
+    'Count of tasks run by the embedded executor by task and state.',
+)
+embedded_pending = metrics.Gauge(
+    'archdiffer_embedded_pending_tasks',
+    'Count of tasks waiting or running in the embedded executor.',
+)
+
+def init_worker():
+    """Prepare a process of the pool like a celery worker process: load the
+    worker plugins and send the worker_process_init signal. Tasks sent by
+    tasks are run at once in the same process.
+    """
+    from celery.signals import worker_process_init
+    from .backend import celery_app
+    celery_app.conf.task_always_eager = True
+    worker_process_init.send(sender=None)
+
+def run_task(name, args, kwargs):
+    """Run the task in a process of the pool.
+
+    :param string name: task name
+    :param tuple args: task arguments
+    :param dict kwargs: task keyword arguments
+    :return string: state of the task
+    """
+    from .backend import celery_app
+    result = celery_app.tasks[name].apply(args=args, kwargs=kwargs)
+    if result.failed():
+        print('Task %s failed: %r' % (name, result.result))
+    return result.state
+
+class Executor():
+    """Runs tasks by their names in a local pool of processes. Queues and
+    priorities are not distinguished; tasks are run in the order they were
+    submitted.
+    """
+    def __init__(self, workers=EMBEDDED_WORKERS):
+        """Create the executor; the pool is started with the first task.
+
+        :param int workers: count of processes of the pool
+        """
+        self.workers = workers
+        self.pool = None
+        self.pending = 0
+        self.lock = threading.Lock()
+        embedded_pending.set_function(lambda: self.pending)
+
+    def new_pool(self):
+        """Start new pool of processes. Processes are spawned, not forked,
+        so that they don't inherit threads and connections of the frontend.
+
+        :return ProcessPoolExecutor: pool
+        """
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+        )
+
+    def submit(self, name, args=(), kwargs=None):
+        """Submit the task to the pool.
+
+        :param string name: task name
+        :param tuple args: task arguments
+        :param dict kwargs: task keyword arguments
+        :return concurrent.futures.Future: future of the state of the task
+        """
+        args = tuple(args)
+        kwargs = kwargs or {}
+        with self.lock:
+            if self.pool is None:
+                self.pool = self.new_pool()
+            try:
+                future = self.pool.submit(run_task, name, args, kwargs)
+            except BrokenProcessPool:
+                # A process of the pool died (for example was killed), the
+                # pool accepts no more tasks
+                print('Embedded executor pool is broken, starting new one.')
+                self.pool.shutdown(wait=False)
+                self.pool = self.new_pool()
+                future = self.pool.submit(run_task, name, args, kwargs)
+            self.pending += 1
+        future.add_done_callback(functools.partial(self.done, name))
+        return future
+
+    def done(self, name, future):
+        """Count the finished task.
+
+        :param string name: task name
+        :param concurrent.futures.Future future: future of the task
+        """
+        with self.lock:
+            self.pending -= 1
+        if future.cancelled():
+            state = 'REVOKED'
+        elif future.exception() is not None:
+            print('Task %s was not run: %s' % (name, future.exception()))
+            state = 'FAILURE'
+        else:
+            state = future.result()
+        embedded_tasks.inc(task=name, state=state)
+
+    def shutdown(self, wait=True):
+        """Stop the pool.
+
+        :param bool wait: wait until all submitted tasks are finished
+        """
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+executor = Executor()
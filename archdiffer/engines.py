@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import random
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine.url import make_url
+from .config import config
+from . import metrics
+
+# Connection pool (not used for SQLite)
+POOL_SIZE = config.getint('common', 'POOL_SIZE', fallback=5)
+POOL_MAX_OVERFLOW = config.getint('common', 'POOL_MAX_OVERFLOW', fallback=10)
+POOL_TIMEOUT = config.getfloat('common', 'POOL_TIMEOUT', fallback=30)
+POOL_RECYCLE = config.getint('common', 'POOL_RECYCLE', fallback=3600)
+POOL_PRE_PING = config.getboolean('common', 'POOL_PRE_PING', fallback=True)
+# Maximal duration of one statement in milliseconds (0 means no limit)
+STATEMENT_TIMEOUT = config.getint('common', 'STATEMENT_TIMEOUT', fallback=0)
+# Log all statements, or only this fraction of them with their durations
+SQL_ECHO = config.getboolean('common', 'SQL_ECHO', fallback=False)
+SQL_ECHO_SAMPLE_RATE = config.getfloat(
+    'common', 'SQL_ECHO_SAMPLE_RATE', fallback=0
+)
+# SQLite pragmas set on each connection: journal mode (WAL lets readers
+# work while one process writes), how long to wait for a locked database in
+# milliseconds and synchronous mode (empty values are not set)
+SQLITE_JOURNAL_MODE = config.get(
+    'common', 'SQLITE_JOURNAL_MODE', fallback='WAL'
+)
+SQLITE_BUSY_TIMEOUT = config.getint(
+    'common', 'SQLITE_BUSY_TIMEOUT', fallback=5000
+)
+SQLITE_SYNCHRONOUS = config.get(
+    'common', 'SQLITE_SYNCHRONOUS', fallback='NORMAL'
+)
+
+# Statements setting the statement timeout (in milliseconds) by dialect
+TIMEOUT_STATEMENTS = {
+    'postgresql': 'SET statement_timeout = %d',
+    'mysql': 'SET SESSION max_execution_time = %d',
+}
+
+pool_size = metrics.Gauge(
+    'archdiffer_db_pool_size',
+    'Count of connections kept in the database connection pool.',
+)
+pool_checked_out = metrics.Gauge(
+    'archdiffer_db_pool_checked_out',
+    'Count of connections of the pool in use.',
+)
+pool_overflow = metrics.Gauge(
+    'archdiffer_db_pool_overflow',
+    'Count of connections opened over the size of the pool.',
+)
+pool_checkouts = metrics.Counter(
+    'archdiffer_db_pool_checkouts_total',
+    'Count of connections taken from the pool.',
+)
+
+# Connections and pools inherited from the parent process. They are kept
+# referenced, so that they are never closed - closing them would end the
+# database sessions of the parent.
+_inherited = []
+
+def engine_options(url):
+    """Get keyword arguments of create_engine from the config.
+
+    :param string url: database URL
+    :return dict: keyword arguments
+    """
+    options = {'echo': SQL_ECHO}
+    if make_url(url).get_backend_name() != 'sqlite':
+        options.update(
+            pool_size=POOL_SIZE,
+            max_overflow=POOL_MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+            pool_pre_ping=POOL_PRE_PING,
+        )
+    return options
+
+def set_statement_timeout(engine, timeout):
+    """Set the statement timeout on each new connection of the engine.
+
+    :param sqlalchemy.engine.Engine engine: engine
+    :param int timeout: timeout in milliseconds
+    """
+    statement = TIMEOUT_STATEMENTS.get(engine.dialect.name)
+    if statement is None:
+        print('Statement timeout is not supported by %s.' %
+              engine.dialect.name)
+        return
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(statement % timeout)
+        cursor.close()
+
+def sqlite_pragmas():
+    """Get SQLite pragmas from the config.
+
+    :return list: list of PRAGMA statements
+    """
+    pragmas = []
+    if SQLITE_JOURNAL_MODE:
+        pragmas.append('PRAGMA journal_mode = %s' % SQLITE_JOURNAL_MODE)
+    if SQLITE_BUSY_TIMEOUT > 0:
+        pragmas.append('PRAGMA busy_timeout = %d' % SQLITE_BUSY_TIMEOUT)
+    if SQLITE_SYNCHRONOUS:
+        pragmas.append('PRAGMA synchronous = %s' % SQLITE_SYNCHRONOUS)
+    return pragmas
+
+def tune_sqlite(engine, pragmas):
+    """Execute the pragmas on each new connection of the engine.
+
+    :param sqlalchemy.engine.Engine engine: engine
+    :param list pragmas: PRAGMA statements
+    """
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+def sample_statements(engine, sample_rate):
+    """Print the sampled fraction of statements with their durations.
+
+    :param sqlalchemy.engine.Engine engine: engine
+    :param float sample_rate: fraction of printed statements
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context,
+                       executemany):
+        if context is not None and random.random() < sample_rate:
+            context.sampled_started = time.monotonic()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context,
+                      executemany):
+        started = getattr(context, 'sampled_started', None)
+        if started is not None:
+            print('SQL (%.3f s): %s %r' % (
+                time.monotonic() - started, statement, parameters
+            ))
+
+def protect_from_fork(engine):
+    """Never use connections inherited from the parent process; they are
+    replaced by new ones at checkout.
+
+    :param sqlalchemy.engine.Engine engine: engine
+    """
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_checkouts.inc()
+        if connection_record.info['pid'] != os.getpid():
+            _inherited.append(connection_record.connection)
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError(
+                'Connection record belongs to pid %s, attempting to check '
+                'out in pid %s' % (connection_record.info['pid'], os.getpid())
+            )
+
+def watch_pool(engine, name):
+    """Export utilization of the engine's connection pool.
+
+    :param sqlalchemy.engine.Engine engine: engine
+    :param string name: name of the database in the metrics labels
+    """
+    if not hasattr(engine.pool, 'checkedout'):
+        return
+    pool_size.set_function(lambda: engine.pool.size(), database=name)
+    pool_checked_out.set_function(
+        lambda: engine.pool.checkedout(), database=name
+    )
+    pool_overflow.set_function(
+        lambda: max(engine.pool.overflow(), 0), database=name
+    )
+
+def create(url, name='primary'):
+    """Create engine configured by the config file.
+
+    :param string url: database URL
+    :param string name: name of the database in the metrics labels
+    :return sqlalchemy.engine.Engine: engine
+    """
+    engine = create_engine(url, **engine_options(url))
+    if STATEMENT_TIMEOUT > 0:
+        set_statement_timeout(engine, STATEMENT_TIMEOUT)
+    if engine.dialect.name == 'sqlite':
+        tune_sqlite(engine, sqlite_pragmas())
+    if SQL_ECHO_SAMPLE_RATE > 0 and not SQL_ECHO:
+        sample_statements(engine, SQL_ECHO_SAMPLE_RATE)
+    protect_from_fork(engine)
+    watch_pool(engine, name)
+    return engine
+
+def dispose_after_fork(engine):
+    """Give the engine a new connection pool in a forked process. Unlike
+    engine.dispose(), connections of the old pool are not closed.
+
+    :param sqlalchemy.engine.Engine engine: engine
+    """
+    _inherited.append(engine.pool)
+    engine.pool = engine.pool.recreate()
@@ -13,4 +13,4 @@ from .flask_app import flask_app
 from ..repository import load_plugins_flask_frontends
 from . import common_views, database_views, login_views, rest_api_views
 
-load_plugins_flask_frontends()
+load_plugins_flask_frontends(lazy=common_views.LAZY_PLUGINS)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import hmac
+import json
+import base64
+import hashlib
+import datetime
+from flask import g
+from .flask_app import flask_app
+from ..config import config
+from ..cache import TTLCache
+from ..database import RevokedToken
+
+# How long is the list of revoked tokens cached, in seconds
+TOKEN_REVOCATION_TTL = config.getfloat(
+    'web', 'TOKEN_REVOCATION_TTL', fallback=30
+)
+
+# Signed REST API tokens carry the user and the expiration signed by HMAC with
+# the SECRET_KEY, so they are verified without the database; only the list of
+# revoked tokens is loaded, and it is cached.
+revoked_cache = TTLCache('revoked_api_tokens', ttl=TOKEN_REVOCATION_TTL)
+
+def _encode(data):
+    """Encode bytes by URL safe base64 without padding."""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _decode(text):
+    """Decode URL safe base64 without padding."""
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _signature(body):
+    """Get signature of the token body.
+
+    :param string body: encoded claims
+    :return string: encoded signature
+    """
+    key = flask_app.config['SECRET_KEY'].encode('utf-8')
+    return _encode(hmac.new(
+        key, b'api-token:' + body.encode('ascii'), hashlib.sha256
+    ).digest())
+
+def is_signed(token):
+    """Find out if the token has the signed format (older tokens are only
+    stored in the database).
+
+    :param string token: token
+    :return bool: True if signed
+    """
+    return '.' in token
+
+def sign(user):
+    """Make signed token of the user's current api_token.
+
+    :param user: User (or SignedUser) with an api_token
+    :return string: token
+    """
+    claims = {
+        'id': user.api_token,
+        'login': user.api_login,
+        'openid': user.openid,
+        'name': user.name,
+        'expires': user.api_token_expiration.isoformat(),
+    }
+    body = _encode(
+        json.dumps(claims, sort_keys=True, separators=(',', ':')).encode(
+            'utf-8'
+        )
+    )
+    return '%s.%s' % (body, _signature(body))
+
+def revoked_ids():
+    """Get cached ids of revoked tokens.
+
+    :return frozenset: ids
+    """
+    return revoked_cache.get('ids', lambda: RevokedToken.ids(g.db_session))
+
+def verify(api_login, token, today=None):
+    """Verify the signed token.
+
+    :param string api_login: login the token was sent with
+    :param string token: token
+    :param datetime.date today: current date
+    :return dict: claims of the token, or None if it isn't valid (also if
+        it is malformed)
+    """
+    body, _, signature = token.partition('.')
+    try:
+        body.encode('ascii')
+    except UnicodeEncodeError:
+        return None
+    if not hmac.compare_digest(
+            signature.encode('utf-8'), _signature(body).encode('ascii')
+    ):
+        return None
+    try:
+        claims = json.loads(_decode(body).decode('utf-8'))
+        expires = datetime.datetime.strptime(
+            claims['expires'], '%Y-%m-%d'
+        ).date()
+    except (ValueError, KeyError, TypeError):
+        return None
+    if today is None:
+        today = datetime.date.today()
+    if claims['login'] != api_login or expires < today:
+        return None
+    if claims['id'] in revoked_ids():
+        return None
+    return claims
+
+def revoke(ses, user):
+    """Revoke the current token of the user. The session is not committed;
+    call revoked_cache.invalidate() after the commit.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param user: User (or SignedUser)
+    """
+    if user.api_token:
+        RevokedToken.add(ses, user.api_token, user.api_token_expiration)
@@ -9,10 +9,54 @@ Created on Wed Aug 30 14:55:56 2017
 @author: Pavla Kratochvilova <pavla.kratochvilova@gmail.com>
 """
 
-from flask import render_template, url_for, g
-from .flask_app import flask_app
+import os
+import time
+import atexit
+import tempfile
+import base64
+import hashlib
+import threading
+from flask import render_template, url_for, g, Response, request, abort
+from flask import session as flask_session
+from .flask_app import flask_app, lazy_global
+from ..config import config
 from ..database import session as db_session
+from ..database import read_session as db_read_session
 from ..database import ComparisonType
+from .. import metrics
+from .. import repository
+from .. import cache
+from . import outbox
+
+# Reading requests of a client go to the primary database for this count of
+# seconds after its last writing request, so that it sees its own changes
+READ_PRIMARY_AFTER_WRITE = config.getfloat(
+    'web', 'READ_PRIMARY_AFTER_WRITE', fallback=10
+)
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Request header by which a client asks for reading from the primary
+READ_PRIMARY_HEADER = 'X-Read-Primary'
+# Import plugins at the first request to them instead of at startup. Not used
+# in debug mode, where blueprints can't be registered after the first request.
+LAZY_PLUGINS = (config.getboolean('web', 'LAZY_PLUGINS', fallback=False)
+                and not flask_app.debug)
+# Serve metrics of all web server processes at /metrics to the clients from
+# METRICS_ALLOWED addresses
+METRICS = config.getboolean('web', 'METRICS', fallback=False)
+METRICS_ALLOWED = [
+    address.strip() for address in config.get(
+        'web', 'METRICS_ALLOWED', fallback='127.0.0.1,::1'
+    ).split(',') if address.strip()
+]
+# Directory where web server processes dump their metrics
+METRICS_DIR = config.get(
+    'web', 'METRICS_DIR',
+    fallback=os.path.join(tempfile.gettempdir(), 'archdiffer-web-metrics'),
+)
+# How often do web server processes dump their metrics, in seconds
+METRICS_DUMP_INTERVAL = config.getfloat(
+    'web', 'METRICS_DUMP_INTERVAL', fallback=5
+)
 
 def my_render_template(html, **arguments):
     """Call render_template with comparison_types as one of the arguments.
@@ -25,16 +69,171 @@ def my_render_template(html, **arguments):
     )
     return render_template(html, **arguments)
 
-@flask_app.before_request
+def basic_auth():
+    """Get credentials of the REST API from the Authorization header.
+
+    :return tuple: tuple (api_login, token), or (None, None) if the header
+        is missing or malformed
+    """
+    try:
+        base64string = request.headers["Authorization"].split()[1].strip()
+        userstring = base64.b64decode(base64string)
+        (api_login, token) = userstring.decode("utf-8").split(":")
+    except Exception:
+        return None, None
+    return api_login, token
+
+def client_key():
+    """Identify the client across sessions: by its REST API login or by the
+    openid of the logged in user. The login is not verified, it only
+    decides where the client reads from.
+
+    :return string: key or None if the client is anonymous
+    """
+    api_login, _ = basic_auth()
+    if api_login:
+        return 'api_login:' + api_login
+    if flask_session.get('openid'):
+        return 'openid:' + flask_session['openid']
+    return None
+
+class PrimaryPins():
+    """Times until which reads of clients go to the primary database. Pins
+    are shared by the processes of the host through files in the shared
+    directory, if given; otherwise kept by this process only.
+    """
+    def __init__(self, shared_dir=None):
+        """Create pins.
+
+        :param string shared_dir: directory shared by the processes of the
+            host; defaults to CACHE_SHARED_DIR
+        """
+        if shared_dir is None:
+            shared_dir = cache.CACHE_SHARED_DIR
+        self.directory = (
+            os.path.join(shared_dir, 'primary') if shared_dir else None
+        )
+        self.until = {}
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        """Get path of the file of the client's pin.
+
+        :param string key: client key
+        :return string: path
+        """
+        return os.path.join(
+            self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest()
+        )
+
+    def pin(self, key, until):
+        """Pin reads of the client to the primary.
+
+        :param string key: client key
+        :param float until: time (as time.time()) of the end of the pin
+        """
+        if self.directory is not None:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(self.path(key), 'a'):
+                    pass
+                os.utime(self.path(key), (until, until))
+                return
+            except OSError as error:
+                print('Pin to primary not shared: %s' % error)
+        now = time.time()
+        with self.lock:
+            self.until = {
+                other: other_until for other, other_until in self.until.items()
+                if other_until > now
+            }
+            self.until[key] = until
+
+    def pinned(self, key):
+        """Check if reads of the client are pinned to the primary.
+
+        :param string key: client key
+        :return bool: True if pinned
+        """
+        now = time.time()
+        if self.directory is not None:
+            try:
+                if os.stat(self.path(key)).st_mtime > now:
+                    return True
+            except OSError:
+                pass
+        with self.lock:
+            return self.until.get(key, 0) > now
+
+primary_pins = PrimaryPins()
+
+def reads_from_replica():
+    """Decide if the current request can be served from a read replica. It
+    has to be a reading request of a view with replica_reads set, the client
+    must not ask for the primary by the READ_PRIMARY_HEADER and must not
+    have written recently (by its session cookie, REST API login or logged
+    in user).
+
+    :return bool: True if the request can use a replica
+    """
+    if request.method not in SAFE_METHODS:
+        return False
+    view = flask_app.view_functions.get(request.endpoint)
+    view = getattr(view, 'view_class', view)
+    if not getattr(view, 'replica_reads', False):
+        return False
+    if request.headers.get(READ_PRIMARY_HEADER, '').lower() in (
+            '1', 'true', 'yes'):
+        return False
+    if flask_session.get('primary_until', 0) > time.time():
+        return False
+    key = client_key()
+    return key is None or not primary_pins.pinned(key)
+
+@lazy_global('db_session')
 def new_database_session():
-    """Get new database session for each request."""
-    g.db_session = db_session()
+    """Get new database session at its first use in the request."""
+    if reads_from_replica():
+        return db_read_session()
+    return db_session()
+
+@flask_app.after_request
+def pin_to_primary(response):
+    """Remember the time of the client's write in its session, and by its
+    REST API login or logged in user for clients without cookies."""
+    if (request.method not in SAFE_METHODS and response.status_code < 400
+            and READ_PRIMARY_AFTER_WRITE > 0):
+        until = time.time() + READ_PRIMARY_AFTER_WRITE
+        flask_session['primary_until'] = until
+        key = client_key()
+        if key is not None:
+            primary_pins.pin(key, until)
+    return response
+
+@flask_app.before_first_request
+def start_outbox_dispatcher():
+    """Start sending tasks left in the outbox by previous runs."""
+    outbox.dispatcher.wake()
+
+@flask_app.before_first_request
+def start_metrics_dumping():
+    """Dump metrics of this process periodically and at its exit, so that
+    any process can serve metrics of all of them."""
+    if not METRICS:
+        return
+    threading.Thread(
+        target=metrics.dump_periodically,
+        args=(METRICS_DIR, METRICS_DUMP_INTERVAL),
+        daemon=True,
+    ).start()
+    atexit.register(metrics.dump_process, METRICS_DIR)
 
 @flask_app.teardown_request
 def close_database_session(exception):
-    """Commit and close database session at the end of request."""
-    ses = getattr(g, 'db_session', None)
-    if ses is not None:
+    """Commit and close database session at the end of request, if it was
+    used."""
+    if 'db_session' in g:
+        ses = g.db_session
         try:
             ses.commit()
         except:
@@ -48,8 +247,41 @@ def comparison_type_unavailable(comparison_type):
         'comparison_type_unavailable.html', comparison_type=comparison_type
     )
 
+@flask_app.route('/metrics')
+def show_metrics():
+    """Show merged metrics of the web server processes in the Prometheus
+    text format."""
+    if not METRICS:
+        abort(404)
+    if request.remote_addr not in METRICS_ALLOWED:
+        abort(403)
+    return Response(
+        metrics.render_processes(METRICS_DIR),
+        mimetype='text/plain; version=0.0.4',
+    )
+
+class PluginLoader():
+    """WSGI middleware importing a lazily registered plugin before the
+    first request to its URL prefix.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        name = environ.get('PATH_INFO', '').lstrip('/').split('/', 1)[0]
+        if name in repository.lazy_flask_frontends:
+            repository.load_plugin_flask_frontend(name)
+        return self.wsgi_app(environ, start_response)
+
+if LAZY_PLUGINS:
+    flask_app.wsgi_app = PluginLoader(flask_app.wsgi_app)
+
 def external_url_handler(error, endpoint, values):
     "Looks up an external URL when `url_for` cannot build a URL."
+    name = endpoint.split('.', 1)[0]
+    if name in repository.lazy_flask_frontends:
+        if repository.load_plugin_flask_frontend(name) is not None:
+            return url_for(endpoint, **values)
     for comparison_type in ComparisonType.get_cache(g.db_session).keys():
         if endpoint.startswith(comparison_type):
             return url_for(
@@ -24,7 +24,7 @@ def openid_providers():
 
 class FlaskConfig(object):
     """Flask config created from the main config."""
-    DEBUG = config['web']['DEBUG']
+    DEBUG = config.getboolean('web', 'DEBUG')
     SECRET_KEY = config['web']['SECRET_KEY']
     OPENID_FS_STORE_PATH = config['web']['OPENID_FS_STORE_PATH']
     API_TOKEN_LENGTH = int(config['web']['API_TOKEN_LENGTH'])
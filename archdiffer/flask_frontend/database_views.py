@@ -77,6 +77,8 @@ class TableList(Resource):
     """List of items of given table."""
     table = None
     filters = None
+    # reading requests may be served from a read replica
+    replica_reads = True
     default_modifiers = {
         'limit': 100,
         'offset': 0,
@@ -43,9 +43,18 @@ def comparisons(prefix='comparison_'):
             name=prefix + 'state',
             function=(lambda x: get_first_key(constants.STATE_STRINGS, x))
         ),
-        **request_parser.time(Comparison.time, name=prefix + 'time'),
-        **request_parser.before(Comparison.time, name=prefix + 'before'),
-        **request_parser.after(Comparison.time, name=prefix + 'after'),
+        **request_parser.time(
+            Comparison.time, name=prefix + 'time',
+            period_column=Comparison.period,
+        ),
+        **request_parser.before(
+            Comparison.time, name=prefix + 'before',
+            period_column=Comparison.period,
+        ),
+        **request_parser.after(
+            Comparison.time, name=prefix + 'after',
+            period_column=Comparison.period,
+        ),
     )
     return filters
 
@@ -10,9 +10,41 @@ Created on Sun Sep 10 10:36:51 2017
 """
 
 from flask import Flask
+from flask.ctx import _AppCtxGlobals
 from flask_restful import Api
 from .config import FlaskConfig
 
+class LazyGlobals(_AppCtxGlobals):
+    """Globals of a request (flask.g). Attributes with a registered loader
+    are loaded at their first use, so requests not using them don't pay for
+    them.
+    """
+    loaders = {}
+
+    def __getattr__(self, name):
+        loader = LazyGlobals.loaders.get(name)
+        if loader is None:
+            raise AttributeError(name)
+        value = loader()
+        setattr(self, name, value)
+        return value
+
+    def get(self, name, default=None):
+        if name in self.__dict__ or name not in LazyGlobals.loaders:
+            return self.__dict__.get(name, default)
+        return getattr(self, name)
+
+def lazy_global(name):
+    """Register the decorated function as loader of the attribute of g.
+
+    :param string name: name of the attribute
+    """
+    def register(loader):
+        LazyGlobals.loaders[name] = loader
+        return loader
+    return register
+
 flask_app = Flask(__name__)
+flask_app.app_ctx_globals_class = LazyGlobals
 flask_app.config.from_object(FlaskConfig)
 flask_api = Api(flask_app)
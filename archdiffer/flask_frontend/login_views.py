@@ -9,21 +9,64 @@ Created on Sun May 20 15:15:08 2018
 @author: Pavla Kratochvilova <pavla.kratochvilova@gmail.com>
 """
 
+import time
 from flask import request, flash, redirect, url_for, g
 from flask import session as flask_session
 from flask_openid import OpenID
-from .flask_app import flask_app
+from .flask_app import flask_app, lazy_global
 from .common_views import my_render_template
+from ..config import config
 from ..database import User
 
+# Openid and name of the logged in user are kept in the signed session and
+# checked against the database after this count of seconds
+USER_REVALIDATE_INTERVAL = config.getfloat(
+    'web', 'USER_REVALIDATE_INTERVAL', fallback=300
+)
+
 oid = OpenID(flask_app, safe_roots=[])
 
-@flask_app.before_request
+class SignedUser():
+    """Logged in user known from the signed session. Its openid and name are
+    available without the database; other attributes are taken from the
+    User loaded at their first use.
+    """
+    def __init__(self, openid, name):
+        self.openid = openid
+        self.name = name
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        user = self.__dict__.get('user')
+        if user is None:
+            user = User.cached(g.db_session, openid=self.openid)
+            if user is None:
+                raise AttributeError(name)
+            self.__dict__['user'] = user
+        return getattr(user, name)
+
+@lazy_global('user')
 def lookup_current_user():
-    g.user = None
-    if 'openid' in flask_session:
-        openid = flask_session['openid']
-        g.user = User.query(g.db_session, openid=openid)
+    """Get the logged in user at the first use in the request.
+
+    :return: SignedUser, User or None
+    """
+    openid = flask_session.get('openid')
+    if openid is None:
+        return None
+    signed = flask_session.get('user')
+    if (signed is not None and signed['openid'] == openid and
+            signed['checked'] + USER_REVALIDATE_INTERVAL > time.time()):
+        return SignedUser(signed['openid'], signed['name'])
+    user = User.cached(g.db_session, openid=openid)
+    if user is None:
+        flask_session.pop('user', None)
+    else:
+        flask_session['user'] = {
+            'openid': user.openid, 'name': user.name, 'checked': time.time(),
+        }
+    return user
 
 def form_openid_url(url, username):
     """Fill in username into url."""
@@ -94,6 +137,7 @@ def create_profile():
 def logout():
     """Logout user."""
     flask_session.pop('openid', None)
+    flask_session.pop('user', None)
     g.user = None
     flash('You were signed out.', 'success')
     return redirect(oid.get_next_url())
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import threading
+from datetime import datetime
+from .. import database
+from ..database import OutboxTask
+from ..config import config
+from .. import metrics
+from . import tasks
+
+OUTBOX_BATCH_SIZE = config.getint('web', 'OUTBOX_BATCH_SIZE', fallback=100)
+OUTBOX_POLL_INTERVAL = config.getfloat(
+    'web', 'OUTBOX_POLL_INTERVAL', fallback=5
+)
+
+outbox_dispatched = metrics.Counter(
+    'archdiffer_outbox_dispatched_total',
+    'Count of tasks sent from the outbox to the broker.',
+)
+outbox_errors = metrics.Counter(
+    'archdiffer_outbox_errors_total',
+    'Count of failed attempts to send a batch of tasks from the outbox.',
+)
+outbox_delay = metrics.Histogram(
+    'archdiffer_outbox_delay_seconds',
+    'Time between adding a task to the outbox and sending it to the broker.',
+)
+
+class Dispatcher():
+    """Sends tasks from the outbox table to the broker in batches.
+
+    Rows are deleted in the same transaction in which they were read, after
+    they are published. If publishing fails, the rows stay in the outbox and
+    are sent again later, so a task can be delivered more than once.
+    """
+    def __init__(self, publish=None, batch_size=OUTBOX_BATCH_SIZE,
+                 interval=OUTBOX_POLL_INTERVAL):
+        """Create the dispatcher; the thread is started by wake.
+
+        :param callable publish: function sending list of tuples (task name,
+            args, options dict) to the broker; defaults to tasks.publish_many
+        :param int batch_size: maximal count of tasks sent in one batch
+        :param float interval: how often should the outbox be polled if the
+            dispatcher isn't woken up
+        """
+        self.publish = publish
+        self.batch_size = batch_size
+        self.interval = interval
+        self.event = threading.Event()
+        self.thread = None
+        self.stopping = False
+        self.lock = threading.Lock()
+
+    def dispatch_batch(self):
+        """Send one batch of tasks from the outbox.
+
+        :return int: count of sent tasks
+        """
+        publish = self.publish or tasks.publish_many
+        ses = database.session()
+        try:
+            # Other dispatchers (in other processes) skip the locked rows.
+            outbox_tasks = ses.query(OutboxTask).order_by(
+                OutboxTask.id
+            ).limit(self.batch_size).with_for_update(skip_locked=True).all()
+            if not outbox_tasks:
+                return 0
+            publish([task.send_task_arguments() for task in outbox_tasks])
+            now = datetime.utcnow()
+            for task in outbox_tasks:
+                outbox_delay.observe((now - task.created).total_seconds())
+            ses.query(OutboxTask).filter(
+                OutboxTask.id.in_([task.id for task in outbox_tasks])
+            ).delete(synchronize_session=False)
+            ses.commit()
+        except:
+            ses.rollback()
+            outbox_errors.inc()
+            raise
+        finally:
+            ses.close()
+        outbox_dispatched.inc(len(outbox_tasks))
+        return len(outbox_tasks)
+
+    def dispatch(self):
+        """Send all tasks from the outbox.
+
+        :return int: count of sent tasks
+        """
+        total = 0
+        while True:
+            count = self.dispatch_batch()
+            total += count
+            if count < self.batch_size:
+                return total
+
+    def wake(self):
+        """Make the dispatcher thread send tasks now; start it if needed."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.event.set()
+
+    def run(self):
+        """Send tasks whenever woken up or the poll interval elapses."""
+        while not self.stopping:
+            self.event.wait(self.interval)
+            self.event.clear()
+            try:
+                self.dispatch()
+            except Exception as error:
+                print('Dispatching of the outbox failed: %s' % error)
+
+    def stop(self):
+        """Stop the dispatcher thread after its current batch."""
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            self.stopping = True
+            self.event.set()
+            thread.join()
+            self.stopping = False
+
+dispatcher = Dispatcher()
@@ -13,7 +13,9 @@ Created on Sun Mar  4 10:23:41 2018
 import operator
 import datetime
 from flask import request
+from sqlalchemy import and_
 from .exceptions import BadRequest
+from ..database import period_of
 
 def make_datetime(time_string, formats=None):
     """Makes datetime from string based on one of the formats.
@@ -51,34 +53,61 @@ _TRANSFORMATIONS = {
 }
 
 # Filters creators
-def before(column, name='before'):
+def _pruned(compare, period_column=None):
+    """Make the comparison of datetimes also compare the partition period, so
+    that the database can skip periods that can't match.
+
+    :param callable compare: operator comparing column with datetime
+    :param period_column: column with period of the rows or None
+    :return callable: resulting operator
+    """
+    if period_column is None:
+        return compare
+    def compare_with_period(column, value):
+        if value is None:
+            return compare(column, value)
+        return and_(
+            compare(column, value), compare(period_column, period_of(value))
+        )
+    return compare_with_period
+
+def before(column, name='before', period_column=None):
     """Make filter template for filtering column values less or equal to
     datetime.
 
     :param column: database model
     :param string name: name used in the filter template
+    :param period_column: column with partition period of the rows
     :return dict: resulting template
     """
-    return {name: (column, operator.le, make_datetime)}
+    return {name: (
+        column, _pruned(operator.le, period_column), make_datetime
+    )}
 
-def after(column, name='after'):
+def after(column, name='after', period_column=None):
     """Make filter template for filtering column values greater or equal to
     datetime.
 
     :param column: database model
     :param string name: name used in the filter template
+    :param period_column: column with partition period of the rows
     :return dict: resulting template
     """
-    return {name: (column, operator.ge, make_datetime)}
+    return {name: (
+        column, _pruned(operator.ge, period_column), make_datetime
+    )}
 
-def time(column, name='time'):
+def time(column, name='time', period_column=None):
     """Make filter template for filtering column values equal to datetime.
 
     :param column: database model
     :param string name: name used in the filter template
+    :param period_column: column with partition period of the rows
     :return dict: resulting template
     """
-    return {name: (column, operator.eq, make_datetime)}
+    return {name: (
+        column, _pruned(operator.eq, period_column), make_datetime
+    )}
 
 def equals(column, name='id', function=(lambda x: x)):
     """Make filter template for filtering column values equal to value
@@ -9,32 +9,29 @@ Created on Sun May 20 15:41:14 2018
 @author: Pavla Kratochvilova <pavla.kratochvilova@gmail.com>
 """
 
-import base64
 import datetime
 import functools
 from flask import request, redirect, url_for, g, abort
 from .flask_app import flask_app
 from .exceptions import AuthFailed
-from .common_views import my_render_template
+from .common_views import my_render_template, basic_auth
+from .login_views import SignedUser
 from ..database import User
+from . import api_tokens
 
 def rest_api_auth_required(f):
     """Checks REST API authentization."""
     @functools.wraps(f)
     def decorated_function(*args, **kwargs):
-        token = None
-        api_login = None
-        try:
-            if "Authorization" in request.headers:
-                base64string = request.headers["Authorization"]
-                base64string = base64string.split()[1].strip()
-                userstring = base64.b64decode(base64string)
-                (api_login, token) = userstring.decode("utf-8").split(":")
-        except Exception:
-            api_login = token = None
+        (api_login, token) = basic_auth()
         token_auth = False
-        if token and api_login:
-            user = User.query(g.db_session, api_login=api_login)
+        if token and api_login and api_tokens.is_signed(token):
+            claims = api_tokens.verify(api_login, token)
+            if claims is not None:
+                token_auth = True
+                g.user = SignedUser(claims['openid'], claims['name'])
+        elif token and api_login:
+            user = User.cached(g.db_session, api_login=api_login)
             if (user and user.api_token == token and
                     user.api_token_expiration >= datetime.date.today()):
                 token_auth = True
@@ -48,7 +45,10 @@ def rest_api_auth_required(f):
 @flask_app.route('/api')
 def show_rest_api():
     """Show page for api."""
-    return my_render_template('show_rest_api.html')
+    api_token = None
+    if g.user is not None and g.user.api_token:
+        api_token = api_tokens.sign(g.user)
+    return my_render_template('show_rest_api.html', api_token=api_token)
 
 @flask_app.route('/generate_token', methods=['POST'])
 def generate_token():
@@ -56,10 +56,12 @@ def generate_token():
     if g.get('user', None) is None:
         abort(401)
 
+    api_tokens.revoke(g.db_session, g.user)
     g.user.new_token(
         g.db_session,
         size=flask_app.config['API_TOKEN_LENGTH'],
         token_expiration=flask_app.config['API_TOKEN_EXPIRATION'],
     )
+    api_tokens.revoked_cache.invalidate()
 
     return redirect(url_for('show_rest_api'))
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import atexit
+import queue
+import threading
+import time
+from ..config import config
+from .. import metrics
+from .. import embedded
+from .. import database
+
+# The one celery app of the frontend used for sending tasks. Connections and
+# producers are taken from its pool, so they are reused among requests.
+# Celery is imported at its first use, see get_celery_app.
+_celery_app = None
+_celery_lock = threading.Lock()
+
+# Optional micro-batching: if PUBLISH_BATCH_SIZE is greater than 1, tasks are
+# published by a background thread in batches of up to PUBLISH_BATCH_SIZE
+# tasks, waiting at most PUBLISH_BATCH_INTERVAL seconds to fill a batch.
+PUBLISH_BATCH_SIZE = config.getint('web', 'PUBLISH_BATCH_SIZE', fallback=1)
+PUBLISH_BATCH_INTERVAL = config.getfloat(
+    'web', 'PUBLISH_BATCH_INTERVAL', fallback=0.05
+)
+
+# How often are the counts of messages waiting in the queues refreshed by
+# the background thread, see BacklogMonitor.
+QUEUE_BACKLOG_TTL = config.getfloat('web', 'QUEUE_BACKLOG_TTL', fallback=5)
+
+publish_seconds = metrics.Histogram(
+    'archdiffer_publish_seconds', 'Time spent publishing one task.'
+)
+publish_batch_seconds = metrics.Histogram(
+    'archdiffer_publish_batch_seconds',
+    'Time spent publishing one batch of tasks, including acquiring producer.',
+)
+published_tasks = metrics.Counter(
+    'archdiffer_published_tasks_total', 'Count of published tasks.'
+)
+publish_errors = metrics.Counter(
+    'archdiffer_publish_errors_total', 'Count of tasks failed to publish.'
+)
+
+def get_celery_app():
+    """Get the celery app of the frontend; create it at the first use.
+
+    :return celery.Celery: celery app
+    """
+    global _celery_app
+    with _celery_lock:
+        if _celery_app is None:
+            from celery import Celery
+            celery_app = Celery(broker=config['common']['MESSAGE_BROKER'])
+            celery_app.conf.broker_pool_limit = config.getint(
+                'web', 'BROKER_POOL_LIMIT', fallback=10
+            )
+            _celery_app = celery_app
+        return _celery_app
+
+def publish_many(tasks):
+    """Publish tasks to the broker using one producer from the pool. In the
+    embedded mode, submit them to the local executor instead.
+
+    :param list tasks: list of tuples (task name, args, options dict)
+    :raises Exception: if publishing of a task fails; tasks preceding it are
+        already published
+    """
+    if embedded.EMBEDDED:
+        for name, args, options in tasks:
+            embedded.executor.submit(name, args, options.get('kwargs'))
+            published_tasks.inc(task=name)
+        return
+    batch_started = time.monotonic()
+    celery_app = get_celery_app()
+    with celery_app.producer_pool.acquire(block=True) as producer:
+        for name, args, options in tasks:
+            started = time.monotonic()
+            try:
+                celery_app.send_task(
+                    name, args=args, producer=producer, **options
+                )
+            except Exception:
+                publish_errors.inc(task=name)
+                raise
+            publish_seconds.observe(time.monotonic() - started, task=name)
+            published_tasks.inc(task=name)
+    publish_batch_seconds.observe(time.monotonic() - batch_started)
+
+def measure_backlog(name):
+    """Ask the broker for count of messages waiting in the queue.
+
+    :param string name: queue name
+    :return int: count of messages (0 if the queue doesn't exist yet or the
+        broker can't tell)
+    """
+    try:
+        with get_celery_app().pool.acquire(block=True) as connection:
+            # Own channel, passive declare of a missing queue closes it
+            channel = connection.channel()
+            try:
+                return channel.queue_declare(
+                    queue=name, passive=True
+                ).message_count
+            finally:
+                try:
+                    channel.close()
+                except Exception:
+                    pass
+    except Exception:
+        return 0
+
+class BacklogMonitor():
+    """Background thread refreshing counts of messages waiting in the
+    queues, so that requests never wait for the broker."""
+    def __init__(self, interval, measure=None):
+        """Create the monitor; the thread is started with the first lookup.
+
+        :param float interval: how often are the counts refreshed
+        :param callable measure: function getting count of messages in
+            a queue from the broker; defaults to measure_backlog
+        """
+        self.interval = interval
+        self.measure = measure
+        self.counts = {}
+        self.event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def backlog(self, name):
+        """Get the last known count of messages waiting in the queue. The
+        queue is refreshed in the background from now on.
+
+        :param string name: queue name
+        :return int: count of messages (0 if not known yet)
+        """
+        with self.lock:
+            if name not in self.counts:
+                self.counts[name] = 0
+                self.event.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            return self.counts[name]
+
+    def refresh(self):
+        """Refresh counts of all known queues."""
+        measure = self.measure or measure_backlog
+        with self.lock:
+            names = list(self.counts)
+        for name in names:
+            count = measure(name)
+            with self.lock:
+                self.counts[name] = count
+
+    def run(self):
+        """Refresh the counts until the process ends."""
+        while True:
+            self.event.clear()
+            self.refresh()
+            self.event.wait(self.interval)
+
+backlog_monitor = BacklogMonitor(QUEUE_BACKLOG_TTL)
+
+def queue_backlog(name):
+    """Get count of messages waiting in the queue, refreshed every
+    QUEUE_BACKLOG_TTL seconds in the background.
+
+    :param string name: queue name
+    :return int: count of messages (0 if the queue doesn't exist yet, the
+        broker can't tell or the count isn't known yet); in the embedded
+        mode, count of tasks pending in the local executor, which has no
+        queues
+    """
+    if embedded.EMBEDDED:
+        return embedded.executor.pending
+    return backlog_monitor.backlog(name)
+
+class Batcher():
+    """Background thread publishing tasks in batches. Batches that fail to
+    publish are written to the outbox, to be sent again by its dispatcher;
+    tasks of such a batch can be delivered more than once.
+    """
+    def __init__(self, size, interval, publish=None):
+        """Create the batcher; the thread is started with the first task.
+
+        :param int size: maximal size of a batch
+        :param float interval: maximal time to wait for filling the batch
+        :param callable publish: function sending list of tuples (task name,
+            args, options dict) to the broker; defaults to publish_many
+        """
+        self.size = size
+        self.interval = interval
+        self.publish = publish
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, name, args, options):
+        """Add task to be published.
+
+        :param string name: task name
+        :param tuple args: task arguments
+        :param dict options: options passed to send_task
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.queue.put((name, args, options))
+
+    def next_batch(self):
+        """Wait for the next batch of tasks.
+
+        :return list: list of tasks
+        """
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def save(self, batch):
+        """Write the tasks to the outbox and wake its dispatcher.
+
+        :param list batch: list of tasks
+        """
+        # The outbox module imports this one
+        from . import outbox
+        ses = database.session()
+        try:
+            for name, args, options in batch:
+                database.OutboxTask.add(ses, name, args, **options)
+            ses.commit()
+        except Exception as error:
+            ses.rollback()
+            print('Saving of tasks to the outbox failed, %s tasks lost: %s' % (
+                len(batch), error
+            ))
+            return
+        finally:
+            ses.close()
+        outbox.dispatcher.wake()
+
+    def run(self):
+        """Publish batches until the process ends."""
+        publish = self.publish or publish_many
+        while True:
+            batch = self.next_batch()
+            try:
+                publish(batch)
+            except Exception as error:
+                print('Publishing of tasks failed, saving them to the outbox: '
+                      '%s' % error)
+                self.save(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        """Wait until all queued tasks are processed."""
+        if self.thread is not None:
+            self.queue.join()
+
+batcher = None
+if PUBLISH_BATCH_SIZE > 1:
+    batcher = Batcher(PUBLISH_BATCH_SIZE, PUBLISH_BATCH_INTERVAL)
+    atexit.register(batcher.flush)
+
+def send_task(name, args=(), **options):
+    """Send task by its name.
+
+    :param string name: task name
+    :param tuple args: task arguments
+    :param **options: options passed to celery send_task (for example queue)
+    """
+    if batcher is not None:
+        batcher.put(name, args, options)
+    else:
+        publish_many([(name, args, options)])
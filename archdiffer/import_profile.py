@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import sys
+import argparse
+import subprocess
+
+# Modules imported at the start of the processes
+TARGETS = {
+    'frontend': 'archdiffer.flask_frontend',
+    'worker': 'archdiffer.backend',
+}
+
+def parse_importtime(output):
+    """Parse output of python -X importtime.
+
+    :param string output: standard error of the python process
+    :return list: list of tuples (module, self time, cumulative time, depth)
+        with times in seconds, in the order of the output
+    """
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        depth = (len(name) - len(module) - 1) // 2
+        rows.append((
+            module, int(fields[0]) / 1e6, int(fields[1]) / 1e6, depth
+        ))
+    return rows
+
+def profile_imports(module):
+    """Import the module in a new python process and measure import times
+    of all modules it imports.
+
+    :param string module: name of the module
+    :return list: parsed rows, see parse_importtime
+    :raises RuntimeError: if the import fails
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'),
+    )
+    if process.returncode != 0:
+        errors = [
+            line for line in process.stderr.splitlines()
+            if not line.startswith('import time:')
+        ]
+        raise RuntimeError('Import of %s failed:\n%s' % (
+            module, '\n'.join(errors[-10:])
+        ))
+    return parse_importtime(process.stderr)
+
+def report(rows, top=30, sort='cumulative'):
+    """Make report of the slowest imports.
+
+    :param list rows: parsed rows, see parse_importtime
+    :param int top: count of reported modules
+    :param string sort: 'cumulative' or 'self'
+    :return string: report
+    """
+    index = 2 if sort == 'cumulative' else 1
+    total = sum(row[2] for row in rows if row[3] == 0)
+    lines = [
+        'Total import time: %.3f s, %d modules' % (total, len(rows)),
+        '%10s %10s  %s' % ('self [s]', 'cumul [s]', 'module'),
+    ]
+    for module, self_time, cumulative, _ in sorted(
+            rows, key=lambda row: row[index], reverse=True
+    )[:top]:
+        lines.append('%10.3f %10.3f  %s' % (self_time, cumulative, module))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    """Print import times of the frontend, the worker or any module.
+
+    :param list argv: command line arguments
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description='Report time spent importing modules at startup.'
+    )
+    parser.add_argument(
+        'target', nargs='?', default='frontend',
+        help='frontend, worker or name of a module (default: frontend)',
+    )
+    parser.add_argument(
+        '--top', type=int, default=30, help='count of reported modules'
+    )
+    parser.add_argument(
+        '--sort', choices=('cumulative', 'self'), default='cumulative',
+        help='sort by time including or excluding submodules',
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        rows = profile_imports(TARGETS.get(args.target, args.target))
+    except RuntimeError as error:
+        return str(error)
+    print(report(rows, args.top, args.sort))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
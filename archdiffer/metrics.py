@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import time
+import threading
+
+class Registry():
+    """Collection of metrics of one process."""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """Add metric to the registry.
+
+        :param Metric metric: metric
+        """
+        self.metrics.append(metric)
+
+    def render(self, extra_labels=None):
+        """Render all metrics in the Prometheus text format.
+
+        :param dict extra_labels: labels added to every sample
+        :return string: metrics
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(extra_labels))
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Get current values of all metrics.
+
+        :return list: list of dicts with name, type, documentation,
+            multiprocess mode and samples of the metric
+        """
+        return [{
+            'name': metric.name,
+            'type': metric.type,
+            'documentation': metric.documentation,
+            'mode': metric.multiprocess_mode,
+            'samples': [
+                [suffix, labels, value]
+                for suffix, labels, value in metric.samples()
+            ],
+        } for metric in self.metrics]
+
+    def dump(self, path):
+        """Write snapshot of the metrics to the file, so that another process
+        can merge metrics of several processes.
+
+        :param string path: path of the file
+        """
+        tmp_path = '%s.tmp' % path
+        with open(tmp_path, 'w') as dump_file:
+            json.dump(self.snapshot(), dump_file)
+        os.replace(tmp_path, path)
+
+REGISTRY = Registry()
+
+def render_snapshots(snapshots):
+    """Merge snapshots of several processes and render them in the
+    Prometheus text format. Samples with the same labels are added up
+    (gauges with the 'max' mode take the maximum). Snapshots of processes
+    that ended contribute only to counters and histograms.
+
+    :param list snapshots: list of tuples (snapshot, True if the process is
+        alive)
+    :return string: metrics
+    """
+    families = {}
+    for snapshot, alive in snapshots:
+        for metric in snapshot:
+            if metric['type'] == 'gauge' and not alive:
+                continue
+            family = families.setdefault(metric['name'], {
+                'metric': metric, 'values': {}
+            })
+            values = family['values']
+            for suffix, labels, value in metric['samples']:
+                key = (suffix, tuple(sorted(labels.items())))
+                if key not in values:
+                    values[key] = value
+                elif metric['mode'] == 'max':
+                    values[key] = max(values[key], value)
+                else:
+                    values[key] += value
+    lines = []
+    for name, family in families.items():
+        metric = family['metric']
+        lines.append('# HELP %s %s' % (name, metric['documentation']))
+        lines.append('# TYPE %s %s' % (name, metric['type']))
+        for (suffix, labels), value in family['values'].items():
+            lines.append('%s%s%s %s' % (
+                name, suffix, _format_labels(dict(labels)),
+                _format_value(value)
+            ))
+    return '\n'.join(lines) + '\n'
+
+def pid_alive(pid):
+    """Find out if process exists.
+
+    :param int pid: process id
+    :return bool: True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def dump_path(directory, pid=None):
+    """Get path of the metrics dump of the process.
+
+    :param string directory: directory with the dumps
+    :param int pid: process id (default is the current process)
+    :return string: path
+    """
+    return os.path.join(directory, '%s.json' % (pid or os.getpid()))
+
+def dump_process(directory, registry=REGISTRY):
+    """Dump metrics of this process into the directory.
+
+    :param string directory: directory with the dumps
+    :param Registry registry: registry of this process
+    """
+    try:
+        os.makedirs(directory, exist_ok=True)
+        registry.dump(dump_path(directory))
+    except OSError as error:
+        print('Metrics not dumped: %s' % error)
+
+def dump_periodically(directory, interval):
+    """Dump metrics of this process into the directory every interval
+    seconds, forever.
+
+    :param string directory: directory with the dumps
+    :param float interval: interval in seconds
+    """
+    while True:
+        time.sleep(interval)
+        dump_process(directory)
+
+def read_snapshots(directory):
+    """Read metrics dumped by other processes.
+
+    :param string directory: directory with the dumps
+    :return list: list of tuples (snapshot, True if the process is alive)
+    """
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        pid = int(name[:-len('.json')])
+        if pid == os.getpid():
+            continue
+        try:
+            with open(os.path.join(directory, name)) as dump_file:
+                snapshots.append((json.load(dump_file), pid_alive(pid)))
+        except (OSError, ValueError):
+            pass
+    return snapshots
+
+def render_processes(directory, registry=REGISTRY):
+    """Render merged metrics of this process and of the other processes
+    that dump their metrics into the directory.
+
+    :param string directory: directory with the dumps
+    :param Registry registry: registry of this process
+    :return string: metrics in the Prometheus text format
+    """
+    snapshots = [(registry.snapshot(), True)]
+    if os.path.isdir(directory):
+        snapshots.extend(read_snapshots(directory))
+    return render_snapshots(snapshots)
+
+def _format_labels(labels):
+    """Format labels of one sample.
+
+    :param dict labels: labels
+    :return string: labels in the Prometheus text format
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for key, value in sorted(labels.items())
+    )
+
+def _format_value(value):
+    """Format value of one sample.
+
+    :param float value: value
+    :return string: value in the Prometheus text format
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+class Metric():
+    """Base of the metrics. Values are kept separately for each combination
+    of labels given when updating the metric."""
+    type = None
+
+    def __init__(self, name, documentation, registry=REGISTRY,
+                 multiprocess_mode='sum'):
+        """Create and register the metric.
+
+        :param string name: name of the metric
+        :param string documentation: help text
+        :param Registry registry: registry to add the metric to
+        :param string multiprocess_mode: how to merge values of several
+            processes: 'sum' or 'max' (for values shared by the processes)
+        """
+        self.name = name
+        self.documentation = documentation
+        self.multiprocess_mode = multiprocess_mode
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.register(self)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def samples(self):
+        """Get samples of the metric.
+
+        :return list: list of tuples (suffix, labels dict, value)
+        """
+        with self.lock:
+            return [
+                ('', dict(key), value) for key, value in self.values.items()
+            ]
+
+    def render(self, extra_labels=None):
+        """Render the metric in the Prometheus text format.
+
+        :param dict extra_labels: labels added to every sample
+        :return list: lines
+        """
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.type),
+        ]
+        for suffix, labels, value in self.samples():
+            if extra_labels:
+                labels = dict(labels, **extra_labels)
+            lines.append('%s%s%s %s' % (
+                self.name, suffix, _format_labels(labels), _format_value(value)
+            ))
+        return lines
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter.
+
+        :param float amount: amount to add
+        :param **labels: labels of the sample
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        """Set the gauge.
+
+        :param float value: value
+        :param **labels: labels of the sample
+        """
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        """Increase the gauge.
+
+        :param float amount: amount to add (can be negative)
+        :param **labels: labels of the sample
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """Decrease the gauge.
+
+        :param float amount: amount to subtract
+        :param **labels: labels of the sample
+        """
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """Compute the value by calling the function when rendering.
+
+        :param callable function: function returning the value
+        :param **labels: labels of the sample
+        """
+        with self.lock:
+            self.functions[self._key(labels)] = function
+
+    def samples(self):
+        samples = super().samples()
+        with self.lock:
+            functions = list(self.functions.items())
+        for key, function in functions:
+            try:
+                samples.append(('', dict(key), function()))
+            except Exception:
+                pass
+        return samples
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+    type = 'histogram'
+    default_buckets = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+        300, 600,
+    )
+
+    def __init__(self, name, documentation, buckets=None, **kwargs):
+        """Create and register the histogram.
+
+        :param string name: name of the metric
+        :param string documentation: help text
+        :param tuple buckets: upper bounds of the buckets
+        """
+        super().__init__(name, documentation, **kwargs)
+        if buckets is None:
+            buckets = self.default_buckets
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        """Observe a value.
+
+        :param float value: value
+        :param **labels: labels of the sample
+        """
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            values = [(dict(key), list(counts), total)
+                      for key, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            for bound, count in zip(self.buckets, counts):
+                bucket_labels = dict(labels, le=_format_value(bound))
+                samples.append(('_bucket', bucket_labels, count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, counts[-1]))
+        return samples
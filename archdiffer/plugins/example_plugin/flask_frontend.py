@@ -10,17 +10,13 @@ Created on Wed May  2 15:58:46 2018
 """
 
 from flask import Blueprint, request, render_template, redirect, url_for
-from celery import Celery
 from ...flask_frontend.flask_app import flask_app
-from ...config import config
+from ...flask_frontend import tasks
 
 # Blueprint named example_plugin. If you want templates or static files,
 # you can provide template_folder or static_folder parameter.
 blueprint = Blueprint('example_plugin', __name__, template_folder='templates')
 
-# Celery app for sending tasks via celery.
-celery_app = Celery(broker=config['common']['MESSAGE_BROKER'])
-
 # Some index page.
 @blueprint.route('/', methods=['GET'])
 def index():
@@ -33,7 +29,7 @@ def index():
 def send_task():
     """Send an example task."""
     data = request.form['data']
-    celery_app.send_task('example_plugin.example_task', args=(data))
+    tasks.send_task('example_plugin.example_task', args=(data))
     return redirect(url_for('example_plugin.index'))
 
 # Register the blueprint and set unique prefix.
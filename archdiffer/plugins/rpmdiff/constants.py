@@ -17,12 +17,22 @@ COMPARISON_TYPE = 'rpmdiff'
 STATE_NEW = 0
 STATE_DONE = 1
 STATE_FILTERING = 2
+STATE_ERROR = -1
 STATE_STRINGS = {
     STATE_NEW: 'new',
     STATE_DONE: 'done',
     STATE_FILTERING: 'filtering',
+    STATE_ERROR: 'error',
 }
 
+# Stages of comparison groups reported in rpm_progress
+STAGE_QUEUED = 'queued'
+STAGE_LOAD = 'load'
+STAGE_DOWNLOAD = 'download'
+STAGE_DIFF = 'diff'
+STAGE_PERSIST = 'persist'
+STAGE_FINISHED = 'finished'
+
 # Codes for categories of rpm_differences
 CATEGORY_TAGS = 0
 CATEGORY_PRCO = 1
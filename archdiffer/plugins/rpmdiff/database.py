@@ -22,3 +22,4 @@ def init_db():
     ).one_or_none() is None:
         session.add(database.ComparisonType(name=COMPARISON_TYPE))
         session.commit()
+        database.ComparisonType._cache.invalidate()
@@ -10,27 +10,35 @@ Created on Sat Sep 16 22:54:57 2017
 """
 
 import json
+from urllib.parse import urlparse
 from flask import (Blueprint, abort, request, flash, redirect, url_for, g,
                    make_response, Markup)
 from flask import session as flask_session
 from flask_restful import Api, Resource
-from celery import Celery
+from sqlalchemy import true
+from sqlalchemy.sql import operators
+from sqlalchemy.exc import IntegrityError
 from ..rpm_db_models import (RPMComparison, RPMDifference, RPMPackage,
-                             RPMRepository, RPMComment, pkg1, pkg2, repo1,
-                             repo2, iter_query_result)
+                             RPMRepository, RPMComment, RPMCallback,
+                             RPMProgress, RPMRequest, RPMDifferenceBlob,
+                             RPMDifferenceWaiver, pkg1, pkg2, repo1,
+                             repo2,
+                             iter_query_result)
 from .. import constants
-from ....database import Comparison, User, modify_query
+from .... import constants as app_constants
+from .... import routing
+from .... import metrics
+from ....database import (Comparison, ComparisonType, User, OutboxTask,
+                          modify_query)
 from ....flask_frontend.common_views import my_render_template
 from ....flask_frontend.database_views import TableList, routes
 from ....flask_frontend.rest_api_views import rest_api_auth_required
 from ....flask_frontend import filter_functions as app_filter_functions
 from ....flask_frontend import request_parser
 from ....flask_frontend.exceptions import BadRequest
-from ....config import config
+from ....flask_frontend import outbox, tasks
 from . import filter_functions
 
-celery_app = Celery(broker=config['common']['MESSAGE_BROKER'])
-
 bp = Blueprint(
     constants.COMPARISON_TYPE, __name__, template_folder='templates'
 )
@@ -64,6 +72,146 @@ def add_filter(modifiers, new_filter):
     modifiers['filter'].append(new_filter)
     return modifiers
 
+def parse_callbacks(data):
+    """Get list of callback URLs from the request data.
+
+    :param dict data: request data
+    :return list: list of URL strings
+    :raises BadRequest: if the callbacks are not list of http(s) URLs
+    """
+    callbacks = data.get('callbacks', [])
+    if not isinstance(callbacks, list):
+        raise BadRequest('Incorrect data format: callbacks must be a list.')
+    for url in callbacks:
+        if (not isinstance(url, str) or
+                urlparse(url).scheme not in ('http', 'https')):
+            raise BadRequest(
+                'Incorrect data format: invalid callback URL "%s".' % url
+            )
+    return callbacks
+
+def parse_priority(data):
+    """Get priority of the comparison request from the request data or the
+    submitting user.
+
+    :param dict data: request data
+    :return string: priority
+    :raises BadRequest: if the priority is not known
+    """
+    requested = data.get('priority')
+    if requested is not None and requested not in app_constants.PRIORITIES:
+        raise BadRequest(
+            'Incorrect data format: priority must be one of: %s.' %
+            ', '.join(app_constants.PRIORITIES)
+        )
+    return routing.priority(requested, username=g.user.name)
+
+coalesced_requests = metrics.Counter(
+    'archdiffer_rpmdiff_coalesced_requests_total',
+    'Count of comparison requests attached to an identical in-flight group.',
+)
+
+affinity_routed = metrics.Counter(
+    'archdiffer_rpmdiff_affinity_routed_total',
+    'Count of comparison requests routed by repository affinity.',
+)
+
+def comparison_queue(priority, pkg1, pkg2):
+    """Get queue of the compare task. Bulk requests are routed by affinity
+    to the pair of repositories, if AFFINITY_QUEUES are configured, so that
+    the same worker node gets the same repositories.
+
+    :param string priority: priority of the request
+    :param dict pkg1: first package dict
+    :param dict pkg2: second package dict
+    :return string: queue name
+    """
+    if priority != app_constants.PRIORITY_BULK or not routing.AFFINITY_QUEUES:
+        return routing.queue(priority)
+    key = '\n'.join(sorted(
+        pkg['repository'].strip().rstrip('/') for pkg in (pkg1, pkg2)
+    ))
+    queue, spilled = routing.affinity_queue(key, tasks.queue_backlog)
+    affinity_routed.inc(queue=queue, spilled=str(spilled).lower())
+    return queue
+
+def request_comparison(ses, pkg1, pkg2, queue, callbacks=None):
+    """Add comparison group and its task, or attach the request to an
+    identical comparison group that is still in flight.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param dict pkg1: first package dict
+    :param dict pkg2: second package dict
+    :param string queue: queue of the compare task
+    :param list callbacks: callback URLs
+    :return tuple: tuple (Comparison id, True if the request was coalesced)
+    """
+    key = RPMRequest.key(pkg1, pkg2)
+    for attempt in range(2):
+        id_group = RPMRequest.coalesce(ses, key)
+        if id_group is not None:
+            if callbacks:
+                RPMCallback.add(ses, id_group, callbacks, commit=False)
+            ses.commit()
+            coalesced_requests.inc()
+            return id_group, True
+
+        try:
+            comp = Comparison.add(ses, constants.COMPARISON_TYPE, commit=False)
+            RPMRequest.add(ses, comp.id, key)
+            RPMProgress.add(ses, comp.id)
+            if callbacks:
+                RPMCallback.add(ses, comp.id, callbacks, commit=False)
+            OutboxTask.add(
+                ses, 'rpmdiff.compare', args=(comp.id, pkg1, pkg2), queue=queue
+            )
+            ses.commit()
+        except IntegrityError:
+            # Identical request was added concurrently; attach to it.
+            ses.rollback()
+            if attempt:
+                raise
+            continue
+        outbox.dispatcher.wake()
+        return comp.id, False
+
+def change_waiver(action, id, index=None):
+    """Waive or unwaive a difference.
+
+    :param string action: 'waive' or 'unwaive'
+    :param id: id of the RPMDifference, or of the RPMComparison if index is
+        given
+    :param index: index of the difference in the blob of the RPMComparison
+    :raises BadRequest: if the index is not valid
+    :raises werkzeug.exceptions.NotFound: if the difference or the blob
+        doesn't exist
+    """
+    if index is None:
+        diff = g.db_session.query(RPMDifference).filter_by(id=id).first()
+        if diff is None:
+            abort(404)
+        if action == 'waive':
+            diff.waive(g.db_session)
+        else:
+            diff.unwaive(g.db_session)
+        return
+    try:
+        index = int(index)
+    except (TypeError, ValueError):
+        raise BadRequest('Incorrect data: index must be an integer.')
+    blob = g.db_session.query(RPMDifferenceBlob).get(id)
+    if blob is None:
+        abort(404)
+    if not 0 <= index < blob.count:
+        raise BadRequest(
+            'Incorrect data: index must be from 0 to %s.' % (blob.count - 1)
+        )
+    if action == 'waive':
+        RPMDifferenceWaiver.waive(g.db_session, id, index)
+    else:
+        RPMDifferenceWaiver.unwaive(g.db_session, id, index)
+
 class RoutesDict(Resource):
     """Dict of routes."""
     def get(self):
@@ -99,7 +247,8 @@ class RPMGroupsList(RPMTableList):
     )
 
     def get(self, id=None):
-        """Get list.
+        """Get list. Each group has its progress (None if the group has
+        none).
         (Overriden because of different iter_query_result function.)
 
         :param int id: id to optionaly filter by
@@ -112,7 +261,57 @@ class RPMGroupsList(RPMTableList):
         modifiers = self.modifiers(additional=additional_modifiers)
         query_ids = modify_query(query_ids, modifiers)
         query = RPMComparison.query_groups(g.db_session, query_ids.subquery())
-        return list(iter_query_result(query, self.table))
+        groups = list(iter_query_result(query, self.table))
+        progress = RPMProgress.of_groups(
+            g.db_session, [group['id'] for group in groups]
+        )
+        for group in groups:
+            group['progress'] = progress.get(group['id'])
+        return groups
+
+    @rest_api_auth_required
+    def put(self, id):
+        """Cancel a queued or running comparison group. The worker stops
+        the group at the next check."""
+        try:
+            data = json.loads(request.data.decode('utf8'))
+        except:
+            raise BadRequest("No data: please provide string 'cancel'.")
+        if data != 'cancel':
+            raise BadRequest("Incorrect data: please provide string 'cancel'.")
+        comp_type_id = ComparisonType.get_cache(g.db_session)[
+            constants.COMPARISON_TYPE
+        ]
+        if g.db_session.query(Comparison).filter_by(
+                id=id, comparison_type_id=comp_type_id
+        ).count() == 0:
+            abort(404)
+        cancelled = g.db_session.query(Comparison).filter_by(
+            id=id, state=app_constants.STATE_NEW
+        ).update(
+            {Comparison.state: app_constants.STATE_CANCELLED},
+            synchronize_session=False,
+        )
+        if not cancelled:
+            raise BadRequest('Comparison group is already finished.')
+        # Identical requests must not be attached to the cancelled group
+        RPMRequest.finish(g.db_session, id)
+        g.db_session.commit()
+        resp = make_response("", 204)
+        return resp
+
+class RPMGroupProgress(Resource):
+    """Progress of a comparison group alone, for polling it without the
+    comparisons of the group."""
+    replica_reads = True
+
+    def get(self, id):
+        """Get progress.
+
+        :param int id: Comparison id
+        :return list: list with the progress (empty if there is none)
+        """
+        return list(RPMProgress.of_groups(g.db_session, [id]).values())
 
 class RPMComparisonsList(RPMTableList):
     """List of rpm comparisons."""
@@ -146,53 +345,177 @@ class RPMComparisonsList(RPMTableList):
             raise BadRequest('Incorrect data format: missing package names.')
         if 'repository' not in pkg1 or 'repository' not in pkg2:
             raise BadRequest('Incorrect data format: missing repositories.')
+        callbacks = parse_callbacks(data)
+        priority = parse_priority(data)
 
-        comp = Comparison.add(g.db_session, constants.COMPARISON_TYPE)
-
-        celery_app.send_task('rpmdiff.compare', args=(comp.id, pkg1, pkg2))
+        id_group, coalesced = request_comparison(
+            g.db_session, pkg1, pkg2, comparison_queue(priority, pkg1, pkg2),
+            callbacks,
+        )
 
         resp = make_response("", 201)
         resp.headers["Location"] = url_for(
-            'rpmdiff.rpmgroupslist', id=comp.id
+            'rpmdiff.rpmgroupone', id=id_group
         )
+        if coalesced:
+            # Identical comparison group was already in flight
+            resp.headers["X-Coalesced"] = 'true'
         return resp
 
 class RPMDifferencesList(RPMTableList):
     """List of rpm differences."""
     table = RPMDifference
+    difference_filters = filter_functions.rpm_differences()
     filters = dict(
         **RPMComparisonsList.filters.copy(),
-        **filter_functions.rpm_differences(),
+        **difference_filters,
     )
 
     def get(self, id=None):
-        """Get list.
+        """Get list. Differences of RPMComparisons stored as blobs are
+        filtered and ordered in memory and listed after the others; limit and
+        offset apply to all the differences together.
 
         :param int id: RPMComparison id
         :return list: list of the resulting query
         """
+        blob_ids = RPMDifferenceBlob.comparison_ids(g.db_session)
         query = self.table.query(g.db_session)
-        additional_modifiers = None
+        additional_modifiers = {'filter': [~RPMComparison.id.in_(blob_ids)]}
         if id is not None:
-            additional_modifiers = {'filter': [RPMComparison.id == id]}
+            additional_modifiers['filter'].append(RPMComparison.id == id)
         modifiers = self.modifiers(additional=additional_modifiers)
-        query = modify_query(query, modifiers)
-        return list(iter_query_result(query, self.table))
+        lines = list(modify_query(query, modifiers))
+        result = list(iter_query_result(lines, self.table))
+
+        offset = modifiers.get('offset', 0)
+        limit = modifiers.get('limit')
+        if limit is not None:
+            if len(lines) >= limit:
+                return result
+            limit -= len(lines)
+        if lines:
+            offset = 0
+        elif offset:
+            # Skip the differences stored as rows before the blobs
+            unlimited = request_parser.get_request_arguments(
+                'limit', 'offset', args_dict=modifiers, invert=True
+            )
+            offset = max(0, offset - modify_query(query, unlimited).count())
+        return result + self.get_blobs(
+            id, blob_ids, modifiers, offset=offset, limit=limit
+        )
+
+    @staticmethod
+    def blob_order(order_by):
+        """Get ordering of differences stored as blobs. Columns of
+        differences are given by name (in request arguments, optionally
+        followed by 'desc') or as columns of RPMDifference; the others are
+        skipped, all differences of a blob share them.
+
+        :param list order_by: order_by modifiers
+        :return list: list of tuples (column name, True if descending)
+        """
+        result = []
+        for item in order_by:
+            descending = False
+            if isinstance(item, str):
+                name, _, direction = item.strip().partition(' ')
+                descending = direction.strip().lower() == 'desc'
+            else:
+                if getattr(item, 'modifier', None) is operators.desc_op:
+                    item, descending = item.element, True
+                if getattr(item, 'table', None) is not RPMDifference.__table__:
+                    continue
+                name = item.key
+            if name in RPMDifference.to_export:
+                result.append((name, descending))
+        return result
+
+    def get_blobs(self, id, blob_ids, modifiers, offset=0, limit=None):
+        """Get RPMComparisons whose differences are stored as blobs, with
+        the differences filtered, ordered and paginated in memory.
+
+        :param int id: RPMComparison id
+        :param sqlalchemy.orm.query.Query blob_ids: query of ids of the
+            RPMComparisons stored as blobs
+        :param dict modifiers: modifiers of the request
+        :param int offset: count of matching differences to skip
+        :param int limit: maximal count of returned differences
+        :return list: list of RPMComparison dicts with differences
+        """
+        # Filters of differences are evaluated in memory; the others in SQL
+        filters = dict(self.filters, **{
+            name: (column, lambda column, value: true(), function)
+            for name, (column, _, function) in self.difference_filters.items()
+        })
+        comparison_filters = request_parser.parse_request(filters=filters)[
+            'filter'
+        ]
+        comparison_filters.append(RPMComparison.id.in_(blob_ids))
+        if id is not None:
+            comparison_filters.append(RPMComparison.id == id)
+        difference_filters = [
+            (column.key, operator, function(request.args[name]))
+            for name, (column, operator, function)
+            in self.difference_filters.items() if name in request.args
+        ]
+        order_by = self.blob_order(modifiers.get('order_by', []))
+
+        result = []
+        query = RPMComparison.query(g.db_session).filter(
+            *comparison_filters
+        ).order_by(RPMComparison.id)
+        for line in query:
+            if limit is not None and limit <= 0:
+                break
+            comparison = RPMComparison.dict_from_line(line)
+            blob = g.db_session.query(RPMDifferenceBlob).get(
+                RPMComparison.id_from_line(line)
+            )
+            count, comparison['differences'] = blob.page(
+                g.db_session, difference_filters, offset=offset, limit=limit,
+                order_by=order_by,
+            )
+            offset = max(0, offset - count)
+            if not comparison['differences']:
+                continue
+            if limit is not None:
+                limit -= len(comparison['differences'])
+            result.append(comparison)
+        return result
 
     @rest_api_auth_required
     def put(self, id):
-        """Waive/unwaive a difference."""
+        """Waive/unwaive a difference. For differences stored as blobs, id is
+        the RPMComparison id and data is a dict with 'action' ('waive' or
+        'unwaive') and 'index' of the difference."""
         try:
             data = json.loads(request.data.decode('utf8'))
         except:
             raise BadRequest(
                 "No data: please provide string 'waive' or 'unwaive'."
             )
-        diff = g.db_session.query(RPMDifference).filter_by(id=id).first()
-        if data == 'waive':
-            diff.waive(g.db_session)
-        if data == 'unwaive':
-            diff.unwaive(g.db_session)
+        if isinstance(data, dict):
+            try:
+                action = data['action']
+                index = data['index']
+            except KeyError:
+                raise BadRequest(
+                    "Incorrect data format: please provide dict with "
+                    "'action' and 'index'."
+                )
+            if action not in ('waive', 'unwaive'):
+                raise BadRequest(
+                    "Incorrect data: action must be 'waive' or 'unwaive'."
+                )
+            change_waiver(action, id, index)
+            return make_response("", 204)
+        if data not in ('waive', 'unwaive'):
+            raise BadRequest(
+                "Incorrect data: please provide string 'waive' or 'unwaive'."
+            )
+        change_waiver(data, id)
         resp = make_response("", 204)
         return resp
 
@@ -299,7 +622,16 @@ class RPMCommentsList(RPMTableList):
         return resp
 
 flask_api.add_resource(RoutesDict, '/rest')
-flask_api.add_resource(RPMGroupsList, '/rest/groups', '/rest/groups/<int:id>')
+flask_api.add_resource(
+    RPMGroupsList, '/rest/groups', endpoint='rpmgroupslist', methods=['GET']
+)
+flask_api.add_resource(
+    RPMGroupsList,
+    '/rest/groups/<int:id>',
+    endpoint='rpmgroupone',
+    methods=['GET', 'PUT'],
+)
+flask_api.add_resource(RPMGroupProgress, '/rest/groups/<int:id>/progress')
 flask_api.add_resource(
     RPMComparisonsList,
     '/rest/comparisons',
@@ -353,6 +685,14 @@ class RPMIndexView(RPMGroupsList):
     }
     template = 'rpm_show_index.html'
 
+    def template_arguments(self, comps):
+        """Get additional arguments for rendering the template.
+
+        :param list comps: comparison groups to be rendered
+        :return dict: arguments
+        """
+        return {}
+
     def dispatch_request(self, id=None):
         """Render template."""
         additional_modifiers = None
@@ -381,6 +721,7 @@ class RPMIndexView(RPMGroupsList):
             items_count=items_count,
             limit=self.modifiers()['limit'],
             offset=self.modifiers()['offset'],
+            **self.template_arguments(comps)
         )
 
 class RPMComparisonsView(RPMIndexView):
@@ -393,6 +734,16 @@ class RPMGroupsView(RPMIndexView):
     template = 'rpm_show_groups.html'
     endpoint = 'rpmdiff.show_groups'
 
+    def template_arguments(self, comps):
+        """Get progress of the comparison groups.
+
+        :param list comps: comparison groups to be rendered
+        :return dict: arguments
+        """
+        return {'progress': RPMProgress.of_groups(
+            g.db_session, [comp['id'] for comp in comps]
+        )}
+
 class RPMDifferencesView(RPMDifferencesList):
     """View of differences."""
     default_modifiers = {'order_by': [RPMDifference.id]}
@@ -591,14 +942,18 @@ def add_comparison():
         'repository': request.form['repo2'],
     }
 
-    comp = Comparison.add(g.db_session, constants.COMPARISON_TYPE)
-
-    celery_app.send_task('rpmdiff.compare', args=(comp.id, pkg1, pkg2))
+    id_group, coalesced = request_comparison(
+        g.db_session, pkg1, pkg2,
+        routing.queue(app_constants.PRIORITY_INTERACTIVE),
+    )
+    if coalesced:
+        message = ('Identical comparison is already in progress <a href=%s '
+                   'class="alert-link">here</a>.')
+    else:
+        message = ('New comparison group created <a href=%s '
+                   'class="alert-link">here</a>.')
     flash(
-        Markup(
-            'New comparison group created <a href=%s class="alert-link">'
-            'here</a>.' % url_for('rpmdiff.show_group', id=comp.id)
-        ),
+        Markup(message % url_for('rpmdiff.show_group', id=id_group)),
         'success'
     )
     return redirect(url_for('rpmdiff.index'))
@@ -608,9 +963,12 @@ def waive():
     """Waive a difference."""
     if g.get('user', None) is None:
         abort(401)
-    id_diff = request.form['id_diff']
-    diff = g.db_session.query(RPMDifference).filter_by(id=id_diff).first()
-    diff.waive(g.db_session)
+    if 'index' in request.form:
+        change_waiver(
+            'waive', request.form['id_comp'], request.form['index']
+        )
+    else:
+        change_waiver('waive', request.form['id_diff'])
     return redirect(
         url_for('rpmdiff.show_differences', id=request.form['id_comp'])
     )
@@ -620,9 +978,12 @@ def unwaive():
     """Unwaive a difference."""
     if g.get('user', None) is None:
         abort(401)
-    id_diff = request.form['id_diff']
-    diff = g.db_session.query(RPMDifference).filter_by(id=id_diff).first()
-    diff.unwaive(g.db_session)
+    if 'index' in request.form:
+        change_waiver(
+            'unwaive', request.form['id_comp'], request.form['index']
+        )
+    else:
+        change_waiver('unwaive', request.form['id_diff'])
     print(request.form['id_comp'])
     return redirect(
         url_for('rpmdiff.show_differences', id=request.form['id_comp'])
@@ -9,16 +9,28 @@ Created on Tue Oct  3 10:56:53 2017
 @author: Pavla Kratochvilova <pavla.kratochvilova@gmail.com>
 """
 
-from datetime import datetime
-from sqlalchemy import (Column, Integer, String, Text, Boolean, DateTime,
-                        ForeignKey, func)
-from sqlalchemy.orm import relationship, backref, aliased
+import json
+import zlib
+import hashlib
+from datetime import datetime, timedelta
+from sqlalchemy import (Column, Integer, BigInteger, String, Text, Boolean,
+                        DateTime, LargeBinary, ForeignKey, func, select,
+                        event, or_)
+from sqlalchemy.orm import relationship, backref, aliased, column_property
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.session import Session
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.exc import IntegrityError
 from ... database import (Base, Comparison, ComparisonType, User,
-                          general_iter_query_result)
+                          general_iter_query_result, current_period)
 from . import constants
 from ... import constants as app_constants
+from ... import cache
+from ...config import config
+
+# Identical requests are not coalesced into a comparison group in flight for
+# longer than this (in seconds); its task was probably lost
+COALESCE_MAX_AGE = config.getint('web', 'COALESCE_MAX_AGE', fallback=21600)
 
 class BaseExported(object):
     """For exporting attributes from the models."""
@@ -43,11 +55,15 @@ class RPMComparison(BaseExported, Base):
 
     id = Column(Integer, primary_key=True, nullable=False)
     id_group = Column(
-        Integer, ForeignKey('comparisons.id'), nullable=False
+        Integer, ForeignKey('comparisons.id'), nullable=False, index=True
     )
     pkg1_id = Column(Integer, ForeignKey('rpm_packages.id'), nullable=False)
     pkg2_id = Column(Integer, ForeignKey('rpm_packages.id'), nullable=False)
     state = Column(Integer, nullable=False)
+    # partition key, the same as the period of the group
+    period = Column(
+        Integer, nullable=False, default=current_period(), index=True
+    )
 
     rpm_differences = relationship(
         "RPMDifference", back_populates="rpm_comparison"
@@ -73,16 +89,18 @@ class RPMComparison(BaseExported, Base):
                     self.state,
                 )
 
-    def update_state(self, ses, state):
+    def update_state(self, ses, state, commit=True):
         """Update state of the RPMComparison.
 
         :param ses: session for communication with the database
         :type ses: qlalchemy.orm.session.Session
         :param int state: new state
+        :param bool commit: if False, the caller commits the transaction
         """
         self.state = state
         ses.add(self)
-        ses.commit()
+        if commit:
+            ses.commit()
 
     def update_group_state(self, ses, state):
         """Update state of the Comparison.
@@ -94,17 +112,21 @@ class RPMComparison(BaseExported, Base):
         self.comparison.update_state(ses, state)
 
     @staticmethod
-    def add(ses, rpm_package1, rpm_package2, id_group=None):
+    def add(ses, rpm_package1, rpm_package2, id_group=None, commit=True):
         """Add new RPMComparison together with corresponding Comparison.
 
         :param ses: session for communication with the database
         :type ses: qlalchemy.orm.session.Session
         :param RPMPackage rpm_package1: first package
         :param RPMPackage rpm_package2: second package
+        :param bool commit: if False, the RPMComparison is only flushed (to
+            get its id) and the caller commits the transaction
         :return RPMComparison: newly added RPMComparison
         """
         if id_group is None:
-            comparison = Comparison.add(ses, constants.COMPARISON_TYPE)
+            comparison = Comparison.add(
+                ses, constants.COMPARISON_TYPE, commit=commit
+            )
             id_group = comparison.id
 
         rpm_comparison = RPMComparison(
@@ -114,9 +136,24 @@ class RPMComparison(BaseExported, Base):
             state=constants.STATE_NEW,
         )
         ses.add(rpm_comparison)
-        ses.commit()
+        if commit:
+            ses.commit()
+        else:
+            ses.flush()
         return rpm_comparison
 
+    @staticmethod
+    def period_of(id_comp):
+        """Get SQL expression of the period of the RPMComparison, to be used
+        as the period of its rows without querying it first.
+
+        :param int id_comp: RPMComparison id
+        :return: SQL expression
+        """
+        return select([RPMComparison.period]).where(
+            RPMComparison.id == id_comp
+        ).as_scalar()
+
     @staticmethod
     def query(ses):
         """Query RPMComparison joined with its packages and their
@@ -259,8 +296,119 @@ class RPMComparison(BaseExported, Base):
             'state': app_constants.STATE_STRINGS[line.Comparison.state],
         }
 
+class RPMPath(Base):
+    """Database model of paths (and other subjects) of rpm differences. Each
+    path is stored once and referenced by id from rpm_differences."""
+    __tablename__ = 'rpm_paths'
+
+    # Count of digests in one IN clause when looking up paths
+    LOOKUP_CHUNK = 500
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    digest = Column(String(40), nullable=False, unique=True)
+    path = Column(Text, nullable=False)
+
+    def __repr__(self):
+        return "<RPMPath(id='%s', path='%s')>" % (self.id, self.path)
+
+    @staticmethod
+    def digest_of(path):
+        """Get digest identifying the path.
+
+        :param string path: path
+        :return string: hexadecimal sha1 of the path
+        """
+        return hashlib.sha1(path.encode('UTF-8')).hexdigest()
+
+    @staticmethod
+    def ids(ses, paths, lock=False):
+        """Get ids of stored paths.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param iterable paths: paths
+        :param bool lock: lock the paths (FOR SHARE) until the end of the
+            transaction, so that they can't be removed as unused meanwhile
+        :return dict: {path: id} of the paths that are stored
+        """
+        digests = {RPMPath.digest_of(path): path for path in set(paths)}
+        keys = list(digests)
+        ids = {}
+        for start in range(0, len(keys), RPMPath.LOOKUP_CHUNK):
+            query = ses.query(RPMPath.id, RPMPath.digest).filter(
+                RPMPath.digest.in_(keys[start:start + RPMPath.LOOKUP_CHUNK])
+            )
+            if lock:
+                query = query.with_for_update(read=True)
+            for id_path, digest in query:
+                ids[digests[digest]] = id_path
+        return ids
+
+    @staticmethod
+    def insert_new(dialect):
+        """Get insert statement of paths skipping the already stored ones.
+
+        :param string dialect: name of the database dialect
+        :return: insert statement or None if the database can't skip them
+        """
+        table = RPMPath.__table__
+        if dialect == 'postgresql':
+            return postgresql.insert(table).on_conflict_do_nothing(
+                index_elements=[table.c.digest]
+            )
+        if dialect == 'sqlite':
+            return table.insert().prefix_with('OR IGNORE')
+        if dialect == 'mysql':
+            return table.insert().prefix_with('IGNORE')
+        return None
+
+    @staticmethod
+    def intern(ses, paths):
+        """Get ids of the paths; add the paths that are not stored yet. The
+        session is not committed: paths added concurrently are skipped by
+        the insert (or, for other databases, roll back only a savepoint).
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param iterable paths: paths
+        :return dict: {path: id}
+        """
+        paths = set(paths)
+        ids = RPMPath.ids(ses, paths, lock=True)
+        missing = [path for path in paths if path not in ids]
+        if not missing:
+            return ids
+        statement = RPMPath.insert_new(ses.connection().dialect.name)
+        if statement is not None:
+            ses.execute(statement, [
+                {'digest': RPMPath.digest_of(path), 'path': path}
+                for path in missing
+            ])
+            ids.update(RPMPath.ids(ses, missing))
+            return ids
+        try:
+            with ses.begin_nested():
+                ses.add_all([
+                    RPMPath(digest=RPMPath.digest_of(path), path=path)
+                    for path in missing
+                ])
+        except IntegrityError:
+            # Some paths were added concurrently; add the others one by one.
+            for path in missing:
+                try:
+                    with ses.begin_nested():
+                        ses.add(RPMPath(
+                            digest=RPMPath.digest_of(path), path=path
+                        ))
+                except IntegrityError:
+                    pass
+        ids.update(RPMPath.ids(ses, missing))
+        return ids
+
 class RPMDifference(BaseExported, Base):
-    """Database model of rpm differences."""
+    """Database model of rpm differences. The path (diff) is stored in
+    rpm_paths; it is loaded with the difference and can be used in filters
+    like a column."""
     __tablename__ = 'rpm_differences'
 
     to_export = [
@@ -269,14 +417,27 @@ class RPMDifference(BaseExported, Base):
 
     id = Column(Integer, primary_key=True, nullable=False)
     id_comp = Column(
-        Integer, ForeignKey('rpm_comparisons.id'), nullable=False
+        Integer, ForeignKey('rpm_comparisons.id'), nullable=False, index=True
     )
     category = Column(Integer)
     diff_type = Column(Integer, nullable=False)
-    diff_info = Column(String(255))
-    diff = Column(String(255), nullable=False)
+    # new path of renamed files, as long as paths can be
+    diff_info = Column(Text)
+    id_path = Column(
+        Integer, ForeignKey('rpm_paths.id'), nullable=False, index=True
+    )
     state = Column(Integer, nullable=False)
     waived = Column(Boolean, nullable=False)
+    # partition key, the same as the period of the comparison
+    period = Column(
+        Integer, nullable=False, default=current_period(), index=True
+    )
+
+    diff = column_property(
+        select([RPMPath.path]).where(RPMPath.id == id_path).as_scalar()
+    )
+
+    rpm_path = relationship("RPMPath")
 
     rpm_comparison = relationship(
         "RPMComparison", back_populates="rpm_differences"
@@ -347,7 +508,7 @@ class RPMDifference(BaseExported, Base):
             category=category,
             diff_type=diff_type,
             diff_info=diff_info,
-            diff=diff,
+            id_path=RPMPath.intern(ses, [diff])[diff],
             state=state,
             waived=False,
         )
@@ -355,6 +516,74 @@ class RPMDifference(BaseExported, Base):
         ses.commit()
         return difference
 
+    @staticmethod
+    def add_many(ses, id_comp, differences, state=constants.DIFF_STATE_NORMAL,
+                 commit=True):
+        """Add new RPMDifferences of one comparison; paths of all of them are
+        interned at once.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_comp: id of corresponding comparison
+        :param list differences: list of tuples (category, diff type,
+            diff_info, diff)
+        :param int state: state
+        :param bool commit: if False, the caller commits the transaction
+        """
+        path_ids = RPMPath.intern(
+            ses, [difference[3] for difference in differences]
+        )
+        period = ses.query(RPMComparison.period).filter_by(
+            id=id_comp
+        ).scalar()
+        ses.bulk_insert_mappings(RPMDifference, [
+            {
+                'id_comp': id_comp,
+                'category': category,
+                'diff_type': diff_type,
+                'diff_info': diff_info,
+                'id_path': path_ids[diff],
+                'state': state,
+                'waived': False,
+                'period': period,
+            }
+            for category, diff_type, diff_info, diff in differences
+        ])
+        if commit:
+            ses.commit()
+
+    @staticmethod
+    def counts(ses, id_group):
+        """Count differences of all RPMComparisons in the group by their
+        category and diff type.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_group: id of the Comparison
+        :return dict: {category string: {diff type string: count}}
+        """
+        query = ses.query(
+            RPMDifference.category,
+            RPMDifference.diff_type,
+            func.count(RPMDifference.id),
+        ).join(RPMComparison).filter(
+            RPMComparison.id_group == id_group
+        ).group_by(RPMDifference.category, RPMDifference.diff_type)
+
+        blob_query = ses.query(
+            RPMDifferenceCount.category,
+            RPMDifferenceCount.diff_type,
+            RPMDifferenceCount.count,
+        ).join(RPMComparison).filter(RPMComparison.id_group == id_group)
+
+        result = {}
+        for category, diff_type, count in list(query) + list(blob_query):
+            category = constants.CATEGORY_STRINGS.get(category)
+            diff_type = constants.DIFF_TYPE_STRINGS[diff_type]
+            counts = result.setdefault(category, {})
+            counts[diff_type] = counts.get(diff_type, 0) + count
+        return result
+
     @staticmethod
     def query(ses):
         """Query RPMComparison joined with its packages and their repositories,
@@ -402,6 +631,247 @@ class RPMDifference(BaseExported, Base):
             ]
         return result_dict
 
+class RPMDifferenceBlob(Base):
+    """Database model of differences of one RPMComparison stored as a single
+    compressed blob. Used for comparisons with too many differences to store
+    them as rows; their counts are kept in rpm_difference_counts and their
+    waivers in rpm_difference_waivers.
+
+    The blob is zlib-compressed JSON with one list per column (category,
+    diff_type, diff_info, diff, state); differences are identified by their
+    index in the lists.
+    """
+    __tablename__ = 'rpm_difference_blobs'
+
+    COLUMNS = ('category', 'diff_type', 'diff_info', 'diff', 'state')
+
+    id_comp = Column(
+        Integer, ForeignKey('rpm_comparisons.id'), primary_key=True,
+        nullable=False
+    )
+    count = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return "<RPMDifferenceBlob(id_comp='%s', count='%s')>" % (
+            self.id_comp, self.count
+        )
+
+    @staticmethod
+    def encode(differences, state=constants.DIFF_STATE_NORMAL):
+        """Encode differences into the blob.
+
+        :param list differences: list of tuples (category, diff type,
+            diff_info, diff)
+        :param int state: state of all the differences
+        :return bytes: blob
+        """
+        columns = {
+            column: [difference[index] for difference in differences]
+            for index, column in enumerate(RPMDifferenceBlob.COLUMNS[:4])
+        }
+        columns['state'] = [state] * len(differences)
+        return zlib.compress(json.dumps(columns).encode('UTF-8'))
+
+    def decode(self):
+        """Decode the blob.
+
+        :return dict: {column name: list of values}
+        """
+        return json.loads(zlib.decompress(self.data).decode('UTF-8'))
+
+    @staticmethod
+    def add(ses, id_comp, differences, state=constants.DIFF_STATE_NORMAL,
+            commit=True):
+        """Add differences of the RPMComparison as a blob together with their
+        counts.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_comp: id of corresponding comparison
+        :param list differences: list of tuples (category, diff type,
+            diff_info, diff)
+        :param int state: state
+        :param bool commit: if False, the caller commits the transaction
+        """
+        counts = {}
+        for category, diff_type, _, _ in differences:
+            counts[(category, diff_type)] = (
+                counts.get((category, diff_type), 0) + 1
+            )
+        ses.add(RPMDifferenceBlob(
+            id_comp=id_comp,
+            count=len(differences),
+            data=RPMDifferenceBlob.encode(differences, state),
+        ))
+        ses.add_all([
+            RPMDifferenceCount(
+                id_comp=id_comp, category=category, diff_type=diff_type,
+                count=count,
+            )
+            for (category, diff_type), count in counts.items()
+        ])
+        if commit:
+            ses.commit()
+
+    @staticmethod
+    def comparison_ids(ses):
+        """Query ids of RPMComparisons whose differences are stored as blobs.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :return sqlalchemy.orm.query.Query: query
+        """
+        return ses.query(RPMDifferenceBlob.id_comp)
+
+    def differences(self, ses, filters=None, offset=0, limit=None,
+                    order_by=None):
+        """Decode the differences, filter, order and paginate them.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param list filters: list of tuples (column name, operator, value)
+        :param int offset: count of matching differences to skip
+        :param int limit: maximal count of returned differences
+        :param list order_by: list of tuples (column name, True if
+            descending); 'id' orders by index
+        :return list: list of dicts like exported RPMDifferences, with
+            'index' instead of 'id'
+        """
+        return self.page(ses, filters, offset, limit, order_by)[1]
+
+    def page(self, ses, filters=None, offset=0, limit=None, order_by=None):
+        """Decode the differences, filter, order and paginate them. Only the
+        differences in the requested page are converted to dicts.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param list filters: list of tuples (column name, operator, value)
+        :param int offset: count of matching differences to skip
+        :param int limit: maximal count of returned differences
+        :param list order_by: list of tuples (column name, True if
+            descending); 'id' orders by index
+        :return tuple: tuple (count of matching differences, list of dicts
+            like exported RPMDifferences, with 'index' instead of 'id')
+        """
+        columns = self.decode()
+        waived = RPMDifferenceWaiver.indexes(ses, self.id_comp)
+        filters = filters or []
+
+        def column_value(column, index):
+            if column == 'waived':
+                return index in waived
+            if column == 'id':
+                return None
+            return columns[column][index]
+
+        def sort_key(column, index):
+            if column == 'id':
+                return (True, index)
+            value = column_value(column, index)
+            # NULLs (None) first, as they can't be compared with values
+            return (value is not None, value)
+
+        indexes = [
+            index for index in range(self.count)
+            if all(operator(column_value(column, index), value)
+                   for column, operator, value in filters)
+        ]
+        # Stable sorts from the least significant column
+        for column, descending in reversed(order_by or []):
+            indexes.sort(
+                key=lambda index: sort_key(column, index), reverse=descending
+            )
+        end = None if limit is None else offset + limit
+        result = [
+            {
+                'id': None,
+                'index': index,
+                'category': constants.CATEGORY_STRINGS[
+                    columns['category'][index]
+                ],
+                'diff_type': constants.DIFF_TYPE_STRINGS[
+                    columns['diff_type'][index]
+                ],
+                'diff_info': columns['diff_info'][index],
+                'diff': columns['diff'][index],
+                'state': constants.DIFF_STATE_STRINGS[
+                    columns['state'][index]
+                ],
+                'waived': index in waived,
+            }
+            for index in indexes[offset:end]
+        ]
+        return len(indexes), result
+
+class RPMDifferenceCount(Base):
+    """Database model of counts of differences stored in blobs by category
+    and diff type."""
+    __tablename__ = 'rpm_difference_counts'
+
+    id_comp = Column(
+        Integer, ForeignKey('rpm_comparisons.id'), primary_key=True,
+        nullable=False
+    )
+    category = Column(Integer, primary_key=True, nullable=False)
+    diff_type = Column(Integer, primary_key=True, nullable=False)
+    count = Column(Integer, nullable=False)
+
+class RPMDifferenceWaiver(Base):
+    """Database model of waived differences stored in blobs; a difference is
+    waived if it has a row here."""
+    __tablename__ = 'rpm_difference_waivers'
+
+    id_comp = Column(
+        Integer, ForeignKey('rpm_comparisons.id'), primary_key=True,
+        nullable=False
+    )
+    diff_index = Column(Integer, primary_key=True, nullable=False)
+
+    @staticmethod
+    def indexes(ses, id_comp):
+        """Get indexes of waived differences of the RPMComparison.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_comp: id of the RPMComparison
+        :return set: indexes
+        """
+        query = ses.query(RPMDifferenceWaiver.diff_index).filter_by(
+            id_comp=id_comp
+        )
+        return {diff_index for diff_index, in query}
+
+    @staticmethod
+    def waive(ses, id_comp, diff_index):
+        """Waive the difference.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_comp: id of the RPMComparison
+        :param int diff_index: index of the difference in the blob
+        """
+        try:
+            ses.add(RPMDifferenceWaiver(id_comp=id_comp, diff_index=diff_index))
+            ses.commit()
+        except IntegrityError:
+            # Already waived
+            ses.rollback()
+
+    @staticmethod
+    def unwaive(ses, id_comp, diff_index):
+        """Unwaive the difference.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_comp: id of the RPMComparison
+        :param int diff_index: index of the difference in the blob
+        """
+        ses.query(RPMDifferenceWaiver).filter_by(
+            id_comp=id_comp, diff_index=diff_index
+        ).delete(synchronize_session=False)
+        ses.commit()
+
 class RPMPackage(BaseExported, Base):
     """Database model of rpm packages."""
     __tablename__ = 'rpm_packages'
@@ -446,6 +916,26 @@ class RPMPackage(BaseExported, Base):
                     self.id_repo,
                 )
 
+    @staticmethod
+    def query_filters(pkg):
+        """Get filters of the package query from the package parameters.
+
+        :param dict pkg: dict containing package parameters
+        :return dict: filters other than name
+        """
+        filters = {}
+        arch = pkg.get('arch', '')
+        if arch != '' and arch and isinstance(arch, str):
+            filters['arch'] = arch
+        epoch = pkg.get('epoch', '')
+        if epoch != '' and isinstance(epoch, int):
+            filters['epoch'] = epoch
+        for field in ('release', 'version'):
+            value = pkg.get(field, '')
+            if value != '' and isinstance(value, str):
+                filters[field] = value
+        return filters
+
     def rpm_filename(self):
         """Get RPM filename based on the package atributes.
 
@@ -469,7 +959,7 @@ class RPMPackage(BaseExported, Base):
         :param string repo_path: repository baseurl
         :return rpm_db_models.RPMPackage: package
         """
-        id_repo = RPMRepository.add(ses, repo_path).id
+        id_repo = RPMRepository.id_of(ses, repo_path)
 
         try:
             rpm_package = RPMPackage(
@@ -544,6 +1034,8 @@ class RPMRepository(BaseExported, Base):
         "RPMPackage", back_populates="rpm_repository"
     )
 
+    _cache = cache.TTLCache('rpm_repositories')
+
     def __repr__(self):
         return "<RPMRepository(id='%s', path='%s')>" % (self.id, self.path)
 
@@ -565,6 +1057,20 @@ class RPMRepository(BaseExported, Base):
             repo = ses.query(RPMRepository).filter_by(path=repo_path).one()
         return repo
 
+    @staticmethod
+    def id_of(ses, repo_path):
+        """Get cached id of the repository; add the repository if it doesn't
+        exist.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param string repo_path: repository baseurl
+        :return int: id of the repository
+        """
+        return RPMRepository._cache.get(
+            repo_path, lambda: RPMRepository.add(ses, repo_path).id
+        )
+
     @staticmethod
     def query(ses):
         """Query RPMRepository.
@@ -696,6 +1202,336 @@ class RPMComment(BaseExported, Base):
             result_dict['difference'] = RPMDifference.dict_from_line(line)
         return result_dict
 
+class RPMCallback(Base):
+    """Database model of callback URLs notified when a comparison group
+    is finished."""
+    __tablename__ = 'rpm_callbacks'
+
+    id = Column(Integer, primary_key=True, nullable=False)
+    id_group = Column(
+        Integer, ForeignKey('comparisons.id'), nullable=False, index=True
+    )
+    url = Column(Text, nullable=False)
+
+    comparison = relationship("Comparison", backref=backref("rpm_callbacks"))
+
+    def __repr__(self):
+        return "<RPMCallback(id='%s', id_group='%s', url='%s')>" % (
+            self.id, self.id_group, self.url
+        )
+
+    @staticmethod
+    def add(ses, id_group, urls, commit=True):
+        """Add callback URLs of the Comparison.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_group: id of the Comparison
+        :param list urls: list of URL strings
+        :param bool commit: if False, the caller commits the transaction
+        :return list: list of newly added RPMCallbacks
+        """
+        callbacks = [RPMCallback(id_group=id_group, url=url) for url in urls]
+        ses.add_all(callbacks)
+        if commit:
+            ses.commit()
+        return callbacks
+
+    @staticmethod
+    def urls(ses, id_group):
+        """Get callback URLs of the Comparison.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_group: id of the Comparison
+        :return list: list of URL strings
+        """
+        query = ses.query(RPMCallback.url).filter_by(
+            id_group=id_group
+        ).order_by(RPMCallback.id)
+        return [url for (url,) in query]
+
+class RPMProgress(Base):
+    """Database model of progress of running comparison groups."""
+    __tablename__ = 'rpm_progress'
+
+    id_group = Column(
+        Integer, ForeignKey('comparisons.id'), primary_key=True,
+        nullable=False
+    )
+    stage = Column(String(32), nullable=False)
+    stage_started = Column(DateTime, nullable=False)
+    tuple_index = Column(Integer, nullable=False, default=0)
+    tuple_count = Column(Integer, nullable=False, default=0)
+    bytes_downloaded = Column(BigInteger, nullable=False, default=0)
+    # JSON dict {stage: total seconds spent in the stage}
+    timings = Column(Text, nullable=False, default='{}')
+    updated = Column(DateTime, nullable=False)
+
+    comparison = relationship(
+        "Comparison", backref=backref("rpm_progress", uselist=False)
+    )
+
+    def __repr__(self):
+        return ("<RPMProgress(id_group='%s', stage='%s', tuple_index='%s', "
+                "tuple_count='%s', bytes_downloaded='%s')>") % (
+                    self.id_group,
+                    self.stage,
+                    self.tuple_index,
+                    self.tuple_count,
+                    self.bytes_downloaded,
+                )
+
+    @staticmethod
+    def add(ses, id_group):
+        """Add progress of a newly queued comparison group. The session is
+        not committed.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_group: id of the Comparison
+        :return RPMProgress: newly added RPMProgress
+        """
+        now = datetime.utcnow()
+        progress = RPMProgress(
+            id_group=id_group,
+            stage=constants.STAGE_QUEUED,
+            stage_started=now,
+            tuple_index=0,
+            tuple_count=0,
+            bytes_downloaded=0,
+            timings='{}',
+            updated=now,
+        )
+        ses.add(progress)
+        return progress
+
+    @staticmethod
+    def query(ses):
+        """Query RPMProgress.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :return sqlalchemy.orm.query.Query: query
+        """
+        return ses.query(RPMProgress)
+
+    @staticmethod
+    def of_groups(ses, ids):
+        """Get progress of the comparison groups, with counts of requests
+        coalesced into them.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param list ids: ids of the Comparisons
+        :return dict: {id of the Comparison: dict of RPMProgress column
+            values}; groups without progress are missing
+        """
+        if not ids:
+            return {}
+        query = RPMProgress.query(ses).filter(RPMProgress.id_group.in_(ids))
+        progress = {
+            line.id_group: dict(RPMProgress.dict_from_line(line), coalesced=0)
+            for line in query
+        }
+        if not progress:
+            return progress
+        query = ses.query(RPMRequest.id_group, RPMRequest.coalesced).filter(
+            RPMRequest.id_group.in_(list(progress.keys()))
+        )
+        for id_group, coalesced in query:
+            progress[id_group]['coalesced'] = coalesced or 0
+        return progress
+
+    @staticmethod
+    def id_from_line(line):
+        """Get Comparison id from line.
+
+        :param RPMProgress line: RPMProgress
+        :return int: Comparison id
+        """
+        return line.id_group
+
+    @staticmethod
+    def dict_from_line(line):
+        """Get dict from line.
+
+        :param RPMProgress line: RPMProgress
+        :return dict: dict of RPMProgress column values
+        """
+        stage_end = datetime.utcnow()
+        if line.stage == constants.STAGE_FINISHED:
+            stage_end = line.updated
+        return {
+            'id_group': line.id_group,
+            'stage': line.stage,
+            'stage_started': datetime.strftime(
+                line.stage_started, '%Y-%m-%d %H:%M:%S'
+            ),
+            'stage_seconds': round(
+                (stage_end - line.stage_started).total_seconds(), 3
+            ),
+            'tuple': line.tuple_index,
+            'tuples': line.tuple_count,
+            'bytes_downloaded': line.bytes_downloaded,
+            'timings': json.loads(line.timings),
+            'updated': datetime.strftime(line.updated, '%Y-%m-%d %H:%M:%S'),
+        }
+
+class RPMRequest(Base):
+    """Database model of comparison requests. Identical requests submitted
+    while a comparison group is in flight are coalesced into that group."""
+    __tablename__ = 'rpm_requests'
+
+    id_group = Column(
+        Integer, ForeignKey('comparisons.id'), primary_key=True, nullable=False
+    )
+    # Hash of the normalized package dicts; cleared when the group finishes
+    inflight_key = Column(String(64), unique=True, nullable=True)
+    # Count of requests coalesced into this group
+    coalesced = Column(Integer, nullable=False, default=0)
+    # UTC time of the request, for releasing requests whose task was lost
+    created = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    comparison = relationship(
+        "Comparison", backref=backref("rpm_request", uselist=False)
+    )
+
+    def __repr__(self):
+        return ("<RPMRequest(id_group='%s', inflight_key='%s', "
+                "coalesced='%s')>") % (
+                    self.id_group, self.inflight_key, self.coalesced
+                )
+
+    @staticmethod
+    def key(pkg1, pkg2):
+        """Get key identifying the request for comparison of the packages.
+
+        :param dict pkg1: first package dict
+        :param dict pkg2: second package dict
+        :return string: hexadecimal sha256 of the normalized package dicts
+        """
+        # Normalized the way the worker looks the packages up, so that only
+        # requests for the same packages get the same key
+        def normalize(pkg):
+            repository = pkg.get('repository') or ''
+            if not repository.endswith('/'):
+                repository += '/'
+            return {
+                'name': pkg.get('name'),
+                'repository': repository,
+                'filters': RPMPackage.query_filters(pkg),
+            }
+        normalized = json.dumps(
+            [normalize(pkg1), normalize(pkg2)], sort_keys=True
+        )
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def add(ses, id_group, key):
+        """Add in-flight request. The session is not committed; committing
+        raises IntegrityError if an identical request is already in flight.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_group: id of the Comparison
+        :param string key: key of the request
+        :return RPMRequest: newly added RPMRequest
+        """
+        rpm_request = RPMRequest(id_group=id_group, inflight_key=key)
+        ses.add(rpm_request)
+        return rpm_request
+
+    @staticmethod
+    def coalesce(ses, key, max_age=COALESCE_MAX_AGE):
+        """Attach request to the identical in-flight request, if any. The
+        session is not committed. An in-flight request older than max_age or
+        whose group isn't new anymore (its task was lost or failed without
+        finishing it) is released instead.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param string key: key of the request
+        :param int max_age: maximal age of the in-flight request in seconds
+        :return int: id of the in-flight Comparison or None
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+        ses.query(RPMRequest).filter(
+            RPMRequest.inflight_key == key,
+            or_(
+                RPMRequest.created < cutoff,
+                RPMRequest.id_group.in_(select([Comparison.id]).where(
+                    Comparison.state != app_constants.STATE_NEW
+                )),
+            ),
+        ).update({RPMRequest.inflight_key: None}, synchronize_session=False)
+        # The update locks the row, so the group can't be finished before
+        # the caller commits.
+        updated = ses.query(RPMRequest).filter_by(inflight_key=key).update(
+            {RPMRequest.coalesced: RPMRequest.coalesced + 1},
+            synchronize_session=False,
+        )
+        if not updated:
+            return None
+        return ses.query(RPMRequest.id_group).filter_by(
+            inflight_key=key
+        ).scalar()
+
+    @staticmethod
+    def finish(ses, id_group):
+        """Stop coalescing requests into the comparison group. The session is
+        not committed.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_group: id of the Comparison
+        """
+        ses.query(RPMRequest).filter_by(id_group=id_group).update(
+            {RPMRequest.inflight_key: None}, synchronize_session=False
+        )
+
+    @staticmethod
+    def coalesced_count(ses, id_group):
+        """Get count of requests coalesced into the comparison group.
+
+        :param ses: session for communication with the database
+        :type ses: qlalchemy.orm.session.Session
+        :param int id_group: id of the Comparison
+        :return int: count of coalesced requests
+        """
+        count = ses.query(RPMRequest.coalesced).filter_by(
+            id_group=id_group
+        ).scalar()
+        return count or 0
+
+@event.listens_for(Session, 'before_flush')
+def intern_new_paths(ses, flush_context, instances):
+    """Store paths of new RPMDifferences created with the diff attribute
+    (instead of id_path) in rpm_paths.
+
+    :param ses: session being flushed
+    :type ses: qlalchemy.orm.session.Session
+    """
+    differences = [
+        instance for instance in ses.new
+        if isinstance(instance, RPMDifference) and instance.id_path is None
+        and instance.rpm_path is None and instance.diff is not None
+    ]
+    if not differences:
+        return
+    with ses.no_autoflush:
+        paths = {difference.diff for difference in differences}
+        ids = RPMPath.ids(ses, paths)
+        new_paths = {
+            path: RPMPath(digest=RPMPath.digest_of(path), path=path)
+            for path in paths if path not in ids
+        }
+    for difference in differences:
+        if difference.diff in ids:
+            difference.id_path = ids[difference.diff]
+        else:
+            difference.rpm_path = new_paths[difference.diff]
+
 def iter_query_result(result, table):
     """Call general_iter_query_result based on given table.
 
@@ -729,3 +1565,22 @@ pkg1 = aliased(RPMPackage, name='pkg1')
 pkg2 = aliased(RPMPackage, name='pkg2')
 repo1 = aliased(RPMRepository, name='repo1')
 repo2 = aliased(RPMRepository, name='repo2')
+
+@event.listens_for(Session, 'before_flush')
+def inherit_periods(ses, flush_context, instances):
+    """Set partition period of new RPMComparisons and RPMDifferences that
+    don't have it to the period of their group or comparison. It is
+    selected in the insert itself.
+
+    :param ses: session being flushed
+    :type ses: qlalchemy.orm.session.Session
+    """
+    for instance in ses.new:
+        if isinstance(instance, RPMComparison):
+            if instance.period is None and instance.id_group is not None:
+                instance.period = select([Comparison.period]).where(
+                    Comparison.id == instance.id_group
+                ).as_scalar()
+        elif isinstance(instance, RPMDifference):
+            if instance.period is None and instance.id_comp is not None:
+                instance.period = RPMComparison.period_of(instance.id_comp)
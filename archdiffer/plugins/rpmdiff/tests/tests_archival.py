@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+from shutil import rmtree
+from sqlalchemy import select
+from ....config import config
+from .... import database
+from .... import constants as app_constants
+from ..rpm_db_models import (RPMComparison, RPMDifference, RPMDifferenceBlob,
+                             RPMDifferenceWaiver, RPMComment, RPMPackage,
+                             RPMRepository)
+from ..worker.archival import (GroupArchive, groups_to_archive, archive_table,
+                               archive_group, restore_group, group_steps)
+from .. import constants
+
+def differences(*paths):
+    """Make added file differences of the paths."""
+    return [
+        (constants.CATEGORY_FILES, constants.DIFF_TYPE_ADDED, None, path)
+        for path in paths
+    ]
+
+class ArchivalTest(unittest.TestCase):
+    """Tests for archival and restoring of comparison groups."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.archive_dir = os.path.join(self.tmpdir, 'archive')
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+        self.ses = database.session()
+        self.ses.add(database.ComparisonType(id=1, name='rpmdiff'))
+        self.ses.add_all([
+            database.Comparison(id=1, state=1, comparison_type_id=1,
+                                time=datetime(2026, 1, 10), period=202601),
+            database.Comparison(id=2, state=1, comparison_type_id=1,
+                                time=datetime(2026, 10, 10), period=202610),
+            database.Comparison(id=3, state=1, comparison_type_id=1,
+                                time=datetime(2026, 10, 11), period=202610),
+            database.Comparison(id=4, state=0, comparison_type_id=1,
+                                time=datetime(2026, 1, 11), period=202601),
+        ])
+        self.ses.add(RPMRepository(id=1, path='repo'))
+        self.ses.add_all([
+            RPMPackage(id=1, name='a', arch='noarch', epoch=0, version='1.0',
+                       release='1', id_repo=1),
+            RPMPackage(id=2, name='b', arch='noarch', epoch=0, version='1.0',
+                       release='1', id_repo=1),
+        ])
+        self.ses.add_all([
+            RPMComparison(id=1, id_group=1, pkg1_id=1, pkg2_id=1, state=1),
+            RPMComparison(id=2, id_group=1, pkg1_id=2, pkg2_id=2, state=1),
+            RPMComparison(id=3, id_group=2, pkg1_id=1, pkg2_id=1, state=1),
+            RPMComparison(id=4, id_group=3, pkg1_id=2, pkg2_id=2, state=1),
+            RPMComparison(id=5, id_group=4, pkg1_id=1, pkg2_id=1, state=0),
+        ])
+        self.ses.commit()
+        RPMDifference.add_many(self.ses, 1, differences('/x', '/y', '/z'))
+        RPMDifference.add_many(self.ses, 3, differences('/x'))
+        RPMDifferenceBlob.add(self.ses, 2, differences('/blob'))
+        RPMDifferenceWaiver.waive(self.ses, 2, 0)
+        diff = self.ses.query(RPMDifference).filter_by(id_comp=1).first()
+        self.ses.add(RPMComment(text='diff', id_user='user', id_diff=diff.id))
+        self.ses.add(RPMComment(text='comp', id_user='user', id_comp=1))
+        self.ses.commit()
+
+    def tearDown(self):
+        self.ses.close()
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def rows(self, id_group):
+        """Get all rows of the group."""
+        return [
+            sorted(
+                tuple(sorted(row.items()))
+                for row in self.ses.execute(select([model]).where(condition))
+            )
+            for model, condition in group_steps(id_group)
+        ]
+
+    def test_groups_to_archive(self):
+        """Test selection of old groups and groups over the cap."""
+        now = datetime(2026, 10, 19)
+        self.assertEqual(groups_to_archive(self.ses, 30, 0, now=now), [1])
+        self.assertEqual(groups_to_archive(self.ses, 0, 1, now=now), [1])
+        self.assertEqual(groups_to_archive(self.ses, 0, 2, now=now), [])
+        self.assertEqual(groups_to_archive(self.ses, 1, 0, now=now), [1, 2, 3])
+        self.assertEqual(
+            groups_to_archive(self.ses, 1, 0, now=now, limit=2), [1, 2]
+        )
+        self.assertEqual(groups_to_archive(self.ses, 0, 0, now=now), [])
+
+    def test_archive_and_restore(self):
+        """Test that archived group is removed and restored unchanged."""
+        before = self.rows(1)
+        other = self.rows(2)
+
+        # Interrupted archiving continues from the checkpoint
+        archive = GroupArchive(1, self.archive_dir)
+        model, condition = group_steps(1)[4]
+        archive_table(self.ses, archive, model, condition, chunk_size=1)
+        archive.progress('rpm_differences')['done'] = False
+        archive.save()
+
+        counts = archive_group(self.ses, 1, self.archive_dir, chunk_size=2)
+        self.assertEqual(counts, {
+            'rpm_comments': 2,
+            'rpm_differences': 3,
+            'rpm_difference_waivers': 1,
+            'rpm_difference_counts': 1,
+            'rpm_difference_blobs': 1,
+            'rpm_comparisons': 2,
+        })
+        self.assertEqual(
+            self.ses.query(database.Comparison).get(1).state,
+            app_constants.STATE_ARCHIVED
+        )
+        self.assertEqual(self.rows(1), [[]] * 6)
+        self.assertEqual(self.rows(2), other)
+        archive = GroupArchive(1, self.archive_dir)
+        self.assertEqual(archive.progress('rpm_differences')['rows'], 3)
+        self.assertIsNone(archive_group(self.ses, 1, self.archive_dir))
+
+        counts = restore_group(self.ses, 1, self.archive_dir)
+        self.assertEqual(counts['rpm_differences'], 3)
+        self.assertEqual(self.ses.query(database.Comparison).get(1).state, 1)
+        self.assertEqual(self.rows(1), before)
+        self.assertFalse(os.path.exists(archive.path))
+        with self.assertRaises(ValueError):
+            restore_group(self.ses, 1, self.archive_dir)
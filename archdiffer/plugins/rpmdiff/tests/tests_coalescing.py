@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from shutil import rmtree
+from sqlalchemy.exc import IntegrityError
+from ....config import config
+from .... import database
+from .... import constants as app_constants
+from ..rpm_db_models import RPMRequest
+from ..worker import compare
+
+PKG1 = {
+    'name': 'testrpm', 'arch': '', 'epoch': '', 'version': '1.0',
+    'release': '1', 'repository': 'http://example.com/repo/',
+}
+PKG2 = dict(PKG1, version='1.1')
+
+class CoalescingTest(unittest.TestCase):
+    """Tests for coalescing identical in-flight comparison requests."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+        self.ses = database.session()
+        self.ses.add(database.ComparisonType(id=1, name='rpmdiff'))
+        self.ses.add_all([
+            database.Comparison(id=1, state=0, comparison_type_id=1),
+            database.Comparison(id=2, state=0, comparison_type_id=1),
+        ])
+        self.ses.commit()
+
+    def tearDown(self):
+        self.ses.close()
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_key(self):
+        """Test that the key identifies the normalized requests."""
+        key = RPMRequest.key(PKG1, PKG2)
+        same = dict(PKG1, repository='http://example.com/repo', extra='x')
+        del same['arch']
+        self.assertEqual(RPMRequest.key(same, PKG2), key)
+        self.assertNotEqual(RPMRequest.key(PKG2, PKG1), key)
+        self.assertNotEqual(RPMRequest.key(PKG1, dict(PKG2, arch='x')), key)
+        # Only integer epoch filters the packages
+        self.assertEqual(RPMRequest.key(dict(PKG1, epoch='0'), PKG2), key)
+        self.assertEqual(RPMRequest.key(dict(PKG1, epoch=None), PKG2), key)
+        self.assertNotEqual(RPMRequest.key(dict(PKG1, epoch=0), PKG2), key)
+        self.assertNotEqual(
+            RPMRequest.key(dict(PKG1, name=' testrpm'), PKG2), key
+        )
+
+    def test_coalesce(self):
+        """Test attaching requests to the in-flight group until finished."""
+        key = RPMRequest.key(PKG1, PKG2)
+        self.assertIsNone(RPMRequest.coalesce(self.ses, key))
+        RPMRequest.add(self.ses, 1, key)
+        self.ses.commit()
+
+        self.assertEqual(RPMRequest.coalesce(self.ses, key), 1)
+        self.assertEqual(RPMRequest.coalesce(self.ses, key), 1)
+        self.ses.commit()
+        self.assertEqual(RPMRequest.coalesced_count(self.ses, 1), 2)
+
+        RPMRequest.finish(self.ses, 1)
+        self.ses.commit()
+        self.assertIsNone(RPMRequest.coalesce(self.ses, key))
+        self.assertEqual(RPMRequest.coalesced_count(self.ses, 1), 2)
+        self.assertEqual(RPMRequest.coalesced_count(self.ses, 2), 0)
+
+    def test_stale(self):
+        """Test that requests are not coalesced into old or finished
+        groups."""
+        key = RPMRequest.key(PKG1, PKG2)
+        RPMRequest.add(self.ses, 1, key)
+        self.ses.commit()
+        self.assertIsNone(RPMRequest.coalesce(self.ses, key, max_age=-1))
+        self.ses.commit()
+        RPMRequest.add(self.ses, 2, key)
+        self.ses.commit()
+        self.assertEqual(RPMRequest.coalesce(self.ses, key), 2)
+        self.ses.query(database.Comparison).filter_by(id=2).update(
+            {database.Comparison.state: app_constants.STATE_ERROR}
+        )
+        self.assertIsNone(RPMRequest.coalesce(self.ses, key))
+        self.ses.commit()
+
+    def test_inflight_unique(self):
+        """Test that only one identical request can be in flight."""
+        key = RPMRequest.key(PKG1, PKG2)
+        RPMRequest.add(self.ses, 1, key)
+        self.ses.commit()
+        RPMRequest.add(self.ses, 2, key)
+        with self.assertRaises(IntegrityError):
+            self.ses.commit()
+        self.ses.rollback()
+
+    def test_failed_setup(self):
+        """Test that the group is finished and the request released when
+        the compare task fails before comparing."""
+        key = RPMRequest.key(PKG1, PKG2)
+        RPMRequest.add(self.ses, 1, key)
+        self.ses.commit()
+        with mock.patch.object(compare.scratch.space, 'task',
+                               side_effect=OSError('no scratch')):
+            self.assertRaises(OSError, compare.compare, 1, PKG1, PKG2)
+        self.ses.expire_all()
+        self.assertEqual(
+            self.ses.query(database.Comparison).get(1).state,
+            app_constants.STATE_ERROR
+        )
+        self.assertIsNone(RPMRequest.coalesce(self.ses, key))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import unittest
+from ..worker.compare import detect_renames
+
+FILE_MODE = 0o100644
+DIR_MODE = 0o40755
+
+class RenamesTest(unittest.TestCase):
+    """Tests for detection of renamed files."""
+    def test_moved_directory(self):
+        """Test that files of a moved directory are renamed."""
+        files1 = {
+            '/usr/lib/old': ('', 4096, DIR_MODE),
+            '/usr/lib/old/a.py': ('aaa', 10, FILE_MODE),
+            '/usr/lib/old/b.py': ('bbb', 20, FILE_MODE),
+        }
+        files2 = {
+            '/usr/lib/new': ('', 4096, DIR_MODE),
+            '/usr/lib/new/a.py': ('aaa', 10, FILE_MODE),
+            '/usr/lib/new/b.py': ('bbb', 20, FILE_MODE),
+        }
+        differences = [
+            ['removed', '/usr/lib/old'],
+            ['removed', '/usr/lib/old/a.py'],
+            ['removed', '/usr/lib/old/b.py'],
+            ['added', '/usr/lib/new'],
+            ['added', '/usr/lib/new/a.py'],
+            ['added', '/usr/lib/new/b.py'],
+            ['S.5........', '/usr/bin/tool'],
+        ]
+        self.assertEqual(detect_renames(differences, files1, files2), [
+            ['removed', '/usr/lib/old'],
+            ['renamed', '/usr/lib/old/a.py', '/usr/lib/new/a.py'],
+            ['renamed', '/usr/lib/old/b.py', '/usr/lib/new/b.py'],
+            ['added', '/usr/lib/new'],
+            ['S.5........', '/usr/bin/tool'],
+        ])
+
+    def test_same_basename_first(self):
+        """Test that files with the same basename are paired first."""
+        files1 = {
+            '/old/x': ('same', 5, FILE_MODE),
+            '/old/y': ('same', 5, FILE_MODE),
+        }
+        files2 = {
+            '/new/y': ('same', 5, FILE_MODE),
+            '/new/z': ('same', 5, FILE_MODE),
+        }
+        differences = [
+            ['removed', '/old/x'],
+            ['removed', '/old/y'],
+            ['added', '/new/y'],
+            ['added', '/new/z'],
+        ]
+        self.assertEqual(detect_renames(differences, files1, files2), [
+            ['renamed', '/old/x', '/new/z'],
+            ['renamed', '/old/y', '/new/y'],
+        ])
+
+    def test_not_renamed(self):
+        """Test that files with different content, size or mode or empty
+        files are not paired."""
+        files1 = {
+            '/old/digest': ('aaa', 10, FILE_MODE),
+            '/old/mode': ('bbb', 10, FILE_MODE),
+            '/old/empty': ('ccc', 0, FILE_MODE),
+        }
+        files2 = {
+            '/new/digest': ('xxx', 10, FILE_MODE),
+            '/new/mode': ('bbb', 10, 0o100755),
+            '/new/empty': ('ccc', 0, FILE_MODE),
+        }
+        differences = [['removed', path] for path in sorted(files1)] + [
+            ['added', path] for path in sorted(files2)
+        ]
+        self.assertEqual(
+            detect_renames(differences, files1, files2), differences
+        )
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..worker.repodata import Repository, RepodataError
+
+_curdir = os.path.dirname(os.path.abspath(__file__))
+_testdata_dir = os.path.join(_curdir, 'test_repository')
+
+class RepositoryTest(unittest.TestCase):
+    """Tests for the repository metadata reader."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.repo = Repository('file://' + _testdata_dir, self.cachedir)
+        self.repo.load()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def assert_packages(self, packages, versions):
+        """Assert that packages are testrpm packages of given versions.
+
+        :param list packages: packages
+        :param list versions: expected versions
+        """
+        self.assertEqual(
+            sorted(package.version for package in packages), versions
+        )
+        for package in packages:
+            self.assertEqual(package.name, 'testrpm')
+            self.assertEqual(package.arch, 'noarch')
+            self.assertEqual(package.epoch, 0)
+            self.assertEqual(package.release, '1')
+            self.assertEqual(
+                package.location, 'testrpm-%s-1.noarch.rpm' % package.version
+            )
+            self.assertEqual(package.checksum_type, 'sha256')
+            self.assertGreater(package.downloadsize, 0)
+
+    def test_query(self):
+        """Test finding packages in primary_db and primary.xml."""
+        for use_sqlite in (True, False):
+            with self.subTest(use_sqlite=use_sqlite):
+                self.assert_packages(
+                    self.repo.query('testrpm', use_sqlite=use_sqlite),
+                    ['1.0', '1.1'],
+                )
+                self.assert_packages(
+                    self.repo.query(
+                        'testrpm', arch='noarch', epoch=0, version='1.1',
+                        use_sqlite=use_sqlite,
+                    ),
+                    ['1.1'],
+                )
+                self.assertEqual(
+                    self.repo.query('nonexistent', use_sqlite=use_sqlite), []
+                )
+                self.assertEqual(
+                    self.repo.query(
+                        'testrpm', release='2', use_sqlite=use_sqlite
+                    ),
+                    []
+                )
+
+    def test_local_path(self):
+        """Test repository given by a local path."""
+        repo = Repository(_testdata_dir, self.cachedir)
+        repo.load()
+        self.assert_packages(repo.query('testrpm'), ['1.0', '1.1'])
+
+    def test_cache(self):
+        """Test that primary metadata are cached by checksum."""
+        self.repo.query('testrpm')
+        cached = sorted(os.listdir(self.cachedir))
+        self.assertTrue(cached)
+        repo = Repository('file://' + _testdata_dir, self.cachedir)
+        repo.load()
+        repo.query('testrpm')
+        self.assertEqual(sorted(os.listdir(self.cachedir)), cached)
+
+    def test_download(self):
+        """Test downloading packages with checksum verification."""
+        destdir = os.path.join(self.tmpdir, 'packages')
+        os.mkdir(destdir)
+        packages = self.repo.query('testrpm')
+        chunks = []
+        self.repo.download(packages, destdir, chunks.append)
+        self.assertEqual(
+            sum(chunks), sum(package.downloadsize for package in packages)
+        )
+        for package in packages:
+            self.assertEqual(os.path.dirname(package.localPkg()), destdir)
+            self.assertEqual(
+                os.path.getsize(package.localPkg()), package.downloadsize
+            )
+
+        packages[0].checksum = '0' * 64
+        with self.assertRaises(RepodataError):
+            self.repo.download(packages[:1], destdir)
+        packages[1].location = 'nonexistent.rpm'
+        with self.assertRaises(RepodataError):
+            self.repo.download(packages[1:], destdir)
+        # No partial or corrupted files are left
+        self.assertEqual(
+            sorted(os.listdir(destdir)),
+            ['testrpm-1.0-1.noarch.rpm', 'testrpm-1.1-1.noarch.rpm']
+        )
+        for package in packages[:1]:
+            self.assertEqual(
+                os.path.getsize(package.localPkg()), package.downloadsize
+            )
+
+    def test_evict(self):
+        """Test that cached files not used for max_age are removed when new
+        metadata are downloaded."""
+        os.makedirs(self.cachedir)
+        stale = os.path.join(self.cachedir, 'old-primary.sqlite.bz2')
+        leftover = os.path.join(self.cachedir, 'tmp1234.part')
+        for path in (stale, leftover):
+            with open(path, 'w'):
+                pass
+            os.utime(path, (time.time() - 120, time.time() - 120))
+        repo = Repository('file://' + _testdata_dir, self.cachedir, max_age=60)
+        repo.load()
+        repo.query('testrpm')
+        cached = sorted(os.listdir(self.cachedir))
+        self.assertTrue(cached)
+        self.assertNotIn(os.path.basename(stale), cached)
+        self.assertNotIn(os.path.basename(leftover), cached)
+
+        # Used files are kept
+        for name in cached:
+            path = os.path.join(self.cachedir, name)
+            os.utime(path, (time.time() - 120, time.time() - 120))
+        repo.query('testrpm')
+        repo.evict()
+        self.assertEqual(sorted(os.listdir(self.cachedir)), cached)
+
+    def test_missing_repository(self):
+        """Test loading of a nonexistent repository."""
+        repo = Repository(os.path.join(self.tmpdir, 'nothing'), self.cachedir)
+        with self.assertRaises(RepodataError):
+            repo.load()
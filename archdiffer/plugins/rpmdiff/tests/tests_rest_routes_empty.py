@@ -89,9 +89,17 @@ class RESTTestRpmdiffRoutes(RESTTest):
                     "routes": {
                         "/rpmdiff/rest/groups/<int:id>": {
                             "methods": [
-                                "GET"
+                                "GET",
+                                "PUT"
                             ],
-                            "routes": {}
+                            "routes": {
+                                "/rpmdiff/rest/groups/<int:id>/progress": {
+                                    "methods": [
+                                        "GET"
+                                    ],
+                                    "routes": {}
+                                }
+                            }
                         }
                     }
                 },
@@ -10,6 +10,7 @@ Created on Thu May 17 13:20:29 2018
 """
 
 from datetime import datetime
+from ....tests import RESTTest
 from ....tests.tests_rest_routes import RESTTestListsFilled
 from .... import constants as app_constants
 from .... import database
@@ -281,6 +282,7 @@ class RESTTestRpmdiffGroupsFilled(RESTTestListsFilled):
             'state': app_constants.STATE_STRINGS[0],
             'time': '1000-01-01 00:00:00',
             'type': 'rpmdiff',
+            'progress': None,
             'comparisons': [
                 {
                     'id': 1,
@@ -322,6 +324,7 @@ class RESTTestRpmdiffGroupsFilled(RESTTestListsFilled):
             'state': app_constants.STATE_STRINGS[1],
             'time': '2018-01-01 00:00:00',
             'type': 'rpmdiff',
+            'progress': None,
             'comparisons': [
                 {
                     'id': 2,
@@ -396,6 +399,7 @@ class RESTTestRpmdiffGroupsFilled(RESTTestListsFilled):
             'state': app_constants.STATE_STRINGS[1],
             'time': '2000-01-01 00:00:00',
             'type': 'rpmdiff',
+            'progress': None,
             'comparisons': [],
         },
     ]
@@ -1477,3 +1481,74 @@ class RESTTestRpmdiffCommentsFilled(RESTTestListsFilled):
         ({'limit': '2'}, [expected[0], expected[1]]),
         ({'offset': '3'}, [expected[3], expected[4]]),
     ]
+
+class RESTTestRpmdiffGroupProgress(RESTTest):
+    """Tests for getting progress of comparison groups."""
+    route = ROUTES['groups']
+
+    def fill_db(self):
+        """Fill database. Called in setUp."""
+        db_session = database.session()
+        comparison_types = [database.ComparisonType(id=1, name='rpmdiff')]
+        comparisons = [
+            database.Comparison(
+                id=1, state=1, time=datetime(2018, 1, 1), comparison_type_id=1
+            ),
+            database.Comparison(
+                id=2, state=0, time=datetime(2018, 1, 1), comparison_type_id=1
+            ),
+        ]
+        rpm_progress = [
+            rpm_db_models.RPMProgress(
+                id_group=1,
+                stage=constants.STAGE_FINISHED,
+                stage_started=datetime(2018, 1, 1, 0, 0, 0),
+                tuple_index=2,
+                tuple_count=2,
+                bytes_downloaded=1024,
+                timings='{"diff": 1.5, "load": 0.5}',
+                updated=datetime(2018, 1, 1, 0, 0, 2),
+            ),
+        ]
+        db_session.add_all(comparison_types)
+        db_session.add_all(comparisons)
+        rpm_requests = [
+            rpm_db_models.RPMRequest(
+                id_group=1, inflight_key=None, coalesced=3
+            ),
+        ]
+        db_session.add_all(rpm_progress)
+        db_session.add_all(rpm_requests)
+        db_session.commit()
+        db_session.close()
+
+    expected = {
+        'id_group': 1,
+        'stage': constants.STAGE_FINISHED,
+        'stage_started': '2018-01-01 00:00:00',
+        'stage_seconds': 2.0,
+        'tuple': 2,
+        'tuples': 2,
+        'bytes_downloaded': 1024,
+        'timings': {'diff': 1.5, 'load': 0.5},
+        'updated': '2018-01-01 00:00:02',
+        'coalesced': 3,
+    }
+
+    def test_progress(self):
+        """Test getting progress of groups with and without progress."""
+        self.get('%s/1/progress' % self.route)
+        self.assert_code_ok()
+        self.assertEqual(self.response, [self.expected])
+        self.get('%s/2/progress' % self.route)
+        self.assert_code_ok()
+        self.assertEqual(self.response, [])
+
+    def test_groups_progress(self):
+        """Test that groups are listed with their progress."""
+        self.get(self.route)
+        self.assert_code_ok()
+        self.assertEqual(
+            [(group['id'], group['progress']) for group in self.response],
+            [(1, self.expected), (2, None)]
+        )
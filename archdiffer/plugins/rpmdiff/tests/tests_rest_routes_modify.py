@@ -345,6 +345,9 @@ class RESTTestRpmdiffWaive(RESTTest):
             rpm_db_models.RPMComparison(
                 id=1, id_group=1, pkg1_id=1, pkg2_id=2, state=0
             ),
+            rpm_db_models.RPMComparison(
+                id=2, id_group=1, pkg1_id=1, pkg2_id=2, state=0
+            ),
         ]
         rpm_differences = [
             rpm_db_models.RPMDifference(
@@ -363,6 +366,9 @@ class RESTTestRpmdiffWaive(RESTTest):
         db_session.add_all(rpm_comparisons)
         db_session.add_all(rpm_differences)
         db_session.commit()
+        rpm_db_models.RPMDifferenceBlob.add(db_session, 2, [
+            (0, 0, None, 'blob%s' % index) for index in range(3)
+        ])
         db_session.close()
 
     def assert_difference(self, diff_id, waived):
@@ -389,3 +395,44 @@ class RESTTestRpmdiffWaive(RESTTest):
                     self.put(self.route, diff_id, data=data)
                     self.assert_code_eq(requests.codes.no_content)
                     self.assert_difference(diff_id, data == 'waive')
+
+    def test_waive_invalid(self):
+        """Test waiving with invalid data or of unknown difference."""
+        for id, data, code in (
+                (1, 'destroy', requests.codes.bad_request),
+                (99, 'waive', requests.codes.not_found),
+                (2, {'action': 'destroy', 'index': 0},
+                 requests.codes.bad_request),
+                (2, {'action': 'waive', 'index': 3},
+                 requests.codes.bad_request),
+                (2, {'action': 'waive', 'index': -1},
+                 requests.codes.bad_request),
+                (2, {'action': 'waive', 'index': 'x'},
+                 requests.codes.bad_request),
+                (1, {'action': 'waive', 'index': 0},
+                 requests.codes.not_found),
+                (2, {'action': 'waive', 'index': 2},
+                 requests.codes.no_content),
+        ):
+            with self.subTest(id=id, data=data):
+                self.put(self.route, id, data=data)
+                self.assert_code_eq(code)
+
+    def test_pagination(self):
+        """Test that limit and offset apply to differences stored as rows and
+        as blobs together."""
+        for params, expected in (
+                ({'limit': 3}, [(1, [1, 2]), (2, [0])]),
+                ({'limit': 2, 'offset': 1}, [(1, [2]), (2, [0])]),
+                ({'limit': 2, 'offset': 3}, [(2, [1, 2])]),
+                ({'offset': 4}, [(2, [2])]),
+        ):
+            with self.subTest(params=params):
+                self.get(route=self.route, params=params)
+                self.assert_code_ok()
+                self.assertEqual(
+                    [(comp['id'], [diff['id'] or diff['index']
+                                   for diff in comp['differences']])
+                     for comp in self.response],
+                    expected
+                )
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import gzip
+import json
+import unittest
+from datetime import datetime
+from tempfile import mkdtemp
+from shutil import rmtree
+from ....config import config
+from .... import database
+from ..rpm_db_models import (RPMComparison, RPMDifference, RPMDifferenceBlob,
+                             RPMComment, RPMPackage, RPMPath, RPMRepository)
+from ..worker.retention import expired_periods, drop_period
+from ..worker.archival import archive_group, restore_group
+from .. import constants
+
+def differences(*paths):
+    """Make added file differences of the paths."""
+    return [
+        (constants.CATEGORY_FILES, constants.DIFF_TYPE_ADDED, None, path)
+        for path in paths
+    ]
+
+class RetentionTest(unittest.TestCase):
+    """Tests for partitioning and retention of comparisons."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+        self.ses = database.session()
+        self.ses.add(database.ComparisonType(id=1, name='rpmdiff'))
+        self.ses.add_all([
+            database.Comparison(id=1, state=0, comparison_type_id=1,
+                                time=datetime(2026, 1, 10), period=202601),
+            database.Comparison(id=2, state=0, comparison_type_id=1,
+                                time=datetime(2026, 10, 10), period=202610),
+        ])
+        self.ses.add(RPMRepository(id=1, path='repo'))
+        self.ses.add(RPMPackage(
+            id=1, name='testrpm', arch='noarch', epoch=0, version='1.0',
+            release='1', id_repo=1
+        ))
+        self.ses.add_all([
+            RPMComparison(id=1, id_group=1, pkg1_id=1, pkg2_id=1, state=0),
+            RPMComparison(id=2, id_group=2, pkg1_id=1, pkg2_id=1, state=0),
+            RPMComparison(id=3, id_group=1, pkg1_id=1, pkg2_id=1, state=0),
+        ])
+        self.ses.commit()
+        RPMDifference.add_many(self.ses, 1, differences('/old', '/both'))
+        RPMDifference.add_many(self.ses, 2, differences('/new', '/both'))
+        RPMDifferenceBlob.add(self.ses, 3, differences('/blob'))
+        self.ses.add(RPMComment(text='old', id_user='user', id_comp=1))
+        self.ses.commit()
+
+    def tearDown(self):
+        self.ses.close()
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_period_of_time(self):
+        """Test that period is computed from an explicit time of the group,
+        and from the current time otherwise."""
+        self.ses.add_all([
+            database.Comparison(id=3, state=0, comparison_type_id=1,
+                                time=datetime(2001, 3, 4)),
+            database.Comparison(id=4, state=0, comparison_type_id=1),
+        ])
+        self.ses.commit()
+        old = self.ses.query(database.Comparison).get(3)
+        self.assertEqual(old.period, 200103)
+        new = self.ses.query(database.Comparison).get(4)
+        self.assertEqual(new.period, database.period_of(new.time))
+
+    def test_periods(self):
+        """Test that rows inherit period of their group."""
+        self.assertEqual(
+            [comp.period for comp in self.ses.query(RPMComparison).order_by(
+                RPMComparison.id
+            )],
+            [202601, 202610, 202601]
+        )
+        self.assertEqual(
+            sorted(diff.period for diff in self.ses.query(RPMDifference)),
+            [202601, 202601, 202610, 202610]
+        )
+        self.assertEqual(
+            expired_periods(self.ses, 90, now=datetime(2026, 10, 19)),
+            [202601]
+        )
+        self.assertEqual(
+            expired_periods(self.ses, 0, now=datetime(2026, 10, 19)), []
+        )
+
+    def test_drop_period(self):
+        """Test that all rows of the period are removed and archived."""
+        counts = drop_period(self.ses, 202601, archive_dir=self.tmpdir)
+        self.assertEqual(counts['rpm_differences'], 2)
+        self.assertEqual(counts['rpm_comparisons'], 2)
+        self.assertEqual(counts['comparisons'], 1)
+        self.assertEqual(counts['rpm_paths'], 1)
+        self.assertEqual(
+            [comp.id for comp in self.ses.query(RPMComparison)], [2]
+        )
+        self.assertEqual(self.ses.query(RPMDifferenceBlob).count(), 0)
+        self.assertEqual(self.ses.query(RPMComment).count(), 0)
+        self.assertEqual(
+            sorted(path.path for path in self.ses.query(RPMPath)),
+            ['/both', '/new']
+        )
+
+        path = os.path.join(self.tmpdir, 'rpmdiff-202601.jsonl.gz')
+        with gzip.open(path, 'rt') as archive_file:
+            lines = [json.loads(line) for line in archive_file]
+        tables = [line['table'] for line in lines]
+        self.assertEqual(tables.count('rpm_paths'), 2)
+        self.assertEqual(tables.count('rpm_differences'), 2)
+        self.assertEqual(tables.count('rpm_difference_blobs'), 1)
+        self.assertEqual(tables.count('rpm_comments'), 1)
+        self.assertEqual(tables[-1], 'comparisons')
+        self.assertEqual(lines[-1]['row']['time'], '2026-01-10T00:00:00')
+
+    def test_drop_period_keeps_other_paths(self):
+        """Test that only paths of the removed differences are removed, not
+        paths added meanwhile by other tasks."""
+        RPMPath.intern(self.ses, ['/pending'])
+        self.ses.commit()
+        counts = drop_period(self.ses, 202601)
+        self.assertEqual(counts['rpm_paths'], 1)
+        self.assertEqual(
+            sorted(path.path for path in self.ses.query(RPMPath)),
+            ['/both', '/new', '/pending']
+        )
+
+    def test_archived_group(self):
+        """Test that archived groups are kept by the retention and can be
+        restored."""
+        archive_dir = os.path.join(self.tmpdir, 'archive')
+        archive_group(self.ses, 1, archive_dir)
+        now = datetime(2026, 10, 19)
+        self.assertEqual(expired_periods(self.ses, 90, now=now), [])
+        counts = drop_period(self.ses, 202601)
+        self.assertEqual(counts['comparisons'], 0)
+        self.assertEqual(counts['rpm_paths'], 0)
+        self.assertTrue(os.path.isdir(
+            os.path.join(archive_dir, 'rpmdiff-group-1')
+        ))
+
+        restore_group(self.ses, 1, archive_dir)
+        self.assertEqual(
+            sorted(comp.id for comp in self.ses.query(RPMComparison)),
+            [1, 2, 3]
+        )
+        self.assertEqual(expired_periods(self.ses, 90, now=now), [202601])
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import threading
+import subprocess
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..worker.scratch import ScratchSpace, ScratchError
+
+class ScratchTest(unittest.TestCase):
+    """Tests for the scratch space of tasks."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.space = ScratchSpace(self.tmpdir, 1000)
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_cleanup(self):
+        """Test that the directory and reservation are removed."""
+        with self.space.task() as scratch:
+            path = scratch.path
+            with open(os.path.join(path, 'package.rpm'), 'w') as package:
+                package.write('content')
+            scratch.reserve(600)
+            self.assertEqual(self.space.reserved(), 600)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.space.reserved(), 0)
+
+    def test_quota(self):
+        """Test that a task waits until there is enough space."""
+        first = self.space.task()
+        first.reserve(600)
+        second = self.space.task()
+        with self.assertRaises(ScratchError):
+            second.reserve(600, timeout=0.2, interval=0.05)
+
+        thread = threading.Thread(target=second.reserve, args=(600,),
+                                  kwargs={'interval': 0.05})
+        thread.start()
+        time.sleep(0.2)
+        self.assertTrue(thread.is_alive())
+        first.cleanup()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.space.reserved(), 600)
+        second.cleanup()
+
+    def test_over_quota_alone(self):
+        """Test that a task larger than the quota runs if it is alone."""
+        with self.space.task() as scratch:
+            scratch.reserve(5000, timeout=0.2, interval=0.05)
+            scratch.reserve(1000, timeout=0.2, interval=0.05)
+            self.assertEqual(self.space.reserved(), 6000)
+
+    def test_stale(self):
+        """Test that space of processes that died is released."""
+        process = subprocess.Popen(['true'])
+        process.wait()
+        name = '%s-stale' % process.pid
+        os.makedirs(os.path.join(self.space.tasks_dir, name))
+        os.makedirs(self.space.reservations_dir)
+        with open(os.path.join(self.space.reservations_dir, name), 'w') as f:
+            f.write('1000')
+        with self.space.task() as scratch:
+            scratch.reserve(1000, timeout=0.2, interval=0.05)
+        self.space.cleanup_stale()
+        self.assertEqual(os.listdir(self.space.tasks_dir), [])
+        self.assertEqual(os.listdir(self.space.reservations_dir), [])
+
+    def test_shared_usage(self):
+        """Test that files in the root outside of tasks count against the
+        quota, but don't stop a task that is alone."""
+        cache_dir = os.path.join(self.tmpdir, 'repodata')
+        os.makedirs(cache_dir)
+        with open(os.path.join(cache_dir, 'primary.sqlite'), 'w') as cache:
+            cache.write('x' * 500)
+        self.assertEqual(self.space.shared_usage(), 500)
+
+        first = self.space.task()
+        first.reserve(400, timeout=0.2, interval=0.05)
+        second = self.space.task()
+        with self.assertRaises(ScratchError):
+            second.reserve(200, timeout=0.2, interval=0.05)
+        second.reserve(100, timeout=0.2, interval=0.05)
+        second.cleanup()
+        first.cleanup()
+
+    def test_usage(self):
+        """Test that size of files of the task is counted."""
+        with self.space.task() as scratch:
+            os.makedirs(os.path.join(scratch.path, 'repo'))
+            with open(os.path.join(scratch.path, 'repo', 'repomd.xml'),
+                      'w') as metadata:
+                metadata.write('x' * 300)
+            self.assertEqual(scratch.usage(), 300)
+            self.assertEqual(self.space.shared_usage(), 0)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import operator
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from sqlalchemy import Text
+from ....config import config
+from .... import database
+from ..rpm_db_models import (RPMComparison, RPMDifference, RPMDifferenceBlob,
+                             RPMDifferenceWaiver, RPMPackage, RPMPath,
+                             RPMRepository)
+from .. import constants
+
+DIFFERENCES = [
+    (constants.CATEGORY_FILES, constants.DIFF_TYPE_REMOVED, None, '/a'),
+    (constants.CATEGORY_FILES, constants.DIFF_TYPE_ADDED, None, '/b'),
+    (constants.CATEGORY_FILES, constants.DIFF_TYPE_CHANGED, 'S.5', '/c'),
+    (constants.CATEGORY_TAGS, constants.DIFF_TYPE_CHANGED, None, 'NAME'),
+]
+
+class StorageTest(unittest.TestCase):
+    """Tests for storage of rpm differences."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+        self.ses = database.session()
+        self.ses.add(database.ComparisonType(id=1, name='rpmdiff'))
+        self.ses.add(database.Comparison(id=1, state=0, comparison_type_id=1))
+        self.ses.add(RPMRepository(id=1, path='repo'))
+        self.ses.add(RPMPackage(
+            id=1, name='testrpm', arch='noarch', epoch=0, version='1.0',
+            release='1', id_repo=1
+        ))
+        self.ses.add_all([
+            RPMComparison(id=1, id_group=1, pkg1_id=1, pkg2_id=1, state=0),
+            RPMComparison(id=2, id_group=1, pkg1_id=1, pkg2_id=1, state=0),
+        ])
+        self.ses.commit()
+
+    def tearDown(self):
+        self.ses.close()
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_interned_paths(self):
+        """Test that each path is stored once."""
+        long_path = '/long' * 100
+        RPMDifference.add_many(self.ses, 1, DIFFERENCES)
+        RPMDifference.add_many(self.ses, 2, DIFFERENCES + [
+            (constants.CATEGORY_FILES, constants.DIFF_TYPE_ADDED, None,
+             long_path),
+        ])
+        self.ses.add(RPMDifference(
+            id_comp=2, category=constants.CATEGORY_FILES,
+            diff_type=constants.DIFF_TYPE_REMOVED, diff='/a',
+            state=constants.DIFF_STATE_NORMAL, waived=False,
+        ))
+        self.ses.commit()
+        self.assertEqual(self.ses.query(RPMPath).count(), 5)
+        self.assertEqual(
+            sorted(diff.diff for diff in self.ses.query(RPMDifference)),
+            sorted(['/a', '/a', '/a', '/b', '/b', '/c', '/c', 'NAME', 'NAME',
+                    long_path])
+        )
+        self.assertEqual(
+            self.ses.query(RPMDifference).filter(
+                RPMDifference.diff == '/a'
+            ).count(),
+            3
+        )
+
+    def test_long_rename(self):
+        """Test that renamed files keep new paths longer than 255 characters.
+        """
+        long_path = '/long' * 100
+        RPMDifference.add_many(self.ses, 1, [
+            (constants.CATEGORY_FILES, constants.DIFF_TYPE_RENAMED,
+             long_path, '/a'),
+        ])
+        self.assertIsInstance(RPMDifference.diff_info.type, Text)
+        diff = self.ses.query(RPMDifference).one()
+        self.assertEqual((diff.diff, diff.diff_info), ('/a', long_path))
+
+    def test_intern_in_transaction(self):
+        """Test that interning doesn't commit or roll back the session."""
+        RPMDifference.add_many(self.ses, 1, DIFFERENCES[:2])
+        self.ses.commit()
+        RPMDifference.add_many(self.ses, 2, DIFFERENCES, commit=False)
+        self.assertEqual(self.ses.query(RPMPath).count(), 4)
+        self.ses.rollback()
+        self.assertEqual(self.ses.query(RPMPath).count(), 2)
+        self.assertEqual(self.ses.query(RPMDifference).count(), 2)
+
+    def test_blob(self):
+        """Test filtering, pagination and waivers of blob differences."""
+        RPMDifference.add_many(self.ses, 1, DIFFERENCES[:1])
+        RPMDifferenceBlob.add(self.ses, 2, DIFFERENCES)
+        blob = self.ses.query(RPMDifferenceBlob).get(2)
+        self.assertEqual(
+            [diff['diff'] for diff in blob.differences(self.ses)],
+            ['/a', '/b', '/c', 'NAME']
+        )
+        files = [('category', operator.eq, constants.CATEGORY_FILES)]
+        self.assertEqual(
+            [diff['index'] for diff in blob.differences(
+                self.ses, files, offset=1, limit=1
+            )],
+            [1]
+        )
+
+        self.assertEqual(
+            blob.page(self.ses, files, offset=1, limit=1,
+                      order_by=[('diff', True)]),
+            (3, blob.differences(self.ses, files)[1:2])
+        )
+        self.assertEqual(
+            [diff['diff'] for diff in blob.differences(
+                self.ses, order_by=[('category', True), ('diff', True)]
+            )],
+            ['/c', '/b', '/a', 'NAME']
+        )
+
+        RPMDifferenceWaiver.waive(self.ses, 2, 2)
+        RPMDifferenceWaiver.waive(self.ses, 2, 2)
+        waived = blob.differences(
+            self.ses, [('waived', operator.eq, True)]
+        )
+        self.assertEqual(len(waived), 1)
+        self.assertEqual(waived[0]['diff_info'], 'S.5')
+        self.assertEqual(waived[0]['diff_type'], 'changed')
+        RPMDifferenceWaiver.unwaive(self.ses, 2, 2)
+        self.assertEqual(RPMDifferenceWaiver.indexes(self.ses, 2), set())
+
+        self.assertEqual(RPMDifference.counts(self.ses, 1), {
+            'files': {'removed': 2, 'added': 1, 'changed': 1},
+            'tags': {'changed': 1},
+        })
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import sqlite3
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from sqlalchemy import inspect
+from ....config import config
+from .... import database
+from ..rpm_db_models import RPMComparison, RPMDifference, RPMPath
+from ..upgrade import upgrade_db
+
+# Tables changed by the upgrade, as created by the previous version
+OLD_SCHEMA = '''
+CREATE TABLE comparison_types (
+    id INTEGER NOT NULL, name VARCHAR(255) NOT NULL,
+    PRIMARY KEY (id), UNIQUE (name)
+);
+CREATE TABLE users (
+    openid VARCHAR(255) NOT NULL, name VARCHAR(255) NOT NULL,
+    api_login VARCHAR(40), api_token VARCHAR(40),
+    api_token_expiration DATE NOT NULL,
+    PRIMARY KEY (openid), UNIQUE (name)
+);
+CREATE TABLE comparisons (
+    id INTEGER NOT NULL, time DATETIME,
+    comparison_type_id INTEGER NOT NULL, state INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(comparison_type_id) REFERENCES comparison_types (id)
+);
+CREATE TABLE rpm_repositories (
+    id INTEGER NOT NULL, path VARCHAR(255) NOT NULL,
+    PRIMARY KEY (id), UNIQUE (path)
+);
+CREATE TABLE rpm_packages (
+    id INTEGER NOT NULL, name VARCHAR(255) NOT NULL,
+    arch VARCHAR(255) NOT NULL, epoch INTEGER NOT NULL,
+    version VARCHAR(255) NOT NULL, release VARCHAR(255) NOT NULL,
+    id_repo INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (name, arch, epoch, version, release, id_repo),
+    FOREIGN KEY(id_repo) REFERENCES rpm_repositories (id)
+);
+CREATE TABLE rpm_comparisons (
+    id INTEGER NOT NULL, id_group INTEGER NOT NULL,
+    pkg1_id INTEGER NOT NULL, pkg2_id INTEGER NOT NULL,
+    state INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(id_group) REFERENCES comparisons (id),
+    FOREIGN KEY(pkg1_id) REFERENCES rpm_packages (id),
+    FOREIGN KEY(pkg2_id) REFERENCES rpm_packages (id)
+);
+CREATE TABLE rpm_differences (
+    id INTEGER NOT NULL, id_comp INTEGER NOT NULL, category INTEGER,
+    diff_type INTEGER NOT NULL, diff_info VARCHAR(255),
+    diff VARCHAR(255) NOT NULL, state INTEGER NOT NULL,
+    waived BOOLEAN NOT NULL,
+    PRIMARY KEY (id),
+    FOREIGN KEY(id_comp) REFERENCES rpm_comparisons (id),
+    CHECK (waived IN (0, 1))
+);
+CREATE TABLE rpm_comments (
+    id INTEGER NOT NULL, time DATETIME, text TEXT,
+    id_user VARCHAR(255) NOT NULL, id_comp INTEGER, id_diff INTEGER,
+    PRIMARY KEY (id),
+    FOREIGN KEY(id_user) REFERENCES users (openid),
+    FOREIGN KEY(id_comp) REFERENCES rpm_comparisons (id),
+    FOREIGN KEY(id_diff) REFERENCES rpm_differences (id)
+);
+INSERT INTO comparison_types VALUES (1, 'rpmdiff');
+INSERT INTO comparisons VALUES (1, '2026-01-10 00:00:00.000000', 1, 1);
+INSERT INTO comparisons VALUES (2, '2026-10-10 00:00:00.000000', 1, 1);
+INSERT INTO rpm_repositories VALUES (1, 'repo');
+INSERT INTO rpm_packages VALUES (1, 'a', 'noarch', 0, '1.0', '1', 1);
+INSERT INTO rpm_comparisons VALUES (1, 1, 1, 1, 1);
+INSERT INTO rpm_comparisons VALUES (2, 2, 1, 1, 1);
+INSERT INTO rpm_differences VALUES (1, 1, 2, 0, NULL, '/a', 0, 0);
+INSERT INTO rpm_differences VALUES (2, 1, 2, 0, NULL, '/b', 0, 0);
+INSERT INTO rpm_differences VALUES (3, 2, 2, 0, NULL, '/a', 0, 1);
+'''
+
+class UpgradeTest(unittest.TestCase):
+    """Tests for upgrading database of the previous version."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        path = os.path.join(self.tmpdir, 'test.db')
+        connection = sqlite3.connect(path)
+        connection.executescript(OLD_SCHEMA)
+        connection.close()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % path
+        database.engine(force_new=True)
+
+    def tearDown(self):
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_upgrade(self):
+        """Test that rows of the previous version can be read after the
+        upgrade, and that the upgrade can be run again."""
+        upgrade_db()
+        upgrade_db()
+
+        engine = database.engine()
+        self.assertNotIn('diff', {
+            info['name']
+            for info in inspect(engine).get_columns('rpm_differences')
+        })
+        self.assertIn('ix_rpm_differences_period', {
+            index['name']
+            for index in inspect(engine).get_indexes('rpm_differences')
+        })
+        ses = database.session()
+        try:
+            self.assertEqual(
+                [comp.period for comp in ses.query(database.Comparison)],
+                [202601, 202610]
+            )
+            self.assertEqual(
+                [comp.period for comp in ses.query(RPMComparison)],
+                [202601, 202610]
+            )
+            self.assertEqual(
+                [(diff.id, diff.diff, diff.period) for diff in ses.query(
+                    RPMDifference
+                ).order_by(RPMDifference.id)],
+                [(1, '/a', 202601), (2, '/b', 202601), (3, '/a', 202610)]
+            )
+            self.assertEqual(ses.query(RPMPath).count(), 2)
+        finally:
+            ses.close()
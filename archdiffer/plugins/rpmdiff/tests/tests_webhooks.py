@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import time
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import requests
+from ....tests import RESTTest
+from .... import database
+from ..worker.notify import deliver
+from .tests_rest_constants import ROUTES
+
+_curdir = os.path.dirname(os.path.abspath(__file__))
+_testdata_dir = os.path.join(_curdir, 'test_repository')
+
+class CallbackHandler(BaseHTTPRequestHandler):
+    """Handler of the stand-in server: saves JSON payloads of POST requests;
+    responds with error to paths starting with /fail."""
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        payload = json.loads(self.rfile.read(length).decode('utf-8'))
+        if self.path.startswith('/fail'):
+            self.send_response(500)
+        else:
+            self.server.received.append((self.path, payload))
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class CallbackServer():
+    """Local HTTP stand-in for the callback receivers."""
+    def __init__(self):
+        self.httpd = HTTPServer(('127.0.0.1', 0), CallbackHandler)
+        self.httpd.received = []
+        self.url = 'http://127.0.0.1:%s' % self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def received(self):
+        return self.httpd.received
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class DeliverTest(unittest.TestCase):
+    """Tests for delivering the payload."""
+    def setUp(self):
+        self.server = CallbackServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_deliver(self):
+        """Test successful delivery."""
+        payload = json.dumps({'id': 1}).encode('utf-8')
+        self.assertTrue(deliver(self.server.url + '/done', payload))
+        self.assertEqual(self.server.received, [('/done', {'id': 1})])
+
+    def test_deliver_failed(self):
+        """Test delivery to a failing or unreachable receiver."""
+        payload = json.dumps({'id': 1}).encode('utf-8')
+        self.assertFalse(deliver(self.server.url + '/fail', payload))
+        self.assertFalse(deliver('http://127.0.0.1:1/', payload, timeout=1))
+        self.assertEqual(self.server.received, [])
+
+class RESTTestRpmdiffCallbacks(RESTTest):
+    """Tests for callbacks of posted comparisons."""
+    route = ROUTES['comparisons']
+
+    def fill_db(self):
+        """Fill database. Called in setUp."""
+        db_session = database.session()
+        comparison_types = [database.ComparisonType(id=1, name='rpmdiff')]
+        db_session.add_all(comparison_types)
+        db_session.commit()
+        db_session.close()
+
+    def setUp(self):
+        super().setUp()
+        self.server = CallbackServer()
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        super().tearDown()
+
+    def data(self, callbacks):
+        """Make data for the comparison request.
+
+        :param list callbacks: callback URLs
+        :return dict: data
+        """
+        repository = 'file://' + _testdata_dir
+        return {
+            'pkg1': {
+                'name': 'testrpm', 'version': '1.0', 'release': '1',
+                'repository': repository,
+            },
+            'pkg2': {
+                'name': 'testrpm', 'version': '1.1', 'release': '1',
+                'repository': repository,
+            },
+            'callbacks': callbacks,
+        }
+
+    def wait_for_callback(self, location, timeout=60):
+        """Wait until the stand-in server receives a callback. Fail if it
+        doesn't come in time or the comparison group fails.
+
+        :param string location: url of the comparison group
+        :param int timeout: how long should wait for the callback, in
+            seconds
+        """
+        deadline = time.monotonic() + timeout
+        while not self.server.received:
+            if time.monotonic() > deadline:
+                self.fail('No callback received in %s seconds.' % timeout)
+            state = requests.get(location).json()[0]['state']
+            if state not in ('new', 'done'):
+                self.fail('Comparison group ended in state %s.' % state)
+            time.sleep(0.5)
+
+    def test_invalid_callbacks(self):
+        """Test posting comparison with invalid callbacks."""
+        for callbacks in ('http://example.com', ['ftp://example.com'], [1]):
+            with self.subTest(callbacks=callbacks):
+                self.post(route=self.route, data=self.data(callbacks))
+                self.assert_code_eq(requests.codes.bad_request)
+
+    def test_callback(self):
+        """Test that the summary is delivered when the comparison is done."""
+        self.post(
+            route=self.route, data=self.data([self.server.url + '/done'])
+        )
+        self.assert_code_eq(requests.codes.created)
+        self.wait_for_callback(self.headers['location'])
+        self.assertEqual(len(self.server.received), 1)
+        path, summary = self.server.received[0]
+        self.assertEqual(path, '/done')
+        self.assertEqual(summary['type'], 'rpmdiff')
+        self.assertEqual(summary['state'], 'done')
+        self.assertEqual(summary['comparisons'], {'done': 1})
+        self.assertEqual(summary['differences']['files']['added'], 2)
+        self.assertEqual(summary['differences']['files']['removed'], 2)
+        self.assertEqual(summary['differences']['files']['changed'], 3)
+        self.assertEqual(summary['differences_count'], 7)
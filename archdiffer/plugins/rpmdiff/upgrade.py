@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import argparse
+from datetime import datetime
+from sqlalchemy import (inspect, select, table, column, bindparam, Integer,
+                        DateTime, String)
+from ... import database
+from .database import init_db
+from .rpm_db_models import RPMPath
+
+# Count of rows updated in one transaction
+CHUNK_SIZE = 1000
+
+# Tables with the columns of the previous version used by the upgrade
+comparisons = table(
+    'comparisons', column('id', Integer), column('time', DateTime),
+    column('period', Integer)
+)
+rpm_comparisons = table(
+    'rpm_comparisons', column('id', Integer), column('id_group', Integer),
+    column('period', Integer)
+)
+rpm_differences = table(
+    'rpm_differences', column('id', Integer), column('id_comp', Integer),
+    column('diff', String), column('id_path', Integer),
+    column('period', Integer)
+)
+
+def columns(connection, table_name):
+    """Get names of columns of the table in the database.
+
+    :param connection: database connection
+    :param string table_name: name of the table
+    :return set: names of the columns
+    """
+    return {
+        info['name'] for info in inspect(connection).get_columns(table_name)
+    }
+
+def add_column(connection, table_name, column_name, column_type='INTEGER'):
+    """Add nullable column to the table if the table doesn't have it.
+
+    :param connection: database connection
+    :param string table_name: name of the table
+    :param string column_name: name of the column
+    :param string column_type: SQL type of the column
+    :return bool: True if the column was added
+    """
+    if column_name in columns(connection, table_name):
+        return False
+    connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+        table_name, column_name, column_type
+    ))
+    return True
+
+def set_not_null(connection, table_name, column_name, column_type='INTEGER'):
+    """Make the column NOT NULL. SQLite can't change columns; there the
+    column stays nullable, which the models don't rely on.
+
+    :param connection: database connection
+    :param string table_name: name of the table
+    :param string column_name: name of the column
+    :param string column_type: SQL type of the column
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL' % (
+            table_name, column_name
+        ))
+    elif dialect == 'mysql':
+        connection.execute('ALTER TABLE %s MODIFY %s %s NOT NULL' % (
+            table_name, column_name, column_type
+        ))
+
+def fill_comparison_periods(engine):
+    """Set period of Comparisons without it from their time.
+
+    :param engine: database engine
+    :return int: count of updated rows
+    """
+    statement = comparisons.update().where(
+        comparisons.c.id == bindparam('comp_id')
+    ).values(period=bindparam('comp_period'))
+    count = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                select([comparisons.c.id, comparisons.c.time]).where(
+                    comparisons.c.period.is_(None)
+                ).order_by(comparisons.c.id).limit(CHUNK_SIZE)
+            ).fetchall()
+            if not rows:
+                return count
+            connection.execute(statement, [{
+                'comp_id': comp_id,
+                'comp_period': database.period_of(time or datetime.now()),
+            } for comp_id, time in rows])
+        count += len(rows)
+
+def fill_periods(engine):
+    """Set period of RPMComparisons and RPMDifferences without it to the
+    period of their group.
+
+    :param engine: database engine
+    """
+    with engine.begin() as connection:
+        connection.execute(rpm_comparisons.update().where(
+            rpm_comparisons.c.period.is_(None)
+        ).values(period=select([comparisons.c.period]).where(
+            comparisons.c.id == rpm_comparisons.c.id_group
+        ).as_scalar()))
+        connection.execute(rpm_differences.update().where(
+            rpm_differences.c.period.is_(None)
+        ).values(period=select([rpm_comparisons.c.period]).where(
+            rpm_comparisons.c.id == rpm_differences.c.id_comp
+        ).as_scalar()))
+
+def intern_paths(engine):
+    """Store paths of RPMDifferences in rpm_paths and set their id_path.
+
+    :param engine: database engine
+    :return int: count of updated rows
+    """
+    statement = rpm_differences.update().where(
+        rpm_differences.c.id == bindparam('diff_id')
+    ).values(id_path=bindparam('path_id'))
+    ses = database.session()
+    count = 0
+    try:
+        while True:
+            rows = ses.execute(
+                select([rpm_differences.c.id, rpm_differences.c.diff]).where(
+                    rpm_differences.c.id_path.is_(None)
+                ).order_by(rpm_differences.c.id).limit(CHUNK_SIZE)
+            ).fetchall()
+            if not rows:
+                return count
+            path_ids = RPMPath.intern(ses, [diff for _, diff in rows])
+            ses.execute(statement, [
+                {'diff_id': diff_id, 'path_id': path_ids[diff]}
+                for diff_id, diff in rows
+            ])
+            ses.commit()
+            count += len(rows)
+    except:
+        ses.rollback()
+        raise
+    finally:
+        ses.close()
+
+def widen_diff_info(connection):
+    """Change type of rpm_differences.diff_info to text. SQLite doesn't
+    limit length of strings, so it needs no change.
+
+    :param connection: database connection
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        connection.execute(
+            'ALTER TABLE rpm_differences ALTER COLUMN diff_info TYPE TEXT'
+        )
+    elif dialect == 'mysql':
+        connection.execute('ALTER TABLE rpm_differences MODIFY diff_info TEXT')
+
+def create_indexes(engine):
+    """Create indexes of the models missing in the database.
+
+    :param engine: database engine
+    :return list: names of the created indexes
+    """
+    created = []
+    inspector = inspect(engine)
+    for model_table in database.Base.metadata.sorted_tables:
+        existing = {
+            index['name'] for index in inspector.get_indexes(model_table.name)
+        }
+        for index in model_table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+    return created
+
+def upgrade_db():
+    """Upgrade database created by an older version: create new tables,
+    add partition periods, move paths of differences to rpm_paths, widen
+    diff_info and create new indexes. Steps already done are skipped, so
+    an interrupted upgrade can be run again. Frontend and workers must be
+    stopped meanwhile.
+    """
+    init_db()
+    engine = database.engine()
+
+    with engine.begin() as connection:
+        add_column(connection, 'comparisons', 'period')
+    print('Periods of comparison groups set: %s' % fill_comparison_periods(
+        engine
+    ))
+    with engine.begin() as connection:
+        add_column(connection, 'rpm_comparisons', 'period')
+        add_column(connection, 'rpm_differences', 'period')
+    fill_periods(engine)
+    with engine.begin() as connection:
+        for table_name in ('comparisons', 'rpm_comparisons',
+                           'rpm_differences'):
+            set_not_null(connection, table_name, 'period')
+    print('Periods of comparisons and differences set.')
+
+    if 'diff' in columns(engine, 'rpm_differences'):
+        with engine.begin() as connection:
+            add_column(connection, 'rpm_differences', 'id_path')
+        print('Paths of differences stored: %s' % intern_paths(engine))
+        with engine.begin() as connection:
+            connection.execute('ALTER TABLE rpm_differences DROP COLUMN diff')
+            set_not_null(connection, 'rpm_differences', 'id_path')
+            if connection.dialect.name != 'sqlite':
+                connection.execute(
+                    'ALTER TABLE rpm_differences ADD FOREIGN KEY (id_path) '
+                    'REFERENCES rpm_paths (id)'
+                )
+    with engine.begin() as connection:
+        widen_diff_info(connection)
+
+    print('Indexes created: %s' % ', '.join(create_indexes(engine)))
+
+def main(argv=None):
+    """Upgrade the database from the command line.
+
+    :param list argv: command line arguments
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description='Upgrade archdiffer and rpmdiff database created by an '
+                    'older version. Stop the frontend and the workers first.'
+    )
+    parser.parse_args(argv)
+    upgrade_db()
+    return 0
@@ -10,4 +10,4 @@ Created on Sat Nov 25 11:43:08 2017
 @author: Pavla Kratochvilova <pavla.kratochvilova@gmail.com>
 """
 
-from . import compare, filter_diffs
+from . import compare, filter_diffs, notify, retention, archival
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import gzip
+import json
+import base64
+import shutil
+import argparse
+import datetime
+from sqlalchemy import (select, func, or_, and_, tuple_, DateTime, Date,
+                        LargeBinary)
+from .... import database
+from ....database import Comparison, ComparisonType
+from ....backend.celery_app import celery_app
+from ....config import config
+from .... import routing
+from .... import constants as app_constants
+from ..rpm_db_models import (RPMComparison, RPMDifference, RPMDifferenceBlob,
+                             RPMDifferenceCount, RPMDifferenceWaiver,
+                             RPMComment, RPMPackage, RPMPath)
+from .. import constants
+
+# Groups finished more than ARCHIVE_DAYS ago are archived (0 means never)
+ARCHIVE_DAYS = config.getint('workers', 'ARCHIVE_DAYS', fallback=0)
+# Only this count of the newest groups of each package is kept (0 means
+# no limit)
+ARCHIVE_PACKAGE_CAP = config.getint(
+    'workers', 'ARCHIVE_PACKAGE_CAP', fallback=0
+)
+ARCHIVE_DIR = config.get(
+    'workers', 'ARCHIVE_DIR', fallback='/var/lib/archdiffer/archive'
+)
+# Count of rows in one archive file and in one delete transaction
+ARCHIVE_CHUNK_SIZE = config.getint(
+    'workers', 'ARCHIVE_CHUNK_SIZE', fallback=10000
+)
+# Interval of the archive task in seconds when run by celery beat
+ARCHIVE_INTERVAL = config.getint(
+    'workers', 'ARCHIVE_INTERVAL', fallback=86400
+)
+
+# States of groups whose results don't change any more
+FINISHED_STATES = [
+    app_constants.STATE_DONE,
+    app_constants.STATE_ERROR,
+    app_constants.STATE_CANCELLED,
+]
+
+def is_rpmdiff():
+    """Get condition selecting rpmdiff Comparisons.
+
+    :return: SQL expression
+    """
+    return Comparison.comparison_type_id == select([ComparisonType.id]).where(
+        ComparisonType.name == constants.COMPARISON_TYPE
+    ).as_scalar()
+
+def encode_row(row):
+    """Convert database row to dict that can be stored as JSON.
+
+    :param row: row of a query result
+    :return dict: dict of column values
+    """
+    result = {}
+    for key, value in row.items():
+        if isinstance(value, (bytes, memoryview)):
+            value = base64.b64encode(bytes(value)).decode('ascii')
+        elif isinstance(value, (datetime.datetime, datetime.date)):
+            value = value.isoformat()
+        result[key] = value
+    return result
+
+def decode_row(table, data):
+    """Convert dict made by encode_row back to column values of the table.
+
+    :param sqlalchemy.Table table: table of the row
+    :param dict data: dict of encoded column values
+    :return dict: dict of column values
+    """
+    row = dict(data)
+    for column in table.columns:
+        value = row.get(column.name)
+        if value is None:
+            continue
+        if isinstance(column.type, LargeBinary):
+            row[column.name] = base64.b64decode(value)
+        elif isinstance(column.type, DateTime):
+            row[column.name] = datetime.datetime.fromisoformat(value)
+        elif isinstance(column.type, Date):
+            row[column.name] = datetime.date.fromisoformat(value)
+    return row
+
+class GroupArchive():
+    """Archive of one comparison group. Rows of each table are stored in
+    gzipped JSON lines files '<table>-<chunk number>.jsonl.gz'; progress of
+    archiving is stored in 'checkpoint.json', so that interrupted archiving
+    continues where it stopped."""
+    def __init__(self, id_group, directory=ARCHIVE_DIR):
+        """Open archive of the group.
+
+        :param int id_group: id of the Comparison
+        :param string directory: directory with archives
+        """
+        self.id_group = id_group
+        self.path = os.path.join(directory, 'rpmdiff-group-%s' % id_group)
+        self.checkpoint = {
+            'group': id_group,
+            'state': None,
+            'archived': False,
+            'tables': {},
+        }
+        try:
+            with open(self.checkpoint_path) as checkpoint_file:
+                self.checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            pass
+
+    @property
+    def checkpoint_path(self):
+        """Path of the checkpoint file."""
+        return os.path.join(self.path, 'checkpoint.json')
+
+    def save(self):
+        """Write the checkpoint."""
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.checkpoint_path + '.part', 'w') as checkpoint_file:
+            json.dump(self.checkpoint, checkpoint_file)
+        os.replace(self.checkpoint_path + '.part', self.checkpoint_path)
+
+    def progress(self, table_name):
+        """Get progress of archiving of the table.
+
+        :param string table_name: name of the table
+        :return dict: dict with count of written 'chunks' and 'rows', primary
+            key of the 'last' written row and 'done' flag
+        """
+        return self.checkpoint['tables'].setdefault(table_name, {
+            'chunks': 0, 'rows': 0, 'last': None, 'done': False,
+        })
+
+    def chunk_path(self, table_name, number):
+        """Get path of the chunk file.
+
+        :param string table_name: name of the table
+        :param int number: number of the chunk
+        :return string: path
+        """
+        return os.path.join(self.path, '%s-%04d.jsonl.gz' % (
+            table_name, number
+        ))
+
+    def write_chunk(self, table_name, rows):
+        """Write next chunk of rows of the table and update the checkpoint.
+
+        :param string table_name: name of the table
+        :param list rows: list of dicts made by encode_row
+        """
+        progress = self.progress(table_name)
+        os.makedirs(self.path, exist_ok=True)
+        with gzip.open(self.chunk_path(table_name, progress['chunks']), 'wt',
+                       encoding='utf-8') as chunk_file:
+            for row in rows:
+                chunk_file.write(json.dumps(row) + '\n')
+        progress['chunks'] += 1
+        progress['rows'] += len(rows)
+
+    def chunks(self, table_name):
+        """Iterate over chunks of the table.
+
+        :param string table_name: name of the table
+        :return: generator of lists of dicts made by encode_row
+        """
+        for number in range(self.progress(table_name)['chunks']):
+            with gzip.open(self.chunk_path(table_name, number), 'rt',
+                           encoding='utf-8') as chunk_file:
+                yield [json.loads(line) for line in chunk_file]
+
+def group_steps(id_group):
+    """Get archived tables of the group with conditions selecting its rows,
+    in the order in which they are restored.
+
+    :param int id_group: id of the Comparison
+    :return list: list of tuples (model, condition)
+    """
+    comp_ids = select([RPMComparison.id]).where(
+        RPMComparison.id_group == id_group
+    )
+    diff_ids = select([RPMDifference.id]).where(
+        RPMDifference.id_comp.in_(comp_ids)
+    )
+    return [
+        (RPMComparison, RPMComparison.id_group == id_group),
+        (RPMDifferenceBlob, RPMDifferenceBlob.id_comp.in_(comp_ids)),
+        (RPMDifferenceCount, RPMDifferenceCount.id_comp.in_(comp_ids)),
+        (RPMDifferenceWaiver, RPMDifferenceWaiver.id_comp.in_(comp_ids)),
+        (RPMDifference, RPMDifference.id_comp.in_(comp_ids)),
+        (RPMComment, or_(
+            RPMComment.id_comp.in_(comp_ids), RPMComment.id_diff.in_(diff_ids)
+        )),
+    ]
+
+def archive_table(ses, archive, model, condition,
+                  chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Write rows of the model matching the condition to the archive in
+    chunks ordered by primary key. Differences are archived with their
+    paths in 'diff'.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param GroupArchive archive: archive of the group
+    :param model: database model
+    :param condition: SQL expression selecting the rows
+    :param int chunk_size: count of rows in one chunk
+    """
+    table = model.__table__
+    key = list(table.primary_key.columns)
+    progress = archive.progress(table.name)
+    if model is RPMDifference:
+        columns = [table, RPMPath.path.label('diff')]
+        condition = and_(condition, RPMDifference.id_path == RPMPath.id)
+    else:
+        columns = [table]
+    while not progress['done']:
+        query = select(columns).where(condition)
+        if progress['last'] is not None:
+            query = query.where(tuple_(*key) > tuple_(*progress['last']))
+        rows = ses.execute(query.order_by(*key).limit(chunk_size)).fetchall()
+        ses.commit()
+        if rows:
+            archive.write_chunk(table.name, [encode_row(row) for row in rows])
+            progress['last'] = [rows[-1][column.name] for column in key]
+        if len(rows) < chunk_size:
+            progress['done'] = True
+        archive.save()
+
+def delete_rows(ses, model, condition, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Delete rows of the model matching the condition, each chunk in its own
+    transaction.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param model: database model
+    :param condition: SQL expression selecting the rows
+    :param int chunk_size: count of rows deleted in one transaction
+    :return int: count of deleted rows
+    """
+    key = list(model.__table__.primary_key.columns)
+    if len(key) > 1:
+        count = ses.query(model).filter(condition).delete(
+            synchronize_session=False
+        )
+        ses.commit()
+        return count
+    count = 0
+    while True:
+        ids = [
+            row_id for row_id, in
+            ses.query(key[0]).filter(condition).limit(chunk_size)
+        ]
+        if not ids:
+            return count
+        count += ses.query(model).filter(key[0].in_(ids)).delete(
+            synchronize_session=False
+        )
+        ses.commit()
+
+def groups_to_archive(ses, days=ARCHIVE_DAYS, package_cap=ARCHIVE_PACKAGE_CAP,
+                      now=None, limit=None):
+    """Get ids of finished groups older than days or not among the newest
+    package_cap groups of any of their packages (by name of the first
+    package of their comparisons).
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int days: age in days; if 0, age is not considered
+    :param int package_cap: count of kept groups of each package; if 0,
+        count is not considered
+    :param datetime.datetime now: current time
+    :param int limit: maximal count of returned groups
+    :return list: sorted list of ids of Comparisons
+    """
+    conditions = []
+    if days > 0:
+        if now is None:
+            now = datetime.datetime.now()
+        cutoff = now - datetime.timedelta(days=days)
+        conditions.append(and_(
+            Comparison.time < cutoff,
+            Comparison.period <= database.period_of(cutoff),
+        ))
+    if package_cap > 0:
+        pairs = select([
+            RPMPackage.name.label('name'),
+            Comparison.id.label('id'),
+            Comparison.time.label('time'),
+        ]).where(and_(
+            RPMComparison.id_group == Comparison.id,
+            RPMComparison.pkg1_id == RPMPackage.id,
+            is_rpmdiff(),
+        )).distinct().alias('pairs')
+        ranked = select([
+            pairs.c.id,
+            func.row_number().over(
+                partition_by=pairs.c.name,
+                order_by=(pairs.c.time.desc(), pairs.c.id.desc()),
+            ).label('rank'),
+        ]).alias('ranked')
+        conditions.append(and_(
+            Comparison.id.in_(select([pairs.c.id])),
+            ~Comparison.id.in_(
+                select([ranked.c.id]).where(ranked.c.rank <= package_cap)
+            ),
+        ))
+    if not conditions:
+        return []
+    query = ses.query(Comparison.id).filter(
+        Comparison.state.in_(FINISHED_STATES), is_rpmdiff(), or_(*conditions)
+    ).order_by(Comparison.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [id_group for id_group, in query]
+
+def archive_group(ses, id_group, directory=ARCHIVE_DIR,
+                  chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Move rpm comparisons of the group with their differences and comments
+    to the archive. Rows are first written to the archive, then deleted in
+    chunks; finally the group gets the archived state.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int id_group: id of the Comparison
+    :param string directory: directory with archives
+    :param int chunk_size: count of rows in one chunk
+    :return dict: counts of deleted rows by table name or None if the group
+        doesn't exist or is already archived
+    """
+    comparison = ses.query(Comparison).get(id_group)
+    if (comparison is None or
+            comparison.state == app_constants.STATE_ARCHIVED):
+        return None
+    archive = GroupArchive(id_group, directory)
+    if archive.checkpoint['state'] is None:
+        archive.checkpoint['state'] = comparison.state
+        archive.save()
+
+    steps = group_steps(id_group)
+    if not archive.checkpoint['archived']:
+        for model, condition in steps:
+            archive_table(ses, archive, model, condition, chunk_size)
+        archive.checkpoint['archived'] = True
+        archive.save()
+
+    counts = {}
+    for model, condition in reversed(steps):
+        counts[model.__tablename__] = delete_rows(
+            ses, model, condition, chunk_size
+        )
+    comparison.update_state(ses, app_constants.STATE_ARCHIVED)
+    return counts
+
+def restore_group(ses, id_group, directory=ARCHIVE_DIR):
+    """Restore archived group in one transaction and remove its archive.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int id_group: id of the Comparison
+    :param string directory: directory with archives
+    :return dict: counts of restored rows by table name
+    :raises ValueError: if the group is not archived
+    """
+    comparison = ses.query(Comparison).get(id_group)
+    archive = GroupArchive(id_group, directory)
+    if (comparison is None or
+            comparison.state != app_constants.STATE_ARCHIVED or
+            not archive.checkpoint['archived']):
+        raise ValueError('Comparison group %s is not archived.' % id_group)
+
+    paths = set()
+    for rows in archive.chunks(RPMDifference.__tablename__):
+        paths.update(row['diff'] for row in rows)
+
+    counts = {}
+    try:
+        path_ids = RPMPath.intern(ses, paths)
+        for model, _ in group_steps(id_group):
+            table = model.__table__
+            counts[table.name] = 0
+            for rows in archive.chunks(table.name):
+                rows = [decode_row(table, row) for row in rows]
+                if model is RPMDifference:
+                    for row in rows:
+                        row['id_path'] = path_ids[row.pop('diff')]
+                ses.execute(table.insert(), rows)
+                counts[table.name] += len(rows)
+        comparison.state = archive.checkpoint['state']
+        ses.add(comparison)
+        ses.commit()
+    except:
+        ses.rollback()
+        raise
+    shutil.rmtree(archive.path)
+    return counts
+
+@celery_app.task(name='rpmdiff.archive')
+def archive_groups(days=ARCHIVE_DAYS, package_cap=ARCHIVE_PACKAGE_CAP,
+                   limit=None):
+    """Archive old groups and groups over the cap of their packages."""
+    with database.UnitOfWork() as work:
+        for id_group in groups_to_archive(work.session, days, package_cap,
+                                          limit=limit):
+            counts = archive_group(work.session, id_group)
+            print('Comparison group %s archived: %s' % (id_group, counts))
+            work.session.expunge_all()
+
+@celery_app.task(name='rpmdiff.restore')
+def restore(id_group):
+    """Restore archived group."""
+    with database.UnitOfWork() as work:
+        counts = restore_group(work.session, id_group)
+        print('Comparison group %s restored: %s' % (id_group, counts))
+
+if ARCHIVE_DAYS > 0 or ARCHIVE_PACKAGE_CAP > 0:
+    celery_app.conf.beat_schedule = dict(celery_app.conf.beat_schedule, **{
+        'rpmdiff.archive': {
+            'task': 'rpmdiff.archive',
+            'schedule': ARCHIVE_INTERVAL,
+            'options': {
+                'queue': routing.queue(app_constants.PRIORITY_BULK),
+            },
+        },
+    })
+
+def main(argv=None):
+    """Archive or restore groups from the command line.
+
+    :param list argv: command line arguments
+    :return: exit status
+    """
+    parser = argparse.ArgumentParser(
+        description='Archive old rpmdiff comparison groups or restore them.'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    archive_parser = subparsers.add_parser(
+        'archive', help='archive old groups'
+    )
+    archive_parser.add_argument(
+        '--days', type=int, default=ARCHIVE_DAYS,
+        help='archive groups older than DAYS (default %(default)s)',
+    )
+    archive_parser.add_argument(
+        '--package-cap', type=int, default=ARCHIVE_PACKAGE_CAP,
+        help='keep only PACKAGE_CAP newest groups of each package '
+             '(default %(default)s)',
+    )
+    archive_parser.add_argument(
+        '--limit', type=int, help='archive at most LIMIT groups'
+    )
+    archive_parser.add_argument(
+        '--dry-run', action='store_true',
+        help='only print ids of the groups that would be archived',
+    )
+    restore_parser = subparsers.add_parser(
+        'restore', help='restore archived groups'
+    )
+    restore_parser.add_argument('groups', type=int, nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'archive':
+        if args.dry_run:
+            ses = database.session()
+            try:
+                for id_group in groups_to_archive(
+                        ses, args.days, args.package_cap, limit=args.limit
+                ):
+                    print(id_group)
+            finally:
+                ses.close()
+        else:
+            archive_groups(args.days, args.package_cap, args.limit)
+        return 0
+    try:
+        for id_group in args.groups:
+            restore(id_group)
+    except ValueError as error:
+        return str(error)
+    return 0
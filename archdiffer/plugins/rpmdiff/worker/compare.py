@@ -10,82 +10,169 @@ Created on Mon Sep  4 12:32:32 2017
 """
 
 import os
-from tempfile import mkdtemp
-from shutil import rmtree
+import time
+import signal
 import subprocess
 from collections import defaultdict
-import dnf
-import rpm
-from celery.signals import worker_process_init, worker_process_shutdown
+from celery.signals import worker_process_init
 from .... import database
-from ..rpm_db_models import (RPMComparison, RPMDifference, RPMPackage)
+from ....config import config
+from ..rpm_db_models import (RPMComparison, RPMDifference, RPMPackage,
+                             RPMRequest, RPMDifferenceBlob)
 from .. import constants
 from ....backend.celery_app import celery_app
 from .... import constants as app_constants
+from .... import metrics
+from .notify import notify_callbacks
+from .progress import Progress
+from . import repodata
+from . import scratch
+
+# Reader of repository metadata: 'slim' reads only the primary metadata,
+# 'dnf' loads the repository with dnf.Base
+REPODATA_READER = config.get('workers', 'REPODATA_READER', fallback='slim')
+REPODATA_CACHE_DIR = config.get(
+    'workers', 'REPODATA_CACHE_DIR', fallback=''
+)
+# Limits of one rpmdiff run: wall-clock time in seconds and resident memory
+# in megabytes (0 means no limit)
+DIFF_TIMEOUT = config.getint('workers', 'DIFF_TIMEOUT', fallback=600)
+DIFF_MEMORY_LIMIT = config.getint(
+    'workers', 'DIFF_MEMORY_LIMIT', fallback=2048
+)
+# Comparisons with more differences are stored as one compressed blob
+# instead of rows (0 means never)
+DIFF_BLOB_THRESHOLD = config.getint(
+    'workers', 'DIFF_BLOB_THRESHOLD', fallback=50000
+)
+# How often are the limits and cancellation checked, in seconds
+DIFF_POLL_INTERVAL = 1
+CANCEL_CHECK_INTERVAL = 5
+
+differences_total = metrics.Counter(
+    'archdiffer_rpmdiff_differences_total',
+    'Count of differences found by rpmdiff by category.',
+)
+groups_total = metrics.Counter(
+    'archdiffer_rpmdiff_groups_total',
+    'Count of finished comparison groups by final state.',
+)
+
+class DiffError(Exception):
+    """rpmdiff was killed because it exceeded its limits."""
+    pass
+
+class Cancelled(Exception):
+    """Comparison group was cancelled by user."""
+    pass
 
 @worker_process_init.connect()
-def setup_tmps(**kwargs):
-    """Make temporal directory to store downloaded packages and set current
-    woring directory there."""
-    tmpdir = mkdtemp()
-    os.chdir(tmpdir)
-
-@worker_process_shutdown.connect()
-def cleanup_tmps(**kwargs):
-    """Remove the temporal directory."""
-    tmpdir = os.getcwd()
-    os.chdir('/')
-    rmtree(tmpdir)
-
-def download_packages(pkg):
-    """Download packages whose parameters match the arguments.
+def cleanup_scratch(**kwargs):
+    """Remove scratch directories left by worker processes that died."""
+    scratch.space.cleanup_stale()
+
+def find_packages(pkg, progress, directory):
+    """Find packages whose parameters match the arguments.
+
+    :param dict pkg: dict containing package parameters
+    :param Progress progress: progress of the comparison group
+    :param string directory: directory where the packages will be downloaded
+    :return tuple: tuple (list of packages, function downloading them)
+    """
+    if REPODATA_READER == 'dnf':
+        return find_packages_dnf(pkg, progress, directory)
+
+    # Metadata are cached by checksum, so the cache always reflects changes
+    # in the repository.
+    cachedir = REPODATA_CACHE_DIR or os.path.join(
+        scratch.space.root, 'repodata'
+    )
+    repo = repodata.Repository(pkg['repository'], cachedir)
+    with progress.stage(constants.STAGE_LOAD):
+        try:
+            print('Loading repository: %s' % pkg['repository'])
+            repo.load()
+            pkgs = repo.query(pkg['name'], **RPMPackage.query_filters(pkg))
+            print('Repository loaded.')
+        except repodata.RepodataError as error:
+            print('Repository loading failed: %s' % error)
+            return [], None
+
+    return pkgs, lambda: repo.download(pkgs, directory, progress.downloaded)
+
+def find_packages_dnf(pkg, progress, directory):
+    """Find packages whose parameters match the arguments using dnf.
 
     :param dict pkg: dict containing package parameters
-    :return list[dnf.package.Package]: packages
+    :param Progress progress: progress of the comparison group
+    :param string directory: directory for the dnf cache and the packages
+    :return tuple: tuple (list[dnf.package.Package], function downloading
+        the packages)
     """
+    import dnf
     base = dnf.Base()
 
     # Add repository
     label = 'temp_repo_label'
     base.repos.add_new_repo(label, base.conf, baseurl=[pkg['repository']])
     base.repos[label].enable()
-    # Set cache directory to the tmpdir. Otherwise it won't see any changes in
-    # repository.
-    base.conf.cachedir = '.'
-    try:
-        print('Loading repository: %s' % pkg['repository'])
-        base.repos[label].load()
-        print('Repository loaded.')
-    except:
-        print('Repository loading failed.')
-        return []
-    base.fill_sack(load_system_repo=False)
+    # Set cache directory to the task's directory. Otherwise it won't see any
+    # changes in repository.
+    base.conf.cachedir = directory
+    with progress.stage(constants.STAGE_LOAD):
+        try:
+            print('Loading repository: %s' % pkg['repository'])
+            base.repos[label].load()
+            print('Repository loaded.')
+        except:
+            print('Repository loading failed.')
+            return [], None
+        base.fill_sack(load_system_repo=False)
 
     # Query packages
-    pkgs = base.sack.query().available().filter(name=pkg['name'])
-    if pkg['arch'] != '' and pkg['arch'] and isinstance(pkg['arch'], str):
-        pkgs = pkgs.filter(arch=pkg['arch'])
-    if pkg['epoch'] != '' and isinstance(pkg['epoch'], int):
-        pkgs = pkgs.filter(epoch=pkg['epoch'])
-    if pkg['release'] != '' and isinstance(pkg['release'], str):
-        pkgs = pkgs.filter(release=pkg['release'])
-    if pkg['version'] != '' and isinstance(pkg['version'], str):
-        pkgs = pkgs.filter(version=pkg['version'])
-
-    # Download the package
-    if pkgs:
-        print('Started package download: %s' % pkgs[0].name)
-        base.conf.destdir = os.getcwd()
+    pkgs = list(base.sack.query().available().filter(
+        name=pkg['name'], **RPMPackage.query_filters(pkg)
+    ))
+
+    class DownloadProgress(dnf.callback.DownloadProgress):
+        """Records bytes downloaded by dnf into the progress."""
+        def __init__(self):
+            self.done = {}
+
+        def progress(self, payload, done):
+            progress.downloaded(done - self.done.get(payload, 0))
+            self.done[payload] = done
+
+    def download():
+        base.conf.destdir = directory
         base.repos.all().pkgdir = base.conf.destdir
-        base.download_packages(list(pkgs))
-        print('Finished package download: %s' % pkgs[0].name)
+        base.download_packages(pkgs, progress=DownloadProgress())
 
-    return list(pkgs)
+    return pkgs, download
+
+def download_packages(found, progress):
+    """Download found packages.
+
+    :param tuple found: tuple (list of packages, function downloading them)
+        returned by find_packages
+    :param Progress progress: progress of the comparison group
+    :return list: packages
+    """
+    pkgs, download = found
+    if pkgs:
+        with progress.stage(constants.STAGE_DOWNLOAD):
+            print('Started package download: %s' % pkgs[0].name)
+            try:
+                download()
+            finally:
+                progress.flush_downloaded()
+            print('Finished package download: %s' % pkgs[0].name)
+    return pkgs
 
 def group_by_arch(pkgs):
     """Make dict of groups of packagase sorted by the architectures.
 
-    :param list[dnf.package.Package] pkgs: packages
+    :param list pkgs: packages
     :return dict: dict of groups
     """
     arch_groups = defaultdict(list)
@@ -96,9 +183,10 @@ def group_by_arch(pkgs):
 def remove_old_versions(pkgs):
     """Remove older packages for each architecture.
 
-    :param list[dnf.package.Package] pkgs: packages
-    :return list[dnf.package.Package]: new list of packages
+    :param list pkgs: packages
+    :return list: new list of packages
     """
+    import rpm
     arch_groups = defaultdict(list)
     for pkg in pkgs:
         arch_groups[pkg.arch].append(pkg)
@@ -121,8 +209,8 @@ def make_tuples(original1, original2, pkgs1, pkgs2):
 
     :param dict original1: dict describing original request for first package
     :param dict original2: dict describing original request for second package
-    :param list[dnf.package.Package] pkgs1: first list of packages
-    :param list[dnf.package.Package] pkgs2: second list of packages
+    :param list pkgs1: first list of packages
+    :param list pkgs2: second list of packages
     :return list: list of package tuples
     """
     tuples = []
@@ -140,16 +228,94 @@ def make_tuples(original1, original2, pkgs1, pkgs2):
                 tuples.append((pkg1, pkg2))
     return tuples
 
-def run_rpmdiff(pkg1, pkg2):
-    """Run rpmdiff as subprocess.
+def process_group_rss(pgid):
+    """Get resident memory of all processes in the process group.
 
-    :param string pkg1: name of the first package
-    :param string pkg2: name of the second package
+    :param int pgid: process group id
+    :return int: resident memory in bytes (0 if unknown)
+    """
+    rss = 0
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        try:
+            with open('/proc/%s/stat' % pid) as stat:
+                # Fields after the command name: state, ppid, pgrp, ...
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[2]) == pgid:
+            rss += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    return rss
+
+def kill_process_group(process):
+    """Terminate the process with all its children; kill it if it doesn't
+    terminate in 5 seconds.
+
+    :param subprocess.Popen process: leader of the process group
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+        try:
+            process.communicate(timeout=5)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+
+def run_rpmdiff(pkg1, pkg2, timeout=DIFF_TIMEOUT,
+                memory_limit=DIFF_MEMORY_LIMIT, cancelled=None):
+    """Run rpmdiff as subprocess in its own process group. Kill it if it
+    exceeds the limits or the comparison group is cancelled.
+
+    :param string pkg1: path of the first package
+    :param string pkg2: path of the second package
+    :param int timeout: wall-clock limit in seconds (0 means no limit)
+    :param int memory_limit: resident memory limit in megabytes (0 means no
+        limit)
+    :param callable cancelled: function returning True if the comparison
+        group is cancelled
     :return: CompletedProcess instance
+    :raises DiffError: if rpmdiff exceeded the limits
+    :raises Cancelled: if the comparison group was cancelled
     """
-    pkg1 = os.path.join(os.getcwd(), pkg1)
-    pkg2 = os.path.join(os.getcwd(), pkg2)
-    return subprocess.run(["rpmdiff", pkg1, pkg2], stdout=subprocess.PIPE)
+    process = subprocess.Popen(
+        ["rpmdiff", pkg1, pkg2],
+        stdout=subprocess.PIPE,
+        start_new_session=True,
+    )
+    started = last_check = time.monotonic()
+    while True:
+        try:
+            stdout, _ = process.communicate(timeout=DIFF_POLL_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+        now = time.monotonic()
+        reason = None
+        if timeout and now - started > timeout:
+            reason = 'time limit of %s s exceeded' % timeout
+        elif (memory_limit and
+              process_group_rss(process.pid) > memory_limit * 2**20):
+            reason = 'memory limit of %s MB exceeded' % memory_limit
+        elif (cancelled is not None and
+              now - last_check >= CANCEL_CHECK_INTERVAL):
+            last_check = now
+            if cancelled():
+                kill_process_group(process)
+                raise Cancelled()
+        if reason is not None:
+            kill_process_group(process)
+            raise DiffError('rpmdiff of %s and %s killed: %s' % (
+                os.path.basename(pkg1), os.path.basename(pkg2), reason
+            ))
+    return subprocess.CompletedProcess(
+        process.args, process.returncode, stdout
+    )
 
 def parse_rpmdiff(rpmdiff_output):
     """Parse output from rpmdiff.
@@ -164,22 +330,128 @@ def parse_rpmdiff(rpmdiff_output):
             diffs.append(line.split(maxsplit=1))
     return diffs
 
+def _decode(value):
+    """Decode header value returned as bytes by older rpm bindings.
+
+    :param value: str or bytes
+    :return string: value
+    """
+    if isinstance(value, bytes):
+        return value.decode('UTF-8', errors='replace')
+    return value
+
+def read_file_info(path):
+    """Read digests, sizes and modes of files from the package header.
+
+    :param string path: path of the package
+    :return dict: {file path: (digest, size, mode)}
+    """
+    import rpm
+    transaction_set = rpm.TransactionSet()
+    transaction_set.setVSFlags(
+        rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS
+    )
+    with open(path, 'rb') as package:
+        header = transaction_set.hdrFromFdno(package.fileno())
+    return {
+        _decode(name): (_decode(digest), size, mode)
+        for name, digest, size, mode in zip(
+            header[rpm.RPMTAG_FILENAMES],
+            header[rpm.RPMTAG_FILEDIGESTS],
+            header[rpm.RPMTAG_FILESIZES],
+            header[rpm.RPMTAG_FILEMODES],
+        )
+    }
+
+def detect_renames(differences, files1, files2):
+    """Replace pairs of removed and added files with the same content by
+    renamed files. Files are joined on (digest, size, mode); files with the
+    same basename are paired first. Directories, symlinks and empty files
+    (without digest or content) are never paired.
+
+    :param list differences: parsed differences from rpmdiff output
+    :param dict files1: file info of the first package from read_file_info
+    :param dict files2: file info of the second package from read_file_info
+    :return list: differences; renamed files are ['renamed', old path,
+        new path] at the position of the removed file
+    """
+    def file_key(info):
+        if info is None or not info[0] or not info[1]:
+            return None
+        return info
+
+    by_basename = defaultdict(list)
+    by_content = defaultdict(list)
+    for difference in differences:
+        if len(difference) == 2 and difference[0] == 'removed':
+            key = file_key(files1.get(difference[1]))
+            if key is not None:
+                basename = os.path.basename(difference[1])
+                by_basename[key + (basename,)].append(difference[1])
+                by_content[key].append(difference[1])
+    if not by_content:
+        return differences
+
+    added = [
+        difference[1] for difference in differences
+        if len(difference) == 2 and difference[0] == 'added'
+    ]
+    renamed = {}
+    new_paths = set()
+    for same_basename in (True, False):
+        for path in added:
+            key = file_key(files2.get(path))
+            if key is None or path in new_paths:
+                continue
+            if same_basename:
+                candidates = by_basename.get(key + (os.path.basename(path),))
+            else:
+                candidates = by_content.get(key)
+            while candidates:
+                old_path = candidates.pop()
+                if old_path not in renamed:
+                    renamed[old_path] = path
+                    new_paths.add(path)
+                    break
+
+    result = []
+    for difference in differences:
+        if len(difference) == 2:
+            if difference[0] == 'removed' and difference[1] in renamed:
+                result.append(
+                    ['renamed', difference[1], renamed[difference[1]]]
+                )
+                continue
+            if difference[0] == 'added' and difference[1] in new_paths:
+                continue
+        result.append(difference)
+    return result
+
 def proces_differences(session, id_comp, differences):
     """Process differences from the rpmdiff output and add to the database.
+    The session is not committed.
 
     :param session: session for communication with the database
     :type session: qlalchemy.orm.session.Session
     :param int id_comp: id_comp of the corresponding RPMComparison
-    :param list diffs: list of parsed differences from rpmdiff output
+    :param list diffs: list of parsed differences from rpmdiff output;
+        renamed files are ['renamed', old path, new path]
     """
-    # TODO: also check for renamed files
-    # (diff_type='renamed', diff_info='name_of_new_file')
     bad_diffs = []
+    rows = []
+    counts = defaultdict(int)
     category = ''
     diff_type = ''
     diff_info = ''
 
     for difference in differences:
+        if len(difference) == 3 and difference[0] == 'renamed':
+            rows.append((
+                constants.CATEGORY_FILES, constants.DIFF_TYPE_RENAMED,
+                difference[2], difference[1]
+            ))
+            counts[constants.CATEGORY_FILES] += 1
+            continue
         if len(difference) != 2:
             bad_diffs.append(difference)
             continue
@@ -201,55 +473,184 @@ def proces_differences(session, id_comp, differences):
         else:
             category = constants.CATEGORY_FILES
 
-        RPMDifference.add(
-            session, id_comp, category, diff_type, diff_info, difference[1]
-        )
+        rows.append((category, diff_type, diff_info, difference[1]))
+        counts[category] += 1
+    if DIFF_BLOB_THRESHOLD and len(rows) > DIFF_BLOB_THRESHOLD:
+        RPMDifferenceBlob.add(session, id_comp, rows, commit=False)
+    else:
+        RPMDifference.add_many(session, id_comp, rows, commit=False)
+    for category, count in counts.items():
+        differences_total.inc(count, category=category)
 
     if bad_diffs != []:
         print('Unrecognized lines in rpmdiff output:')
         for bad_diff in bad_diffs:
             print(bad_diff)
 
+def is_cancelled(comp_id):
+    """Find out if the comparison group was cancelled by user.
+
+    :param int comp_id: id of the Comparison
+    :return bool: True if cancelled
+    """
+    session = database.session()
+    try:
+        state = session.query(database.Comparison.state).filter_by(
+            id=comp_id
+        ).scalar()
+    finally:
+        session.close()
+    return state == app_constants.STATE_CANCELLED
+
+def check_cancelled(comp_id):
+    """Raise Cancelled if the comparison group was cancelled by user.
+
+    :param int comp_id: id of the Comparison
+    :raises Cancelled: if cancelled
+    """
+    if is_cancelled(comp_id):
+        raise Cancelled()
+
+def finish_group(session, comp_id, state, progress):
+    """Update state of the Comparison and notify its callbacks. State of
+    a cancelled Comparison is kept.
+
+    :param session: session for communication with the database
+    :type session: qlalchemy.orm.session.Session
+    :param int comp_id: id of the Comparison
+    :param int state: final state
+    :param Progress progress: progress of the comparison group or None if
+        it wasn't created
+    """
+    RPMRequest.finish(session, comp_id)
+    session.query(database.Comparison).filter_by(
+        id=comp_id, state=app_constants.STATE_NEW
+    ).update(
+        {database.Comparison.state: state}, synchronize_session=False
+    )
+    session.commit()
+    if progress is not None:
+        progress.finish()
+    groups_total.inc(state=app_constants.STATE_STRINGS[state])
+    notify_callbacks(session, comp_id)
+
 @celery_app.task(name='rpmdiff.compare')
 def compare(comp_id, pkg1, pkg2):
-    """Compare two packages and write results to the database.
+    """Compare two packages and write results to the database. Each tuple of
+    packages is committed at two checkpoints: when its RPMComparison is
+    added and when its results are stored.
 
     :param int comp_id: id of Comparison which will be used as group
     :param dict pkg1: first package dict with keys:
         name, arch, epoch, version, release, repository
     :param dict pkg2: second package dict
     """
-    session = database.session()
-
-    # Download packages
-    dnf_packages1 = download_packages(pkg1)
-    dnf_packages2 = download_packages(pkg2)
+    # Objects are kept loaded after checkpoints, so that the current
+    # RPMComparison can be updated after rollback
+    with database.UnitOfWork(expire_on_commit=False) as work:
+        compare_packages(work, comp_id, pkg1, pkg2)
 
-    tuples = make_tuples(pkg1, pkg2, dnf_packages1, dnf_packages2)
+def compare_packages(work, comp_id, pkg1, pkg2):
+    """Compare two packages within the unit of work.
 
+    :param database.UnitOfWork work: unit of work of the task
+    :param int comp_id: id of Comparison which will be used as group
+    :param dict pkg1: first package dict
+    :param dict pkg2: second package dict
+    """
+    session = work.session
+    progress = None
+    task_scratch = None
+    state = app_constants.STATE_DONE
     rpm_comparison = None
-    for dnf_package1, dnf_package2 in tuples:
-        # Add packages to the database
-        db_package1 = RPMPackage.add(session, dnf_package1, pkg1['repository'])
-        db_package2 = RPMPackage.add(session, dnf_package2, pkg2['repository'])
-
-        # Add comparison and rpm_comparison to the database
-        rpm_comparison = RPMComparison.add(
-            session, db_package1, db_package2, id_group=comp_id
-        )
-
-        # Compare packages
-        completed_process = run_rpmdiff(
-            dnf_package1.localPkg(), dnf_package2.localPkg()
-        )
-        rpmdiff_output = completed_process.stdout.decode('UTF-8')
-        diffs = parse_rpmdiff(rpmdiff_output)
 
-        # Process results
-        proces_differences(session, int(rpm_comparison.id), diffs)
-
-        # Update RPMComparison state
-        rpm_comparison.update_state(session, constants.STATE_DONE)
-
-    comp = session.query(database.Comparison).filter_by(id=comp_id).first()
-    comp.update_state(session, app_constants.STATE_DONE)
+    # Everything that can fail is in the try, so that the group is always
+    # finished and its request released
+    try:
+        import rpm
+        progress = Progress(comp_id)
+        task_scratch = scratch.space.task()
+        check_cancelled(comp_id)
+
+        # Find packages, wait for space for them and download them; the
+        # metadata dnf already loaded into the task directory is reserved too
+        found1 = find_packages(pkg1, progress, task_scratch.path)
+        found2 = find_packages(pkg2, progress, task_scratch.path)
+        task_scratch.reserve(task_scratch.usage() + sum(
+            p.downloadsize for p in found1[0] + found2[0]
+        ))
+        check_cancelled(comp_id)
+        dnf_packages1 = download_packages(found1, progress)
+        dnf_packages2 = download_packages(found2, progress)
+
+        tuples = make_tuples(pkg1, pkg2, dnf_packages1, dnf_packages2)
+
+        for index, (dnf_package1, dnf_package2) in enumerate(tuples, 1):
+            check_cancelled(comp_id)
+            progress.tuple(index, len(tuples))
+
+            # Add packages to the database
+            db_package1 = RPMPackage.add(
+                session, dnf_package1, pkg1['repository']
+            )
+            db_package2 = RPMPackage.add(
+                session, dnf_package2, pkg2['repository']
+            )
+
+            # Add comparison and rpm_comparison to the database
+            rpm_comparison = RPMComparison.add(
+                session, db_package1, db_package2, id_group=comp_id,
+                commit=False,
+            )
+            work.checkpoint()
+
+            # Compare packages
+            with progress.stage(constants.STAGE_DIFF):
+                try:
+                    completed_process = run_rpmdiff(
+                        dnf_package1.localPkg(),
+                        dnf_package2.localPkg(),
+                        cancelled=lambda: is_cancelled(comp_id),
+                    )
+                except DiffError as error:
+                    print(error)
+                    rpm_comparison.update_state(
+                        session, constants.STATE_ERROR, commit=False
+                    )
+                    work.checkpoint()
+                    state = app_constants.STATE_ERROR
+                    continue
+                rpmdiff_output = completed_process.stdout.decode('UTF-8')
+                diffs = parse_rpmdiff(rpmdiff_output)
+                try:
+                    diffs = detect_renames(
+                        diffs,
+                        read_file_info(dnf_package1.localPkg()),
+                        read_file_info(dnf_package2.localPkg()),
+                    )
+                except (OSError, rpm.error) as error:
+                    print('Renamed files not detected: %s' % error)
+
+            # Process results and update RPMComparison state
+            with progress.stage(constants.STAGE_PERSIST):
+                proces_differences(session, int(rpm_comparison.id), diffs)
+                rpm_comparison.update_state(
+                    session, constants.STATE_DONE, commit=False
+                )
+                work.checkpoint()
+    except Cancelled:
+        session.rollback()
+        print('Comparison group %s cancelled.' % comp_id)
+        if rpm_comparison is not None and \
+                rpm_comparison.state == constants.STATE_NEW:
+            rpm_comparison.update_state(session, constants.STATE_ERROR)
+        state = app_constants.STATE_CANCELLED
+    except Exception:
+        session.rollback()
+        finish_group(session, comp_id, app_constants.STATE_ERROR, progress)
+        raise
+    finally:
+        if task_scratch is not None:
+            task_scratch.cleanup()
+
+    finish_group(session, comp_id, state, progress)
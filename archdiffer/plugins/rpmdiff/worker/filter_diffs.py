@@ -27,20 +27,22 @@ def filter_diffs(id_comp):
         name, arch, epoch, version, release, repository
     :param dict pkg2: second package dict
     """
-    session = database.session()
-
-    diffs = session.query(RPMDifference).filter_by(id_comp=id_comp)
-    for rule in RULES:
-        filtered_diffs = diffs.filter(rule)
-        for diff in filtered_diffs.all():
-            diff.state = constants.DIFF_STATE_IGNORED
-            session.add(diff)
-
-    comp = session.query(RPMComparison).filter_by(id=id_comp).one()
-    comp.update_state(session, constants.STATE_DONE)
-
-    try:
-        session.commit()
-    except:
-        session.rollback()
-        print("Couldn't add filter changes to the database.")
+    with database.UnitOfWork() as work:
+        session = work.session
+        # Differences are updated in bulk, without loading them
+        for rule in RULES:
+            session.query(RPMDifference).filter_by(id_comp=id_comp).filter(
+                rule
+            ).update(
+                {RPMDifference.state: constants.DIFF_STATE_IGNORED},
+                synchronize_session=False,
+            )
+
+        comp = session.query(RPMComparison).filter_by(id=id_comp).one()
+        comp.update_state(session, constants.STATE_DONE, commit=False)
+
+        try:
+            work.checkpoint()
+        except:
+            session.rollback()
+            print("Couldn't add filter changes to the database.")
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import json
+import urllib.request
+import urllib.error
+from datetime import datetime
+from .... import database
+from ....backend.celery_app import celery_app
+from ....config import config
+from ..rpm_db_models import RPMComparison, RPMDifference, RPMCallback
+from .. import constants
+from .... import constants as app_constants
+
+# Delivery of the callbacks
+WEBHOOK_TIMEOUT = config.getint('workers', 'WEBHOOK_TIMEOUT', fallback=10)
+WEBHOOK_MAX_RETRIES = config.getint(
+    'workers', 'WEBHOOK_MAX_RETRIES', fallback=5
+)
+WEBHOOK_RETRY_BACKOFF = config.getint(
+    'workers', 'WEBHOOK_RETRY_BACKOFF', fallback=30
+)
+# Routing of the notify task
+WEBHOOK_QUEUE = config.get('workers', 'WEBHOOK_QUEUE', fallback='celery')
+WEBHOOK_PRIORITY = config.getint('workers', 'WEBHOOK_PRIORITY', fallback=0)
+
+def summary(ses, comp_id):
+    """Make compact summary of the comparison group.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int comp_id: id of the Comparison
+    :return dict: summary with counts of differences by category and type
+    """
+    comp = ses.query(database.Comparison).filter_by(id=comp_id).one()
+    comparisons = {}
+    for rpm_comp in ses.query(RPMComparison).filter_by(id_group=comp_id):
+        state = constants.STATE_STRINGS[rpm_comp.state]
+        comparisons[state] = comparisons.get(state, 0) + 1
+    counts = RPMDifference.counts(ses, comp_id)
+    return {
+        'id': comp.id,
+        'type': constants.COMPARISON_TYPE,
+        'state': app_constants.STATE_STRINGS[comp.state],
+        'time': datetime.strftime(comp.time, '%Y-%m-%d %H:%M:%S'),
+        'comparisons': comparisons,
+        'differences': counts,
+        'differences_count': sum(
+            sum(types.values()) for types in counts.values()
+        ),
+    }
+
+def deliver(url, payload, timeout=WEBHOOK_TIMEOUT):
+    """Send the payload to the url by POST request.
+
+    :param string url: callback URL
+    :param bytes payload: JSON encoded payload
+    :param int timeout: timeout of the request in seconds
+    :return bool: True if the delivery succeeded
+    """
+    request = urllib.request.Request(
+        url,
+        data=payload,
+        headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'archdiffer',
+        },
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return 200 <= response.status < 300
+    except (urllib.error.URLError, OSError) as error:
+        print('Callback delivery to %s failed: %s' % (url, error))
+        return False
+
+@celery_app.task(
+    name='rpmdiff.notify', bind=True, max_retries=WEBHOOK_MAX_RETRIES
+)
+def notify(self, comp_id, urls=None):
+    """POST summary of the finished comparison group to its callback URLs.
+    All URLs are delivered by one task; only the failed ones are retried with
+    exponential backoff.
+
+    :param int comp_id: id of the Comparison
+    :param list urls: URLs to deliver to; defaults to all callbacks of the
+        Comparison
+    """
+    session = database.session()
+    try:
+        if urls is None:
+            urls = RPMCallback.urls(session, comp_id)
+        if not urls:
+            return
+        payload = json.dumps(summary(session, comp_id)).encode('utf-8')
+    finally:
+        session.close()
+
+    failed = [url for url in urls if not deliver(url, payload)]
+    if failed:
+        raise self.retry(
+            args=(comp_id, failed),
+            countdown=WEBHOOK_RETRY_BACKOFF * 2 ** self.request.retries,
+        )
+
+def notify_callbacks(ses, comp_id):
+    """Send the notify task if the Comparison has any callbacks.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int comp_id: id of the Comparison
+    """
+    if ses.query(RPMCallback).filter_by(id_group=comp_id).count() == 0:
+        return
+    notify.apply_async(
+        args=(comp_id,), queue=WEBHOOK_QUEUE, priority=WEBHOOK_PRIORITY
+    )
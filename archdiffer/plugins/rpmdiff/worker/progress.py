@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from .... import database
+from .... import metrics
+from ..rpm_db_models import RPMProgress
+from .. import constants
+
+stage_seconds = metrics.Histogram(
+    'archdiffer_rpmdiff_stage_seconds',
+    'Duration of stages of comparison groups.',
+)
+downloaded_bytes = metrics.Counter(
+    'archdiffer_rpmdiff_downloaded_bytes_total',
+    'Bytes of downloaded packages.',
+)
+
+class Progress():
+    """Records progress of a comparison group into rpm_progress.
+
+    The progress is written using its own short-lived sessions, so that it is
+    visible immediately and independent of the task's session.
+    """
+    # Bytes being downloaded are written at most once per this count of
+    # seconds
+    DOWNLOAD_WRITE_INTERVAL = 1
+
+    def __init__(self, comp_id):
+        """Create or reset the progress of the comparison group.
+
+        :param int comp_id: id of the Comparison
+        """
+        self.comp_id = comp_id
+        self.timings = {}
+        self.unwritten_bytes = 0
+        self.bytes_written_at = time.monotonic()
+        now = datetime.utcnow()
+        self._write(
+            stage=constants.STAGE_LOAD,
+            stage_started=now,
+            tuple_index=0,
+            tuple_count=0,
+            bytes_downloaded=0,
+            timings='{}',
+            updated=now,
+        )
+
+    def _write(self, **values):
+        """Update the progress row with given values.
+
+        :param **values: column values
+        """
+        session = database.session()
+        try:
+            progress = session.query(RPMProgress).filter_by(
+                id_group=self.comp_id
+            ).one_or_none()
+            if progress is None:
+                progress = RPMProgress(id_group=self.comp_id)
+                session.add(progress)
+            for key, value in values.items():
+                setattr(progress, key, value)
+            progress.updated = datetime.utcnow()
+            session.commit()
+        except Exception as error:
+            session.rollback()
+            print('Progress of comparison %s not recorded: %s' % (
+                self.comp_id, error
+            ))
+        finally:
+            session.close()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager recording that the group is in the given stage and
+        how long the stage takes.
+
+        :param string name: name of the stage
+        """
+        self._write(stage=name, stage_started=datetime.utcnow())
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            stage_seconds.observe(elapsed, stage=name)
+            self.timings[name] = round(
+                self.timings.get(name, 0) + elapsed, 3
+            )
+            self._write(timings=json.dumps(self.timings))
+
+    def tuple(self, index, count):
+        """Record which tuple of packages is being compared.
+
+        :param int index: index of the tuple, starting at 1
+        :param int count: count of all tuples
+        """
+        self._write(tuple_index=index, tuple_count=count)
+
+    def downloaded(self, size):
+        """Add downloaded bytes. Called for each downloaded chunk; the bytes
+        are written at most every DOWNLOAD_WRITE_INTERVAL seconds and when
+        flushed.
+
+        :param int size: count of downloaded bytes
+        """
+        downloaded_bytes.inc(size)
+        self.unwritten_bytes += size
+        if (time.monotonic() - self.bytes_written_at >=
+                self.DOWNLOAD_WRITE_INTERVAL):
+            self.flush_downloaded()
+
+    def flush_downloaded(self):
+        """Write the downloaded bytes not written yet."""
+        self.bytes_written_at = time.monotonic()
+        if not self.unwritten_bytes:
+            return
+        size, self.unwritten_bytes = self.unwritten_bytes, 0
+        # Added in the database, concurrent downloads are not lost
+        self._write(bytes_downloaded=RPMProgress.bytes_downloaded + size)
+
+    def finish(self):
+        """Record that the group is finished."""
+        self._write(
+            stage=constants.STAGE_FINISHED, stage_started=datetime.utcnow()
+        )
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import bz2
+import gzip
+import lzma
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+from urllib.parse import urljoin, urlparse
+from urllib.request import urlopen, pathname2url
+import xml.etree.ElementTree as ET
+from ....config import config
+from .... import metrics
+
+REPOMD_NS = '{http://linux.duke.edu/metadata/repo}'
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+XML_BASE = '{http://www.w3.org/XML/1998/namespace}base'
+
+FETCH_TIMEOUT = config.getint('workers', 'REPODATA_TIMEOUT', fallback=60)
+# Cached metadata files not used for this many seconds are removed
+CACHE_MAX_AGE = config.getint(
+    'workers', 'REPODATA_CACHE_MAX_AGE', fallback=86400
+)
+CHUNK_SIZE = 1024 * 1024
+
+repodata_cache = metrics.Counter(
+    'archdiffer_rpmdiff_repodata_cache_total',
+    'Count of lookups of primary metadata in the cache by result.',
+)
+
+class RepodataError(Exception):
+    """Repository metadata can't be loaded or a package can't be fetched."""
+    pass
+
+def fetch(url, path, on_chunk=None):
+    """Download url into the file at path.
+
+    :param string url: url
+    :param string path: path of the file
+    :param on_chunk: function called with the size of each downloaded chunk
+    :return string: hexadecimal sha256 of the content
+    """
+    digest = hashlib.sha256()
+    with urlopen(url, timeout=FETCH_TIMEOUT) as response, \
+            open(path, 'wb') as output:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            output.write(chunk)
+            if on_chunk is not None:
+                on_chunk(len(chunk))
+    return digest.hexdigest()
+
+def file_checksum(path, checksum_type):
+    """Compute checksum of the file.
+
+    :param string path: path of the file
+    :param string checksum_type: hashlib name of the checksum ('sha' is sha1)
+    :return string: hexadecimal checksum
+    """
+    if checksum_type == 'sha':
+        checksum_type = 'sha1'
+    digest = hashlib.new(checksum_type)
+    with open(path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def touch(path):
+    """Mark the cached file as used now.
+
+    :param string path: path of the file
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def open_compressed(path):
+    """Open possibly compressed file for reading.
+
+    :param string path: path of the file
+    :return: file object with decompressed content
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'rb')
+    return open(path, 'rb')
+
+class Package():
+    """Package found in the repository metadata. Has the attributes of
+    dnf.package.Package used by the rpmdiff worker."""
+    def __init__(self, name, arch, epoch, version, release, location,
+                 checksum_type, checksum, downloadsize, baseurl):
+        self.name = name
+        self.arch = arch
+        self.epoch = int(epoch or 0)
+        self.version = version
+        self.release = release
+        self.location = location
+        self.checksum_type = checksum_type
+        self.checksum = checksum
+        self.downloadsize = int(downloadsize or 0)
+        self.baseurl = baseurl
+        self.destdir = None
+
+    def __repr__(self):
+        return '<Package(%s-%s:%s-%s.%s)>' % (
+            self.name, self.epoch, self.version, self.release, self.arch
+        )
+
+    @property
+    def url(self):
+        """Url of the package file."""
+        return urljoin(self.baseurl, self.location)
+
+    def localPkg(self):
+        """Get path of the downloaded package file.
+
+        :return string: path
+        """
+        return os.path.join(
+            self.destdir or os.getcwd(), os.path.basename(self.location)
+        )
+
+class Repository():
+    """Reader of rpm-md repository metadata. Reads only the primary metadata,
+    from primary_db (sqlite) if published, otherwise from primary.xml."""
+    def __init__(self, baseurl, cachedir, max_age=CACHE_MAX_AGE):
+        """Create the reader.
+
+        :param string baseurl: url (or local path) of the repository
+        :param string cachedir: directory for caching the primary metadata;
+            files are named by their checksums, so the directory can be
+            shared by all repositories and processes
+        :param int max_age: cached files not used for max_age seconds are
+            removed when new metadata are downloaded
+        """
+        if not urlparse(baseurl).scheme:
+            baseurl = 'file://' + pathname2url(os.path.abspath(baseurl))
+        if not baseurl.endswith('/'):
+            baseurl += '/'
+        self.baseurl = baseurl
+        self.cachedir = cachedir
+        self.max_age = max_age
+        self.data = {}
+
+    def load(self):
+        """Download and parse repomd.xml.
+
+        :raises RepodataError: if repomd.xml can't be loaded
+        """
+        try:
+            with urlopen(urljoin(self.baseurl, 'repodata/repomd.xml'),
+                         timeout=FETCH_TIMEOUT) as response:
+                root = ET.parse(response).getroot()
+        except Exception as error:
+            raise RepodataError(
+                'Loading of %s failed: %s' % (self.baseurl, error)
+            )
+        self.data = {}
+        for data in root.iter(REPOMD_NS + 'data'):
+            checksum = data.find(REPOMD_NS + 'checksum')
+            location = data.find(REPOMD_NS + 'location')
+            self.data[data.get('type')] = {
+                'href': location.get('href'),
+                'checksum_type': checksum.get('type'),
+                'checksum': checksum.text.strip(),
+            }
+        if 'primary' not in self.data and 'primary_db' not in self.data:
+            raise RepodataError(
+                'Repository %s has no primary metadata.' % self.baseurl
+            )
+
+    def metadata_path(self, data_type):
+        """Get path of the cached metadata file; download it if needed.
+
+        :param string data_type: type of the metadata in repomd.xml
+        :return string: path of the (compressed) metadata file
+        :raises RepodataError: if the download fails or checksum mismatches
+        """
+        data = self.data[data_type]
+        suffix = os.path.basename(data['href']).split('-')[-1]
+        path = os.path.join(
+            self.cachedir, '%s-%s' % (data['checksum'], suffix)
+        )
+        if os.path.exists(path):
+            repodata_cache.inc(result='hit')
+            touch(path)
+            return path
+        repodata_cache.inc(result='miss')
+
+        os.makedirs(self.cachedir, exist_ok=True)
+        self.evict()
+        # Download to a temporary file, so other processes never see partial
+        # metadata.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cachedir, suffix='.part')
+        os.close(fd)
+        try:
+            fetch(urljoin(self.baseurl, data['href']), tmp_path)
+            checksum = file_checksum(tmp_path, data['checksum_type'])
+            if checksum != data['checksum']:
+                raise RepodataError(
+                    'Checksum of %s does not match.' % data['href']
+                )
+            os.replace(tmp_path, path)
+        except RepodataError:
+            raise
+        except Exception as error:
+            raise RepodataError(
+                'Download of %s failed: %s' % (data['href'], error)
+            )
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return path
+
+    def evict(self):
+        """Remove cached files not used for max_age seconds: metadata of
+        previous versions of the repositories and leftovers of interrupted
+        downloads. Files in use are never old, they are touched at each use.
+        """
+        deadline = time.time() - self.max_age
+        try:
+            names = os.listdir(self.cachedir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.cachedir, name)
+            try:
+                if os.stat(path).st_mtime < deadline:
+                    os.unlink(path)
+            except OSError:
+                # Removed by another process meanwhile
+                pass
+
+    def query(self, name, arch=None, epoch=None, version=None, release=None,
+              use_sqlite=True):
+        """Find packages in the repository.
+
+        :param string name: package name
+        :param string arch: architecture
+        :param int epoch: epoch
+        :param string version: version
+        :param string release: release
+        :param bool use_sqlite: if False, primary.xml is read even if
+            primary_db is published
+        :return list[Package]: packages
+        """
+        filters = {'name': name}
+        if arch is not None:
+            filters['arch'] = arch
+        if epoch is not None:
+            filters['epoch'] = str(epoch)
+        if version is not None:
+            filters['version'] = version
+        if release is not None:
+            filters['release'] = release
+
+        if use_sqlite and 'primary_db' in self.data:
+            return self.query_sqlite(filters)
+        return self.query_xml(filters)
+
+    def query_sqlite(self, filters):
+        """Find packages in primary_db.
+
+        :param dict filters: column values
+        :return list[Package]: packages
+        """
+        path = self.metadata_path('primary_db')
+        database_path = path
+        if path.endswith(('.gz', '.bz2', '.xz')):
+            database_path = path.rsplit('.', 1)[0]
+            if os.path.exists(database_path):
+                touch(database_path)
+            else:
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=self.cachedir, suffix='.part'
+                )
+                try:
+                    with open_compressed(path) as input_file, \
+                            os.fdopen(fd, 'wb') as output:
+                        shutil.copyfileobj(input_file, output, CHUNK_SIZE)
+                    os.replace(tmp_path, database_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+
+        condition = ' AND '.join('%s = ?' % key for key in sorted(filters))
+        connection = sqlite3.connect(
+            'file:%s?mode=ro' % pathname2url(database_path), uri=True
+        )
+        try:
+            rows = connection.execute(
+                'SELECT name, arch, epoch, version, release, location_href, '
+                'checksum_type, pkgId, size_package, location_base '
+                'FROM packages WHERE %s' % condition,
+                [filters[key] for key in sorted(filters)],
+            ).fetchall()
+        finally:
+            connection.close()
+        return [
+            Package(*row[:9], baseurl=row[9] or self.baseurl) for row in rows
+        ]
+
+    def query_xml(self, filters):
+        """Find packages in primary.xml; the file is streamed.
+
+        :param dict filters: values of name, arch, epoch, version, release
+        :return list[Package]: packages
+        """
+        path = self.metadata_path('primary')
+        packages = []
+        with open_compressed(path) as input_file:
+            for event, element in ET.iterparse(input_file):
+                if element.tag != COMMON_NS + 'package':
+                    continue
+                version = element.find(COMMON_NS + 'version')
+                values = {
+                    'name': element.findtext(COMMON_NS + 'name'),
+                    'arch': element.findtext(COMMON_NS + 'arch'),
+                    'epoch': version.get('epoch') or '0',
+                    'version': version.get('ver'),
+                    'release': version.get('rel'),
+                }
+                if all(values[key] == value for key, value in filters.items()):
+                    checksum = element.find(COMMON_NS + 'checksum')
+                    location = element.find(COMMON_NS + 'location')
+                    size = element.find(COMMON_NS + 'size')
+                    packages.append(Package(
+                        checksum_type=checksum.get('type'),
+                        checksum=checksum.text.strip(),
+                        location=location.get('href'),
+                        downloadsize=size.get('package'),
+                        baseurl=location.get(XML_BASE) or self.baseurl,
+                        **values
+                    ))
+                # Keep memory constant while streaming
+                element.clear()
+        return packages
+
+    def download(self, packages, destdir, on_chunk=None):
+        """Download the packages and verify their checksums.
+
+        :param list[Package] packages: packages
+        :param string destdir: destination directory
+        :param on_chunk: function called with the size of each downloaded
+            chunk
+        :raises RepodataError: if the download fails or checksum mismatches
+        """
+        for package in packages:
+            package.destdir = destdir
+            path = package.localPkg()
+            # Partial or corrupted files are never left at path
+            tmp_path = path + '.part'
+            try:
+                try:
+                    sha256 = fetch(package.url, tmp_path, on_chunk)
+                except Exception as error:
+                    raise RepodataError(
+                        'Download of %s failed: %s' % (package.url, error)
+                    )
+                if package.checksum_type == 'sha256':
+                    checksum = sha256
+                else:
+                    checksum = file_checksum(tmp_path, package.checksum_type)
+                if checksum != package.checksum:
+                    raise RepodataError(
+                        'Checksum of %s does not match.' % package.url
+                    )
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import gzip
+import json
+import datetime
+from sqlalchemy import select, exists, and_, or_
+from sqlalchemy.exc import IntegrityError
+from .... import database
+from ....database import Comparison
+from ....backend.celery_app import celery_app
+from ....config import config
+from .... import routing
+from .... import constants as app_constants
+from ..rpm_db_models import (RPMComparison, RPMDifference, RPMDifferenceBlob,
+                             RPMDifferenceCount, RPMDifferenceWaiver,
+                             RPMComment, RPMPath, RPMCallback, RPMProgress,
+                             RPMRequest)
+from .archival import is_rpmdiff, encode_row
+
+# Periods (months) older than this count of days are removed; 0 keeps
+# everything
+RETENTION_DAYS = config.getint('workers', 'RETENTION_DAYS', fallback=0)
+# Interval of the retention task in seconds when run by celery beat
+RETENTION_INTERVAL = config.getint(
+    'workers', 'RETENTION_INTERVAL', fallback=86400
+)
+# If set, rows of the removed periods are archived there first
+RETENTION_ARCHIVE_DIR = config.get(
+    'workers', 'RETENTION_ARCHIVE_DIR', fallback=''
+)
+
+def expirable():
+    """Get condition selecting rpmdiff Comparisons that can be removed by
+    the retention. Archived groups are kept, so that they can be restored;
+    once restored, they are removed by the next run.
+
+    :return: SQL expression
+    """
+    return and_(
+        is_rpmdiff(), Comparison.state != app_constants.STATE_ARCHIVED
+    )
+
+def expired_periods(ses, days=RETENTION_DAYS, now=None):
+    """Get periods whose comparisons are all older than the retention.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int days: retention in days; if 0, nothing expires
+    :param datetime.datetime now: current time
+    :return list: sorted list of periods
+    """
+    if days <= 0:
+        return []
+    if now is None:
+        now = datetime.datetime.now()
+    cutoff = database.period_of(now - datetime.timedelta(days=days))
+    query = ses.query(Comparison.period).filter(
+        Comparison.period < cutoff, expirable()
+    ).distinct().order_by(Comparison.period)
+    return [period for period, in query]
+
+def group_ids(period):
+    """Get query of ids of expirable Comparisons of the period.
+
+    :param int period: period
+    :return: SQL select
+    """
+    return select([Comparison.id]).where(
+        and_(Comparison.period == period, expirable())
+    )
+
+def comparison_ids(period):
+    """Get query of ids of RPMComparisons of the period.
+
+    :param int period: period
+    :return: SQL select
+    """
+    return select([RPMComparison.id]).where(
+        RPMComparison.id_group.in_(group_ids(period))
+    )
+
+def period_steps(period):
+    """Get tables of the period with conditions selecting its rows, in the
+    order in which the rows can be deleted. Rows are selected by the
+    partition key where the table has one; the other conditions catch rows
+    whose period differs from the period of their comparison group.
+
+    :param int period: period
+    :return list: list of tuples (model, condition)
+    """
+    groups = group_ids(period)
+    comp_ids = comparison_ids(period)
+    diff_ids = select([RPMDifference.id]).where(
+        RPMDifference.id_comp.in_(comp_ids)
+    )
+    return [
+        (RPMComment, RPMComment.id_diff.in_(diff_ids)),
+        (RPMComment, RPMComment.id_comp.in_(comp_ids)),
+        (RPMDifferenceWaiver, RPMDifferenceWaiver.id_comp.in_(comp_ids)),
+        (RPMDifferenceCount, RPMDifferenceCount.id_comp.in_(comp_ids)),
+        (RPMDifferenceBlob, RPMDifferenceBlob.id_comp.in_(comp_ids)),
+        (RPMDifference, RPMDifference.period == period),
+        (RPMDifference, RPMDifference.id_comp.in_(comp_ids)),
+        (RPMComparison, RPMComparison.period == period),
+        (RPMComparison, RPMComparison.id_group.in_(groups)),
+        (RPMCallback, RPMCallback.id_group.in_(groups)),
+        (RPMProgress, RPMProgress.id_group.in_(groups)),
+        (RPMRequest, RPMRequest.id_group.in_(groups)),
+        (Comparison, and_(Comparison.period == period, expirable())),
+    ]
+
+def archive_rows(ses, archive_file, model, condition):
+    """Write rows of the model matching the condition to the archive, one
+    JSON object per line.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param archive_file: file object opened for writing text
+    :param model: database model
+    :param condition: SQL expression selecting the rows
+    """
+    table = model.__table__
+    result = ses.execute(select([table]).where(condition))
+    for row in result:
+        archive_file.write(json.dumps({
+            'table': table.name, 'row': encode_row(row),
+        }) + '\n')
+
+def period_path_ids(ses, period):
+    """Get ids of paths used by differences of the period.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int period: period
+    :return list: ids of paths
+    """
+    query = ses.query(RPMDifference.id_path).filter(or_(
+        RPMDifference.period == period,
+        RPMDifference.id_comp.in_(comparison_ids(period)),
+    )).distinct()
+    return [id_path for id_path, in query]
+
+def drop_unused_paths(ses, path_ids):
+    """Remove those of the paths that are not used by any difference, in
+    a separate transaction. Only paths of removed differences are checked,
+    so paths just added by running tasks are never removed; paths reused by
+    running tasks are locked by them (see RPMPath.intern), and if one is
+    used meanwhile anyway, the paths are kept.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param list path_ids: ids of candidate paths
+    :return int: count of removed paths
+    """
+    count = 0
+    try:
+        for start in range(0, len(path_ids), RPMPath.LOOKUP_CHUNK):
+            count += ses.query(RPMPath).filter(
+                RPMPath.id.in_(path_ids[start:start + RPMPath.LOOKUP_CHUNK]),
+                ~exists().where(RPMDifference.id_path == RPMPath.id),
+            ).delete(synchronize_session=False)
+        ses.commit()
+    except IntegrityError as error:
+        ses.rollback()
+        print('Unused paths not removed: %s' % error)
+        return 0
+    return count
+
+def drop_period(ses, period, archive_dir=None):
+    """Remove all rows of the period in one transaction, each table by one
+    bulk delete (in addition to the rows of the period's comparisons whose
+    own period differs). Paths of the removed differences that are no
+    longer used by any difference are removed afterwards.
+
+    :param ses: session for communication with the database
+    :type ses: qlalchemy.orm.session.Session
+    :param int period: period
+    :param string archive_dir: if given, rows are archived into
+        'rpmdiff-<period>.jsonl.gz' in this directory before being removed
+    :return dict: counts of removed rows by table name
+    """
+    steps = period_steps(period)
+    path_ids = period_path_ids(ses, period)
+    archive_file = None
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, 'rpmdiff-%s.jsonl.gz' % period)
+        archive_file = gzip.open(path + '.part', 'wt', encoding='utf-8')
+        # Paths of the differences are archived with them
+        used_paths = select([RPMDifference.id_path]).where(
+            RPMDifference.id_comp.in_(comparison_ids(period))
+        )
+        steps = [(RPMPath, RPMPath.id.in_(used_paths), False)] + [
+            (model, condition, True) for model, condition in steps
+        ]
+    else:
+        steps = [(model, condition, True) for model, condition in steps]
+
+    counts = {}
+    try:
+        for model, condition, delete in steps:
+            if archive_file is not None:
+                archive_rows(ses, archive_file, model, condition)
+            if delete:
+                count = ses.query(model).filter(condition).delete(
+                    synchronize_session=False
+                )
+                name = model.__tablename__
+                counts[name] = counts.get(name, 0) + count
+        if archive_file is not None:
+            archive_file.close()
+        ses.commit()
+    except:
+        ses.rollback()
+        if archive_file is not None:
+            archive_file.close()
+            os.remove(path + '.part')
+        raise
+    if archive_file is not None:
+        os.replace(path + '.part', path)
+    counts[RPMPath.__tablename__] = drop_unused_paths(ses, path_ids)
+    return counts
+
+@celery_app.task(name='rpmdiff.retention')
+def retention():
+    """Remove periods older than RETENTION_DAYS."""
+    with database.UnitOfWork() as work:
+        for period in expired_periods(work.session):
+            counts = drop_period(
+                work.session, period, RETENTION_ARCHIVE_DIR or None
+            )
+            print('Period %s removed: %s' % (period, counts))
+
+if RETENTION_DAYS > 0:
+    celery_app.conf.beat_schedule = dict(celery_app.conf.beat_schedule, **{
+        'rpmdiff.retention': {
+            'task': 'rpmdiff.retention',
+            'schedule': RETENTION_INTERVAL,
+            'options': {
+                'queue': routing.queue(app_constants.PRIORITY_BULK),
+            },
+        },
+    })
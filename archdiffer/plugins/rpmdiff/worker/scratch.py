@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import fcntl
+import tempfile
+from uuid import uuid4
+from shutil import rmtree
+from contextlib import contextmanager
+from ....config import config
+from .... import metrics
+
+SCRATCH_DIR = config.get(
+    'workers', 'SCRATCH_DIR',
+    fallback=os.path.join(tempfile.gettempdir(), 'archdiffer-scratch'),
+)
+# Quota of all worker processes of the node in megabytes
+SCRATCH_QUOTA = config.getint('workers', 'SCRATCH_QUOTA', fallback=10240)
+# How long can a task wait for space in seconds (0 means no limit)
+SCRATCH_WAIT_TIMEOUT = config.getint(
+    'workers', 'SCRATCH_WAIT_TIMEOUT', fallback=0
+)
+SCRATCH_WAIT_INTERVAL = 5
+
+scratch_reserved = metrics.Gauge(
+    'archdiffer_rpmdiff_scratch_reserved_bytes',
+    'Scratch space reserved by tasks of all worker processes.',
+    multiprocess_mode='max',
+)
+scratch_quota = metrics.Gauge(
+    'archdiffer_rpmdiff_scratch_quota_bytes',
+    'Quota of the scratch space of all worker processes.',
+    multiprocess_mode='max',
+)
+scratch_waiting = metrics.Gauge(
+    'archdiffer_rpmdiff_scratch_waiting_tasks',
+    'Count of tasks waiting for scratch space.',
+)
+scratch_wait_seconds = metrics.Histogram(
+    'archdiffer_rpmdiff_scratch_wait_seconds',
+    'Time spent waiting for scratch space.',
+)
+
+class ScratchError(Exception):
+    """Scratch space was not available in time."""
+    pass
+
+def pid_alive(pid):
+    """Find out if process exists.
+
+    :param int pid: process id
+    :return bool: True if the process exists
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def disk_usage(path):
+    """Get total size of files in the directory and its subdirectories.
+    Files removed meanwhile are skipped.
+
+    :param string path: path of the directory or file
+    :return int: size in bytes
+    """
+    if not os.path.isdir(path):
+        try:
+            return os.lstat(path).st_size
+        except FileNotFoundError:
+            return 0
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+class ScratchSpace():
+    """Disk space for temporary files of tasks, shared by all worker
+    processes of the node and limited by a quota.
+
+    Tasks reserve space before using it. Reservations are files in the
+    'reservations' directory, named '<pid>-<id>' and containing the reserved
+    size; they are updated under a lock file, and reservations of processes
+    that no longer exist are released. Other directories in the root (like
+    the shared cache of repository metadata) are counted against the quota
+    by their actual size.
+    """
+    def __init__(self, root, quota):
+        """Create the scratch space.
+
+        :param string root: root directory
+        :param int quota: quota in bytes
+        """
+        self.root = root
+        self.quota = quota
+        self.tasks_dir = os.path.join(root, 'tasks')
+        self.reservations_dir = os.path.join(root, 'reservations')
+
+    @contextmanager
+    def lock(self):
+        """Context manager holding the lock of the scratch space."""
+        os.makedirs(self.reservations_dir, exist_ok=True)
+        with open(os.path.join(self.root, 'lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def remove(self, name):
+        """Remove task directory and reservation.
+
+        :param string name: name of the task scratch
+        """
+        rmtree(os.path.join(self.tasks_dir, name), ignore_errors=True)
+        try:
+            os.unlink(os.path.join(self.reservations_dir, name))
+        except FileNotFoundError:
+            pass
+
+    def reservations(self):
+        """Get reservations of existing processes; remove the others. Should
+        be called with the lock held.
+
+        :return dict: {name of the task scratch: reserved bytes}
+        """
+        reservations = {}
+        for name in os.listdir(self.reservations_dir):
+            path = os.path.join(self.reservations_dir, name)
+            if not pid_alive(int(name.split('-', 1)[0])):
+                self.remove(name)
+                continue
+            try:
+                with open(path) as reservation:
+                    reservations[name] = int(reservation.read() or 0)
+            except (FileNotFoundError, ValueError):
+                pass
+        return reservations
+
+    def reserved(self):
+        """Get total reserved bytes.
+
+        :return int: reserved bytes
+        """
+        with self.lock():
+            return sum(self.reservations().values())
+
+    def shared_usage(self):
+        """Get size of files in the root outside of task directories and
+        reservations.
+
+        :return int: size in bytes
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        return sum(
+            disk_usage(os.path.join(self.root, name))
+            for name in os.listdir(self.root)
+            if name not in ('tasks', 'reservations', 'lock')
+        )
+
+    def cleanup_stale(self):
+        """Remove directories and reservations of processes that no longer
+        exist."""
+        with self.lock():
+            self.reservations()
+            if os.path.isdir(self.tasks_dir):
+                for name in os.listdir(self.tasks_dir):
+                    if not pid_alive(int(name.split('-', 1)[0])):
+                        self.remove(name)
+
+    def try_reserve(self, name, total):
+        """Set reservation of the task scratch if the quota allows it. A task
+        is always allowed if it is the only one with reservation, so that
+        a task larger than the quota (or than what the shared files leave
+        of it) doesn't wait forever.
+
+        :param string name: name of the task scratch
+        :param int total: total bytes reserved by the task
+        :return bool: True if reserved
+        """
+        with self.lock():
+            others = sum(
+                size for other, size in self.reservations().items()
+                if other != name
+            )
+            if others and (others + self.shared_usage() + total >
+                           self.quota):
+                return False
+            tmp_path = os.path.join(self.reservations_dir, '.%s' % name)
+            with open(tmp_path, 'w') as reservation:
+                reservation.write(str(total))
+            os.replace(tmp_path, os.path.join(self.reservations_dir, name))
+            return True
+
+    def task(self):
+        """Create scratch of a task.
+
+        :return Scratch: scratch
+        """
+        return Scratch(self)
+
+class Scratch():
+    """Scratch directory of one task. Can be used as a context manager;
+    the directory and the reservation are removed at the end."""
+    def __init__(self, space):
+        """Create the directory.
+
+        :param ScratchSpace space: scratch space
+        """
+        self.space = space
+        self.name = '%s-%s' % (os.getpid(), uuid4().hex)
+        self.path = os.path.join(space.tasks_dir, self.name)
+        os.makedirs(self.path)
+        self.reserved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+    def reserve(self, size, timeout=SCRATCH_WAIT_TIMEOUT,
+                interval=SCRATCH_WAIT_INTERVAL):
+        """Reserve space; wait until other tasks free enough space.
+
+        :param int size: bytes to add to the reservation of the task
+        :param int timeout: how long to wait in seconds (0 means no limit)
+        :param float interval: how often to check for free space
+        :raises ScratchError: if the space isn't free in time
+        """
+        started = time.monotonic()
+        total = self.reserved + size
+        if not self.space.try_reserve(self.name, total):
+            print('Waiting for %s B of scratch space.' % size)
+            scratch_waiting.inc()
+            try:
+                while not self.space.try_reserve(self.name, total):
+                    if timeout and time.monotonic() - started > timeout:
+                        raise ScratchError(
+                            '%s B of scratch space not available in %s s.' %
+                            (size, timeout)
+                        )
+                    time.sleep(interval)
+            finally:
+                scratch_waiting.dec()
+        scratch_wait_seconds.observe(time.monotonic() - started)
+        self.reserved = total
+
+    def usage(self):
+        """Get size of files in the directory of the task.
+
+        :return int: size in bytes
+        """
+        return disk_usage(self.path)
+
+    def cleanup(self):
+        """Remove the directory and release the reservation."""
+        with self.space.lock():
+            self.space.remove(self.name)
+        self.reserved = 0
+
+space = ScratchSpace(SCRATCH_DIR, SCRATCH_QUOTA * 1024 * 1024)
+scratch_quota.set(space.quota)
+scratch_reserved.set_function(space.reserved)
@@ -10,14 +10,30 @@ Created on Mon Jul 17 10:23:02 2017
 """
 
 import importlib
+import threading
 import os
 
 workers = {}
 flask_frontends = {}
+# Names of flask-frontend plugins registered to be imported at first use
+lazy_flask_frontends = set()
+
+_lock = threading.RLock()
+
+def plugin_names():
+    """Get names of all plugins.
+
+    :return list: names of plugin packages
+    """
+    return sorted(
+        name for name in os.listdir(
+            os.path.join(os.path.dirname(__file__), 'plugins')
+        ) if not name.startswith('_')
+    )
 
 def load_plugins_workers():
     """Load worker plugins from all plugins if possible."""
-    for name in os.listdir(os.path.join(os.path.dirname(__file__), 'plugins')):
+    for name in plugin_names():
         try:
             workers[name] = importlib.import_module(
                 '.plugins.' + name + '.worker', 'archdiffer'
@@ -25,12 +41,32 @@ def load_plugins_workers():
         except ImportError as ie:
             print(ie)
 
-def load_plugins_flask_frontends():
-    """Load flask-frontend plugins from all plugins if possible."""
-    for name in os.listdir(os.path.join(os.path.dirname(__file__), 'plugins')):
-        try:
-            flask_frontends[name] = importlib.import_module(
-                '.plugins.' + name + '.flask_frontend', 'archdiffer'
-            )
-        except ImportError as ie:
-            print(ie)
+def load_plugin_flask_frontend(name):
+    """Load flask-frontend plugin if it isn't loaded yet.
+
+    :param string name: name of the plugin
+    :return: module of the plugin or None if it can't be imported
+    """
+    with _lock:
+        if name not in flask_frontends:
+            lazy_flask_frontends.discard(name)
+            try:
+                flask_frontends[name] = importlib.import_module(
+                    '.plugins.' + name + '.flask_frontend', 'archdiffer'
+                )
+            except ImportError as ie:
+                print(ie)
+                flask_frontends[name] = None
+        return flask_frontends[name]
+
+def load_plugins_flask_frontends(lazy=False):
+    """Load flask-frontend plugins from all plugins if possible.
+
+    :param bool lazy: if True, plugins are only registered and each is
+        imported by load_plugin_flask_frontend at its first use
+    """
+    for name in plugin_names():
+        if lazy:
+            lazy_flask_frontends.add(name)
+        else:
+            load_plugin_flask_frontend(name)
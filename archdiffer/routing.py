@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import bisect
+import hashlib
+from .config import config
+from .constants import PRIORITY_INTERACTIVE, PRIORITY_BULK, PRIORITIES
+
+QUEUES = {
+    PRIORITY_INTERACTIVE: config.get(
+        'workers', 'INTERACTIVE_QUEUE', fallback='celery'
+    ),
+    PRIORITY_BULK: config.get('workers', 'BULK_QUEUE', fallback='celery'),
+}
+
+CONCURRENCY = {
+    PRIORITY_INTERACTIVE: config.getint(
+        'workers', 'INTERACTIVE_CONCURRENCY', fallback=2
+    ),
+    PRIORITY_BULK: config.getint('workers', 'BULK_CONCURRENCY', fallback=4),
+}
+
+INTERACTIVE_USERS = [
+    user.strip() for user in
+    config.get('workers', 'INTERACTIVE_USERS', fallback='').split(',')
+    if user.strip()
+]
+
+# Queues of worker nodes for repository affinity of bulk requests
+AFFINITY_QUEUES = [
+    name.strip() for name in
+    config.get('workers', 'AFFINITY_QUEUES', fallback='').split(',')
+    if name.strip()
+]
+AFFINITY_MAX_BACKLOG = config.getint(
+    'workers', 'AFFINITY_MAX_BACKLOG', fallback=100
+)
+
+class HashRing():
+    """Consistent hashing ring of nodes. Adding or removing a node moves only
+    the keys of that node."""
+    def __init__(self, nodes, replicas=100):
+        """Create the ring.
+
+        :param list nodes: names of nodes
+        :param int replicas: count of points of each node on the ring
+        """
+        self.nodes = list(nodes)
+        self.ring = sorted(
+            (self.hash('%s#%s' % (node, replica)), node)
+            for node in self.nodes for replica in range(replicas)
+        )
+        self.points = [point for point, node in self.ring]
+
+    @staticmethod
+    def hash(key):
+        """Get position of the key on the ring.
+
+        :param string key: key
+        :return int: position
+        """
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def nodes_for(self, key):
+        """Get all nodes in order of preference for the key.
+
+        :param string key: key
+        :return list: names of nodes; the first one owns the key
+        """
+        result = []
+        start = bisect.bisect(self.points, self.hash(key))
+        for index in range(len(self.ring)):
+            node = self.ring[(start + index) % len(self.ring)][1]
+            if node not in result:
+                result.append(node)
+                if len(result) == len(self.nodes):
+                    break
+        return result
+
+affinity_ring = HashRing(AFFINITY_QUEUES)
+
+def affinity_queue(key, backlog=None, ring=None,
+                   max_backlog=AFFINITY_MAX_BACKLOG):
+    """Get queue of the worker node with affinity to the key. If the queue is
+    backlogged, spill over to the next queues on the ring.
+
+    :param string key: key, for example repository urls
+    :param callable backlog: function getting count of messages waiting in
+        the queue; if None, backlog is not checked
+    :param HashRing ring: ring of queues, defaults to AFFINITY_QUEUES
+    :param int max_backlog: count of waiting messages from which the queue
+        is considered backlogged
+    :return tuple: tuple (queue name, True if spilled over from the owner)
+        or (None, False) if there are no affinity queues
+    """
+    if ring is None:
+        ring = affinity_ring
+    queues = ring.nodes_for(key)
+    if not queues:
+        return None, False
+    if backlog is not None:
+        for index, name in enumerate(queues):
+            if backlog(name) < max_backlog:
+                return name, index > 0
+    # Everything is backlogged (or unknown) - stay with the owner
+    return queues[0], False
+
+def priority(requested=None, username=None, default=PRIORITY_BULK):
+    """Get priority of a request.
+
+    :param string requested: priority given in the request, has precedence
+    :param string username: name of the submitting user
+    :param string default: priority used if nothing else decides
+    :return string: priority
+    """
+    if requested is not None:
+        return requested
+    if username in INTERACTIVE_USERS:
+        return PRIORITY_INTERACTIVE
+    return default
+
+def queue(priority):
+    """Get name of the queue for the priority.
+
+    :param string priority: priority
+    :return string: queue name
+    """
+    return QUEUES[priority]
+
+def all_queues():
+    """Get names of all queues that workers should consume by default.
+
+    :return list: queue names
+    """
+    queues = list(QUEUES.values()) + AFFINITY_QUEUES
+    queues.append(config.get('workers', 'WEBHOOK_QUEUE', fallback='celery'))
+    return sorted(set(queues))
+
+def priority_queues(worker_priority):
+    """Get names of queues consumed by a worker of the priority: the queue of
+    the priority, the webhook queue and, for bulk workers, the affinity
+    queues. Queues of the other priorities are never consumed.
+
+    :param string worker_priority: priority of the worker
+    :return list: queue names
+    """
+    queues = [queue(worker_priority)]
+    queues.append(config.get('workers', 'WEBHOOK_QUEUE', fallback='celery'))
+    if worker_priority == PRIORITY_BULK:
+        queues.extend(AFFINITY_QUEUES)
+    others = set(
+        name for other, name in QUEUES.items() if other != worker_priority
+    )
+    return sorted(set(
+        name for name in queues
+        if name == queue(worker_priority) or name not in others
+    ))
+
+def worker_arguments(argv):
+    """Translate archdiffer options of the worker command to celery options.
+
+    With '--priority <priority>' the worker consumes the queues of the
+    priority (see priority_queues) with its configured concurrency. Without
+    it, the worker consumes all queues (unless queues are given by
+    -Q/--queues).
+
+    :param list argv: command line arguments
+    :return list: command line arguments for celery
+    :raises ValueError: if the priority is missing or not known
+    """
+    argv = list(argv)
+    if 'worker' not in argv:
+        return argv
+
+    worker_priority = None
+    for index, arg in enumerate(argv):
+        if arg == '--priority':
+            if index + 1 >= len(argv):
+                raise ValueError('Option --priority requires a value.')
+            worker_priority = argv[index + 1]
+            del argv[index:index + 2]
+            break
+        if arg.startswith('--priority='):
+            worker_priority = arg.split('=', 1)[1]
+            del argv[index]
+            break
+
+    position = argv.index('worker') + 1
+    if worker_priority is not None:
+        if worker_priority not in PRIORITIES:
+            raise ValueError('Unknown priority "%s".' % worker_priority)
+        # Inserted right after 'worker', so that options given explicitly
+        # later on the command line take precedence.
+        argv[position:position] = [
+            '-Q', ','.join(priority_queues(worker_priority)),
+            '-c', str(CONCURRENCY[worker_priority]),
+            '-n', '%s@%%h' % worker_priority,
+        ]
+    elif not any(arg in ('-Q', '--queues') or arg.startswith('--queues=')
+                 for arg in argv):
+        argv[position:position] = ['-Q', ','.join(all_queues())]
+    return argv
@@ -22,6 +22,7 @@ import json
 import celery
 from ..config import config
 from .. import database
+from .. import embedded
 
 _curdir = os.path.dirname(os.path.abspath(__file__))
 _basedir = os.path.dirname(os.path.dirname(_curdir))
@@ -96,12 +97,15 @@ class RESTTest(unittest.TestCase):
             env=cls.env,
         )
 
-        # Run backend
-        cls.backend = subprocess.Popen(
-            ['python3', '-m', 'archdiffer.backend', 'worker', '-c', '1'],
-            cwd=_basedir,
-            env=cls.env,
-        )
+        # Run backend, unless tasks are run by the frontend in the embedded
+        # mode
+        cls.backend = None
+        if not embedded.EMBEDDED:
+            cls.backend = subprocess.Popen(
+                ['python3', '-m', 'archdiffer.backend', 'worker', '-c', '1'],
+                cwd=_basedir,
+                env=cls.env,
+            )
 
         # Wait for frontend to start
         cls.wait_for_frontend_start()
@@ -244,19 +248,63 @@ class RESTTest(unittest.TestCase):
             time.sleep(0.5)
         return waited
 
-    def tearDown(self):
-        """Ensure there are no celery tasks remaining; remove database."""
-        # Discard all waiting tasks
-        celery_app = celery.Celery(broker=config['common']['MESSAGE_BROKER'])
-        discarded = celery_app.control.discard_all()
+    def embedded_pending(self):
+        """Get count of tasks waiting or running in the embedded executor of
+        the frontend, from its metrics.
 
-        # Wait for any unfinished active tasks
-        celery_inspect = celery_app.control.inspect()
-        waited = self.wait_for_unfinished_tasks(celery_inspect)
+        :return int: count of tasks
+        """
+        r = requests.get(self.baseurl + 'metrics')
+        for line in r.text.splitlines():
+            if line.startswith(embedded.embedded_pending.name + ' '):
+                return int(float(line.split()[1]))
+        return 0
+
+    def wait_for_embedded_tasks(self, timeout=60):
+        """Wait for all tasks of the embedded executor to finish.
+
+        :param int timeout: how long should wait for the tasks, in seconds
+        :return bool: True if there were unfinished tasks
+        :raises Exception: if the tasks don't finish in time
+        """
+        waited = False
+        deadline = time.monotonic() + timeout
+        while self.embedded_pending():
+            if time.monotonic() > deadline:
+                raise Exception(
+                    "Tasks didn't finish even after %s seconds." % timeout
+                )
+            waited = True
+            time.sleep(0.5)
+        return waited
 
-        # Determine if exception should be raised
-        if discarded != 0 or waited:
-            raise Exception('Some tasks were unfinished at the end of test.')
+    def tearDown(self):
+        """Ensure there are no celery tasks remaining; remove database. In
+        the embedded mode, tasks run in the frontend process, which reports
+        count of its pending tasks in its metrics.
+        """
+        if embedded.EMBEDDED:
+            # Tasks must not write to the database while it is removed
+            if self.wait_for_embedded_tasks():
+                raise Exception(
+                    'Some tasks were unfinished at the end of test.'
+                )
+        else:
+            # Discard all waiting tasks
+            celery_app = celery.Celery(
+                broker=config['common']['MESSAGE_BROKER']
+            )
+            discarded = celery_app.control.discard_all()
+
+            # Wait for any unfinished active tasks
+            celery_inspect = celery_app.control.inspect()
+            waited = self.wait_for_unfinished_tasks(celery_inspect)
+
+            # Determine if exception should be raised
+            if discarded != 0 or waited:
+                raise Exception(
+                    'Some tasks were unfinished at the end of test.'
+                )
 
         # Remove the database.
         os.remove(os.path.join(self.tmpdir, 'test.db'))
@@ -273,8 +321,9 @@ class RESTTest(unittest.TestCase):
         cls.frontend.wait()
 
         # Terminate backend
-        cls.backend.terminate()
-        cls.backend.wait()
+        if cls.backend is not None:
+            cls.backend.terminate()
+            cls.backend.wait()
 
         # Remove the temporal directory.
         rmtree(cls.tmpdir)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import base64
+import datetime
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..config import config
+from .. import database
+from ..flask_frontend.flask_app import flask_app
+from ..flask_frontend import api_tokens
+from ..flask_frontend.rest_api_views import rest_api_auth_required
+from ..flask_frontend.exceptions import AuthFailed
+
+class ApiTokensTest(unittest.TestCase):
+    """Tests for signed REST API tokens."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+        ses = database.session(expire_on_commit=False)
+        database.User.add(ses, 'openid', 'user')
+        self.user = database.User.query(ses, openid='openid')
+        self.user.new_token(ses)
+        ses.close()
+
+    def tearDown(self):
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_verify(self):
+        """Test that only unchanged, unexpired tokens are valid."""
+        token = api_tokens.sign(self.user)
+        login = self.user.api_login
+        expiration = self.user.api_token_expiration
+        with flask_app.test_request_context('/'), \
+                mock.patch.object(database.RevokedToken, 'ids',
+                                  return_value=frozenset()):
+            claims = api_tokens.verify(login, token)
+            self.assertEqual(claims['openid'], 'openid')
+            self.assertEqual(claims['name'], 'user')
+            self.assertIsNone(api_tokens.verify('other', token))
+            self.assertIsNone(api_tokens.verify(
+                login, token, today=expiration + datetime.timedelta(days=1)
+            ))
+            body, signature = token.split('.')
+            self.assertIsNone(
+                api_tokens.verify(login, body + 'x.' + signature)
+            )
+            self.assertIsNone(api_tokens.verify(login, body))
+            self.assertIsNone(api_tokens.verify(login, '.'))
+
+    def test_malformed(self):
+        """Test that malformed tokens are rejected, not raising errors."""
+        login = self.user.api_login
+        body, signature = api_tokens.sign(self.user).split('.')
+        view = rest_api_auth_required(lambda: 'ok')
+        tokens = ('\u017e.' + signature, body + '.\u017e', '\u017e.\u017e')
+        for token in tokens:
+            with flask_app.test_request_context('/'):
+                self.assertIsNone(api_tokens.verify(login, token))
+            auth = base64.b64encode(
+                ('%s:%s' % (login, token)).encode('utf-8')
+            ).decode('ascii')
+            with flask_app.test_request_context(
+                    '/', headers={'Authorization': 'Basic ' + auth}
+            ):
+                self.assertRaises(AuthFailed, view)
+
+    def test_revoke(self):
+        """Test that revoked token is rejected after invalidation."""
+        token = api_tokens.sign(self.user)
+        login = self.user.api_login
+        with flask_app.test_request_context('/'):
+            self.assertIsNotNone(api_tokens.verify(login, token))
+            ses = database.session(expire_on_commit=False)
+            user = database.User.query(ses, openid='openid')
+            api_tokens.revoke(ses, user)
+            user.new_token(ses)
+            ses.close()
+            # The list of revoked tokens is cached
+            self.assertIsNotNone(api_tokens.verify(login, token))
+            api_tokens.revoked_cache.invalidate()
+            self.assertIsNone(api_tokens.verify(login, token))
+            self.assertIsNotNone(
+                api_tokens.verify(user.api_login, api_tokens.sign(user))
+            )
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..config import config
+from .. import database
+from ..cache import TTLCache
+
+class TTLCacheTest(unittest.TestCase):
+    """Tests for cache of reference data."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.loads = []
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def load(self, value):
+        """Get loader of the value recording its calls."""
+        def load():
+            self.loads.append(value)
+            return value
+        return load
+
+    def test_ttl(self):
+        """Test that values are loaded again after they expire."""
+        cache = TTLCache('test', ttl=10, shared_dir='')
+        with mock.patch('time.monotonic', return_value=100):
+            self.assertEqual(cache.get('a', self.load(1)), 1)
+            self.assertEqual(cache.get('a', self.load(2)), 1)
+            self.assertIsNone(cache.get('b', self.load(None)))
+            self.assertIsNone(cache.get('b', self.load(None)))
+        with mock.patch('time.monotonic', return_value=111):
+            self.assertEqual(cache.get('a', self.load(3)), 3)
+        self.assertEqual(self.loads, [1, None, None, 3])
+
+    def test_invalidate(self):
+        """Test explicit invalidation and value loaded during it."""
+        cache = TTLCache('test', shared_dir='')
+        cache.get('a', self.load(1))
+        cache.get('b', self.load(1))
+        cache.invalidate('a')
+        self.assertEqual(cache.get('a', self.load(2)), 2)
+        self.assertEqual(cache.get('b', self.load(2)), 1)
+
+        def load_invalidated():
+            cache.invalidate()
+            return 3
+        self.assertEqual(cache.get('c', load_invalidated), 3)
+        self.assertEqual(cache.get('c', self.load(4)), 4)
+
+    def test_shared(self):
+        """Test that invalidation is seen by other processes."""
+        cache1 = TTLCache('test', shared_dir=self.tmpdir)
+        cache2 = TTLCache('test', shared_dir=self.tmpdir)
+        cache1.get('a', self.load(1))
+        cache2.get('a', self.load(1))
+        cache1.invalidate('b')
+        self.assertEqual(cache1.get('a', self.load(2)), 1)
+        self.assertEqual(cache2.get('a', self.load(3)), 3)
+
+class UserCacheTest(unittest.TestCase):
+    """Tests for cached users."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+        ses = database.session()
+        database.User.add(ses, 'openid', 'user')
+        ses.close()
+
+    def tearDown(self):
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_cached(self):
+        """Test that cached user can be used and token change invalidates
+        the cache."""
+        ses = database.session()
+        user = database.User.cached(ses, openid='openid')
+        user.new_token(ses)
+        api_login = user.api_login
+        ses.close()
+
+        ses = database.session()
+        self.assertEqual(
+            database.User.cached(ses, openid='openid').api_login, api_login
+        )
+        ses.close()
+
+        ses = database.session()
+        with mock.patch.object(database.User, 'query') as query:
+            user = database.User.cached(ses, openid='openid')
+            query.assert_not_called()
+        self.assertIs(user, ses.query(database.User).get('openid'))
+        self.assertEqual(user.api_login, api_login)
+        self.assertEqual(
+            database.User.cached(ses, api_login=api_login).name, 'user'
+        )
+        self.assertIsNone(database.User.cached(ses, api_login='other'))
+        ses.close()
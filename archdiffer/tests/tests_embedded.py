@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import unittest
+from unittest import mock
+from .. import embedded
+from ..flask_frontend import tasks
+
+class EmbeddedTest(unittest.TestCase):
+    """Tests for the embedded executor of tasks."""
+    def setUp(self):
+        self.executor = embedded.Executor(workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_run_task(self):
+        """Test that task is run by its name in the pool."""
+        future = self.executor.submit('example_plugin.example_task')
+        self.assertEqual(future.result(timeout=60), 'SUCCESS')
+
+    def test_failed_task(self):
+        """Test that failure of the task is reported by its state."""
+        future = self.executor.submit('example_plugin.example_task', (1,))
+        self.assertEqual(future.result(timeout=60), 'FAILURE')
+
+    def test_publish(self):
+        """Test that tasks are submitted instead of sent to the broker."""
+        with mock.patch.object(embedded, 'EMBEDDED', True), \
+                mock.patch.object(embedded, 'executor') as executor, \
+                mock.patch.object(tasks, 'get_celery_app') as get_celery_app:
+            executor.pending = 3
+            tasks.publish_many([
+                ('rpmdiff.compare', [1, {}, {}], {'queue': 'bulk'}),
+            ])
+            self.assertEqual(tasks.queue_backlog('bulk'), 3)
+        executor.submit.assert_called_once_with(
+            'rpmdiff.compare', [1, {}, {}], None
+        )
+        get_celery_app.assert_not_called()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import io
+import os
+import unittest
+import contextlib
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest import mock
+from sqlalchemy import create_engine
+from .. import engines
+
+class EnginesTest(unittest.TestCase):
+    """Tests for configuration of database engines."""
+    def test_engine_options(self):
+        """Test that pool options are not used for SQLite."""
+        options = engines.engine_options('sqlite:////tmp/archdiffer.db')
+        self.assertNotIn('pool_size', options)
+        options = engines.engine_options('postgresql://host/archdiffer')
+        self.assertEqual(options['pool_size'], engines.POOL_SIZE)
+        self.assertEqual(options['pool_recycle'], engines.POOL_RECYCLE)
+
+    def test_sample_statements(self):
+        """Test that only sampled statements are printed."""
+        engine = create_engine('sqlite://')
+        engines.sample_statements(engine, 0.5)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), \
+                mock.patch('random.random', side_effect=[0.9, 0.1]):
+            engine.execute('SELECT 1')
+            engine.execute('SELECT 2')
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn('SELECT 2', lines[0])
+
+    def test_dispose_after_fork(self):
+        """Test that pool of the parent process is replaced, not closed."""
+        engine = create_engine('sqlite://')
+        pool = engine.pool
+        engines.dispose_after_fork(engine)
+        self.assertIsNot(engine.pool, pool)
+        self.assertIs(engines._inherited[-1], pool)
+
+    def test_connection_of_parent(self):
+        """Test that connection opened by another process is replaced."""
+        engine = create_engine('sqlite://')
+        engines.protect_from_fork(engine)
+        with mock.patch('os.getpid', return_value=1):
+            connection = engine.raw_connection()
+            first = connection.connection
+            connection.close()
+        connection = engine.raw_connection()
+        self.assertIsNot(connection.connection, first)
+        self.assertIn(first, engines._inherited)
+        connection.close()
+
+    def test_tune_sqlite(self):
+        """Test that pragmas are set on new SQLite connections."""
+        tmpdir = mkdtemp()
+        try:
+            engine = create_engine(
+                'sqlite:///%s' % os.path.join(tmpdir, 'test.db')
+            )
+            engines.tune_sqlite(engine, [
+                'PRAGMA journal_mode = WAL', 'PRAGMA busy_timeout = 1234',
+            ])
+            self.assertEqual(
+                engine.execute('PRAGMA journal_mode').scalar(), 'wal'
+            )
+            self.assertEqual(
+                engine.execute('PRAGMA busy_timeout').scalar(), 1234
+            )
+            engine.dispose()
+        finally:
+            rmtree(tmpdir)
+
+    def test_sqlite_pragmas(self):
+        """Test that empty pragma settings are skipped."""
+        with mock.patch.object(engines, 'SQLITE_JOURNAL_MODE', ''), \
+                mock.patch.object(engines, 'SQLITE_BUSY_TIMEOUT', 100):
+            self.assertEqual(engines.sqlite_pragmas()[0],
+                             'PRAGMA busy_timeout = 100')
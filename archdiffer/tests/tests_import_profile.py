@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import unittest
+from ..import_profile import parse_importtime, report
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _io
+import time:       300 |        300 |   encodings
+import time:      1000 |       1420 | archdiffer
+Traceback (most recent call last):
+import time:      2500 |       2500 | json
+"""
+
+class ImportProfileTest(unittest.TestCase):
+    """Tests for the import time report."""
+    def test_parse(self):
+        """Test parsing of python -X importtime output."""
+        self.assertEqual(parse_importtime(OUTPUT), [
+            ('_io', 0.00012, 0.00012, 2),
+            ('encodings', 0.0003, 0.0003, 1),
+            ('archdiffer', 0.001, 0.00142, 0),
+            ('json', 0.0025, 0.0025, 0),
+        ])
+
+    def test_report(self):
+        """Test that report is sorted and limited."""
+        rows = parse_importtime(OUTPUT)
+        lines = report(rows, top=2, sort='self').splitlines()
+        self.assertEqual(lines[0], 'Total import time: 0.004 s, 4 modules')
+        self.assertEqual(
+            [line.split()[-1] for line in lines[2:]], ['json', 'archdiffer']
+        )
+        lines = report(rows, top=3).splitlines()
+        self.assertEqual(
+            [line.split()[-1] for line in lines[2:]],
+            ['json', 'archdiffer', 'encodings'],
+        )
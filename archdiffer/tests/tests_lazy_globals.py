@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import time
+import unittest
+from unittest import mock
+from flask import g
+from flask import session as flask_session
+from ..flask_frontend.flask_app import flask_app
+from ..flask_frontend import login_views
+
+class LazyGlobalsTest(unittest.TestCase):
+    """Tests for lazily opened database session and current user."""
+    def test_static(self):
+        """Test that static files don't open database session."""
+        client = flask_app.test_client()
+        with mock.patch(
+                'archdiffer.flask_frontend.common_views.db_session'
+        ) as db_session:
+            response = client.get('/static/style.css')
+            response.close()
+        self.assertEqual(response.status_code, 200)
+        db_session.assert_not_called()
+
+    def test_session_opened_once(self):
+        """Test that session is opened at first use and closed."""
+        with mock.patch(
+                'archdiffer.flask_frontend.common_views.db_session'
+        ) as db_session:
+            with flask_app.test_request_context('/', method='POST'):
+                self.assertNotIn('db_session', g)
+                self.assertIs(g.db_session, g.db_session)
+                self.assertIs(g.get('db_session'), g.db_session)
+        db_session.assert_called_once_with()
+        db_session.return_value.close.assert_called_once_with()
+
+    def test_signed_user(self):
+        """Test that user from the signed session is revalidated."""
+        user = mock.Mock(openid='openid')
+        user.name = 'user'
+        with mock.patch.object(login_views.User, 'cached',
+                               return_value=user) as cached, \
+                mock.patch.object(login_views, 'USER_REVALIDATE_INTERVAL',
+                                  60):
+            with flask_app.test_request_context('/'):
+                g.db_session = mock.Mock()
+                self.assertIsNone(g.user)
+
+            with flask_app.test_request_context('/'):
+                g.db_session = mock.Mock()
+                flask_session['openid'] = 'openid'
+                self.assertIs(g.get('user'), user)
+                signed = flask_session['user']
+            self.assertEqual(cached.call_count, 1)
+
+            with flask_app.test_request_context('/'):
+                flask_session['openid'] = 'openid'
+                flask_session['user'] = signed
+                self.assertEqual(g.user.name, 'user')
+                self.assertNotIn('db_session', g)
+                self.assertEqual(cached.call_count, 1)
+                # Other attributes are loaded from the database
+                g.db_session = mock.Mock()
+                self.assertIs(g.user.api_token, user.api_token)
+            self.assertEqual(cached.call_count, 2)
+
+            with flask_app.test_request_context('/'):
+                g.db_session = mock.Mock()
+                flask_session['openid'] = 'openid'
+                flask_session['user'] = dict(
+                    signed, checked=time.time() - 61
+                )
+                self.assertIs(g.user, user)
+            self.assertEqual(cached.call_count, 3)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from shutil import rmtree
+from werkzeug.exceptions import NotFound, Forbidden
+from .. import metrics
+from ..flask_frontend.flask_app import flask_app
+from ..flask_frontend import common_views
+
+def make_registry(tasks, in_flight, reserved, duration):
+    """Create registry of one process with given values.
+
+    :param int tasks: value of the counter
+    :param int in_flight: value of the summed gauge
+    :param int reserved: value of the shared gauge
+    :param float duration: value observed by the histogram
+    :return Registry: registry
+    """
+    registry = metrics.Registry()
+    metrics.Counter('tasks_total', 'Tasks.', registry=registry).inc(
+        tasks, state='done'
+    )
+    metrics.Gauge('in_flight', 'In flight.', registry=registry).set(
+        in_flight
+    )
+    metrics.Gauge(
+        'reserved', 'Reserved.', registry=registry, multiprocess_mode='max'
+    ).set(reserved)
+    metrics.Histogram(
+        'duration', 'Duration.', registry=registry, buckets=(1, 10)
+    ).observe(duration)
+    return registry
+
+def parse(text):
+    """Parse samples of metrics in the Prometheus text format.
+
+    :param string text: metrics
+    :return dict: {sample: value}
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            sample, value = line.rsplit(' ', 1)
+            samples[sample] = float(value)
+    return samples
+
+class MergeTest(unittest.TestCase):
+    """Tests for merging metrics of several processes."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def snapshot(self, registry):
+        """Dump the registry and read the snapshot back.
+
+        :param Registry registry: registry
+        :return list: snapshot
+        """
+        path = os.path.join(self.tmpdir, 'dump.json')
+        registry.dump(path)
+        with open(path) as dump_file:
+            return json.load(dump_file)
+
+    def test_merge(self):
+        """Test that values of live and dead processes are merged."""
+        text = metrics.render_snapshots([
+            (self.snapshot(make_registry(2, 1, 100, 0.5)), True),
+            (self.snapshot(make_registry(3, 2, 300, 5)), True),
+            (self.snapshot(make_registry(4, 7, 900, 50)), False),
+        ])
+        samples = parse(text)
+        self.assertEqual(samples['tasks_total{state="done"}'], 9)
+        self.assertEqual(samples['in_flight'], 3)
+        self.assertEqual(samples['reserved'], 300)
+        self.assertEqual(samples['duration_bucket{le="1.0"}'], 1)
+        self.assertEqual(samples['duration_bucket{le="10.0"}'], 2)
+        self.assertEqual(samples['duration_bucket{le="+Inf"}'], 3)
+        self.assertEqual(samples['duration_count'], 3)
+        self.assertEqual(samples['duration_sum'], 55.5)
+        self.assertEqual(text.count('# TYPE tasks_total counter'), 1)
+
+    def test_single_process(self):
+        """Test that merging one snapshot renders the same samples."""
+        registry = make_registry(2, 1, 100, 0.5)
+        self.assertEqual(
+            parse(metrics.render_snapshots([(registry.snapshot(), True)])),
+            parse(registry.render()),
+        )
+
+    def test_render_processes(self):
+        """Test that metrics of this process are merged with dumps of other
+        processes, of live and dead ones."""
+        make_registry(3, 2, 300, 5).dump(
+            metrics.dump_path(self.tmpdir, os.getppid())
+        )
+        make_registry(4, 7, 900, 50).dump(
+            metrics.dump_path(self.tmpdir, 2 ** 30)
+        )
+        # Stale dump of this process is replaced by its current values
+        make_registry(100, 100, 100, 100).dump(
+            metrics.dump_path(self.tmpdir)
+        )
+        samples = parse(metrics.render_processes(
+            self.tmpdir, make_registry(2, 1, 100, 0.5)
+        ))
+        self.assertEqual(samples['tasks_total{state="done"}'], 9)
+        self.assertEqual(samples['in_flight'], 3)
+        self.assertEqual(samples['duration_count'], 3)
+
+class FrontendMetricsTest(unittest.TestCase):
+    """Tests for metrics of the web frontend."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def show_metrics(self, address):
+        """Get metrics as the client from the address.
+
+        :param string address: address of the client
+        :return Response: response
+        """
+        with flask_app.test_request_context(
+                '/metrics', environ_base={'REMOTE_ADDR': address}):
+            return common_views.show_metrics()
+
+    def test_access(self):
+        """Test that metrics are shown only if enabled and only to the
+        allowed addresses."""
+        with mock.patch.object(common_views, 'METRICS', False):
+            with self.assertRaises(NotFound):
+                self.show_metrics('127.0.0.1')
+        with mock.patch.object(common_views, 'METRICS', True), \
+                mock.patch.object(common_views, 'METRICS_DIR', self.tmpdir):
+            with self.assertRaises(Forbidden):
+                self.show_metrics('192.0.2.1')
+            make_registry(3, 2, 300, 5).dump(
+                metrics.dump_path(self.tmpdir, os.getppid())
+            )
+            response = self.show_metrics('127.0.0.1')
+            samples = parse(response.get_data(as_text=True))
+            self.assertEqual(samples['tasks_total{state="done"}'], 3)
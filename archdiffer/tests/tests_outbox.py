@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..config import config
+from .. import database
+from ..flask_frontend.outbox import Dispatcher
+
+class Broker():
+    """Local stand-in for the message broker; collects published batches."""
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+
+    def publish(self, tasks):
+        if self.failing:
+            raise ConnectionError('Broker is not available.')
+        self.batches.append(list(tasks))
+
+    @property
+    def tasks(self):
+        return [task for batch in self.batches for task in batch]
+
+class OutboxTest(unittest.TestCase):
+    """Tests for dispatching tasks from the outbox."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+        self.broker = Broker()
+        self.dispatcher = Dispatcher(
+            publish=self.broker.publish, batch_size=2, interval=60
+        )
+
+    def tearDown(self):
+        self.dispatcher.stop()
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def add_tasks(self, count):
+        """Add tasks to the outbox in one transaction.
+
+        :param int count: count of tasks
+        """
+        ses = database.session()
+        for i in range(count):
+            database.OutboxTask.add(ses, 'test.task', (i, {'a': i}), queue='q')
+        ses.commit()
+        ses.close()
+
+    def outbox_count(self):
+        """Get count of tasks remaining in the outbox.
+
+        :return int: count of tasks
+        """
+        ses = database.session()
+        count = ses.query(database.OutboxTask).count()
+        ses.close()
+        return count
+
+    def test_dispatch(self):
+        """Test that tasks are sent in batches in order and removed."""
+        self.add_tasks(5)
+        self.assertEqual(self.dispatcher.dispatch(), 5)
+        self.assertEqual([len(batch) for batch in self.broker.batches],
+                         [2, 2, 1])
+        self.assertEqual(
+            self.broker.tasks,
+            [('test.task', (i, {'a': i}), {'queue': 'q'}) for i in range(5)]
+        )
+        self.assertEqual(self.outbox_count(), 0)
+        self.assertEqual(self.dispatcher.dispatch(), 0)
+
+    def test_dispatch_failed(self):
+        """Test that tasks stay in the outbox if the broker fails."""
+        self.add_tasks(3)
+        self.broker.failing = True
+        with self.assertRaises(ConnectionError):
+            self.dispatcher.dispatch()
+        self.assertEqual(self.outbox_count(), 3)
+        self.broker.failing = False
+        self.assertEqual(self.dispatcher.dispatch(), 3)
+        self.assertEqual(self.outbox_count(), 0)
+
+    def test_rollback(self):
+        """Test that tasks of a rolled back transaction are not sent."""
+        ses = database.session()
+        database.OutboxTask.add(ses, 'test.task', (1,))
+        ses.rollback()
+        ses.close()
+        self.assertEqual(self.dispatcher.dispatch(), 0)
+        self.assertEqual(self.broker.tasks, [])
+
+    def test_wake(self):
+        """Test that the dispatcher thread sends tasks when woken up."""
+        self.add_tasks(3)
+        self.dispatcher.wake()
+        for i in range(50):
+            if len(self.broker.tasks) == 3:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(self.broker.tasks), 3)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import json
+import pstats
+import unittest
+import tracemalloc
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..backend.profiling import TaskProfile, should_profile, comparison_id
+
+def busy_function():
+    """Allocate some memory."""
+    return [str(number) for number in range(100000)]
+
+class ProfilingTest(unittest.TestCase):
+    """Tests for profiling of tasks."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmpdir)
+
+    def test_should_profile(self):
+        """Test selection of profiled tasks."""
+        tasks = ['rpmdiff.compare']
+        self.assertTrue(should_profile('rpmdiff.compare', tasks, 0))
+        self.assertFalse(should_profile('rpmdiff.notify', tasks, 0))
+        self.assertTrue(should_profile('rpmdiff.notify', tasks, 1))
+
+    def test_comparison_id(self):
+        """Test finding comparison id in task arguments."""
+        self.assertEqual(comparison_id((5, {}, {}), {}), 5)
+        self.assertEqual(comparison_id((), {'id_comp': 7}), 7)
+        self.assertEqual(comparison_id((), {}), None)
+
+    def test_output(self):
+        """Test that profile, memory snapshot and summary are written."""
+        profile = TaskProfile('rpmdiff.compare', 'abc', 5)
+        profile.start()
+        busy_function()
+        path = profile.stop(self.tmpdir, state='SUCCESS')
+        self.assertEqual(
+            path, os.path.join(self.tmpdir, 'rpmdiff.compare-5-abc')
+        )
+        self.assertFalse(tracemalloc.is_tracing())
+
+        stats = pstats.Stats(path + '.prof')
+        self.assertTrue(any(
+            function[2] == 'busy_function' for function in stats.stats
+        ))
+        snapshot = tracemalloc.Snapshot.load(path + '.tracemalloc')
+        self.assertTrue(snapshot.traces)
+        with open(path + '.json') as summary_file:
+            summary = json.load(summary_file)
+        self.assertEqual(summary['comparison'], 5)
+        self.assertEqual(summary['state'], 'SUCCESS')
+        self.assertGreater(summary['memory_peak'], 1000000)
+
+    def test_unwritable_directory(self):
+        """Test that tracing of memory is stopped even if the results can't
+        be written."""
+        blocker = os.path.join(self.tmpdir, 'file')
+        open(blocker, 'w').close()
+        profile = TaskProfile('rpmdiff.compare', 'abc', 5)
+        profile.start()
+        busy_function()
+        with self.assertRaises(OSError):
+            profile.stop(os.path.join(blocker, 'profiles'), state='SUCCESS')
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import base64
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..config import config
+from .. import database
+from ..flask_frontend.flask_app import flask_app
+from ..flask_frontend import common_views
+
+class ReplicasTest(unittest.TestCase):
+    """Tests for read replicas."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.urls = [
+            'sqlite:///%s' % os.path.join(self.tmpdir, name)
+            for name in ('primary.db', 'replica1.db', 'replica2.db')
+        ]
+        self.unavailable = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'missing', 'replica.db'
+        )
+        self.database_url = config['common']['DATABASE_URL']
+
+    def tearDown(self):
+        config['common']['DATABASE_URL'] = self.database_url
+        config.remove_option('common', 'READ_REPLICA_URLS')
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_pool(self):
+        """Test that replicas are used in turns and unusable are skipped."""
+        pool = database.ReplicaPool(
+            [self.urls[1], self.unavailable, self.urls[2]], lag_interval=60
+        )
+        # Lag is measured by the test only
+        pool.stopped.set()
+        self.assertIsNone(pool.engine())
+        pool.refresh()
+        urls = [str(pool.engine().url) for _ in range(4)]
+        self.assertEqual(
+            urls, [self.urls[1], self.urls[2], self.urls[1], self.urls[2]]
+        )
+        self.assertIsNone(pool.lags[1])
+
+        # Lagging replica is skipped until the lag is measured again
+        pool.lags[0] = pool.max_lag + 1
+        self.assertEqual(str(pool.engine().url), self.urls[2])
+        self.assertEqual(str(pool.engine().url), self.urls[2])
+        pool.refresh()
+        self.assertEqual(str(pool.engine().url), self.urls[1])
+
+    def test_read_session(self):
+        """Test binding of read sessions."""
+        config['common']['DATABASE_URL'] = self.urls[0]
+        database.SessionSingleton.init(force_new=True)
+        self.assertEqual(
+            str(database.read_session().bind.url), self.urls[0]
+        )
+
+        config['common']['READ_REPLICA_URLS'] = self.unavailable
+        database.SessionSingleton.init(force_new=True)
+        self.assertEqual(
+            str(database.read_session().bind.url), self.urls[0]
+        )
+
+        config['common']['READ_REPLICA_URLS'] = self.urls[1]
+        database.SessionSingleton.init(force_new=True)
+        database.SessionSingleton.replicas.refresh()
+        self.assertEqual(
+            str(database.read_session().bind.url), self.urls[1]
+        )
+        self.assertEqual(str(database.session().bind.url), self.urls[0])
+
+    def test_pins(self):
+        """Test pinning reads of clients to the primary."""
+        for shared_dir in ('', self.tmpdir):
+            with self.subTest(shared_dir=shared_dir):
+                pins = common_views.PrimaryPins(shared_dir=shared_dir)
+                pins.pin('old', time.time() - 1)
+                pins.pin('new', time.time() + 60)
+                self.assertFalse(pins.pinned('old'))
+                self.assertTrue(pins.pinned('new'))
+                self.assertFalse(pins.pinned('other'))
+                other = common_views.PrimaryPins(shared_dir=shared_dir)
+                self.assertEqual(other.pinned('new'), bool(shared_dir))
+
+    def test_reads_from_replica(self):
+        """Test that clients read from the primary after their writes, by
+        the session cookie, REST API login or explicit header."""
+        def view():
+            pass
+        view.replica_reads = True
+        auth = {'Authorization': 'Basic ' + base64.b64encode(
+            b'login:token'
+        ).decode('ascii')}
+        pins = common_views.PrimaryPins(shared_dir='')
+        with mock.patch.dict(flask_app.view_functions,
+                             {'show_metrics': view}), \
+                mock.patch.object(common_views, 'primary_pins', pins):
+            with flask_app.test_request_context('/metrics', headers=auth):
+                self.assertTrue(common_views.reads_from_replica())
+            with flask_app.test_request_context(
+                    '/metrics', headers={'X-Read-Primary': 'true'}):
+                self.assertFalse(common_views.reads_from_replica())
+
+            with flask_app.test_request_context(
+                    '/metrics', method='POST', headers=auth):
+                common_views.pin_to_primary(flask_app.response_class())
+            with flask_app.test_request_context('/metrics', headers=auth):
+                self.assertFalse(common_views.reads_from_replica())
+            with flask_app.test_request_context('/metrics'):
+                self.assertTrue(common_views.reads_from_replica())
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import unittest
+from unittest import mock
+from .. import routing
+from ..routing import HashRing, affinity_queue, worker_arguments
+from ..constants import PRIORITY_INTERACTIVE, PRIORITY_BULK
+
+QUEUES = ['node1', 'node2', 'node3', 'node4']
+KEYS = ['http://example.com/repo%s\nhttp://example.com/other' % i
+        for i in range(1000)]
+
+class HashRingTest(unittest.TestCase):
+    """Tests for the consistent hashing ring."""
+    def test_nodes_for(self):
+        """Test that every key gets all nodes, always in the same order."""
+        ring = HashRing(QUEUES)
+        for key in KEYS[:50]:
+            nodes = ring.nodes_for(key)
+            self.assertEqual(sorted(nodes), QUEUES)
+            self.assertEqual(HashRing(QUEUES).nodes_for(key), nodes)
+
+    def test_balance(self):
+        """Test that keys are spread among all nodes."""
+        ring = HashRing(QUEUES)
+        owners = [ring.nodes_for(key)[0] for key in KEYS]
+        for node in QUEUES:
+            self.assertGreater(owners.count(node), len(KEYS) / 8)
+
+    def test_remove_node(self):
+        """Test that removing a node moves only the keys of that node."""
+        ring = HashRing(QUEUES)
+        smaller = HashRing(QUEUES[:-1])
+        for key in KEYS:
+            owner = ring.nodes_for(key)[0]
+            if owner != QUEUES[-1]:
+                self.assertEqual(smaller.nodes_for(key)[0], owner)
+
+    def test_empty(self):
+        """Test ring without nodes."""
+        self.assertEqual(HashRing([]).nodes_for(KEYS[0]), [])
+        self.assertEqual(
+            affinity_queue(KEYS[0], ring=HashRing([])), (None, False)
+        )
+
+class AffinityQueueTest(unittest.TestCase):
+    """Tests for choosing affinity queues."""
+    def setUp(self):
+        self.ring = HashRing(QUEUES)
+        self.key = KEYS[0]
+        self.nodes = self.ring.nodes_for(self.key)
+
+    def test_owner(self):
+        """Test that the owner is used if it isn't backlogged."""
+        self.assertEqual(
+            affinity_queue(self.key, lambda name: 0, ring=self.ring),
+            (self.nodes[0], False)
+        )
+        self.assertEqual(
+            affinity_queue(self.key, ring=self.ring), (self.nodes[0], False)
+        )
+
+    def test_spill_over(self):
+        """Test spilling over to the next queues on the ring."""
+        backlog = {self.nodes[0]: 500, self.nodes[1]: 100}
+        self.assertEqual(
+            affinity_queue(
+                self.key, lambda name: backlog.get(name, 0), ring=self.ring,
+                max_backlog=100,
+            ),
+            (self.nodes[2], True)
+        )
+
+    def test_all_backlogged(self):
+        """Test that the owner is used if all queues are backlogged."""
+        self.assertEqual(
+            affinity_queue(
+                self.key, lambda name: 1000, ring=self.ring, max_backlog=100
+            ),
+            (self.nodes[0], False)
+        )
+
+class WorkerArgumentsTest(unittest.TestCase):
+    """Tests for the options of the worker command."""
+    def setUp(self):
+        patchers = [
+            mock.patch.dict(routing.QUEUES, {
+                PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk',
+            }),
+            mock.patch.object(routing, 'AFFINITY_QUEUES', ['node1']),
+            mock.patch.object(routing.config, 'get', return_value='webhooks'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_priority_queues(self):
+        """Test that priority workers also consume the shared queues."""
+        self.assertEqual(
+            worker_arguments(
+                ['worker', '--priority', PRIORITY_INTERACTIVE]
+            )[:3],
+            ['worker', '-Q', 'interactive,webhooks']
+        )
+        self.assertEqual(
+            worker_arguments(['worker', '--priority=' + PRIORITY_BULK])[:3],
+            ['worker', '-Q', 'bulk,node1,webhooks']
+        )
+
+    def test_other_priority_queue(self):
+        """Test that queue of the other priority is not consumed."""
+        routing.QUEUES[PRIORITY_BULK] = 'webhooks'
+        self.assertEqual(
+            worker_arguments(
+                ['worker', '--priority', PRIORITY_INTERACTIVE]
+            )[:3],
+            ['worker', '-Q', 'interactive']
+        )
+
+    def test_missing_priority(self):
+        """Test that missing or unknown priority is an error."""
+        self.assertRaises(
+            ValueError, worker_arguments, ['worker', '--priority']
+        )
+        self.assertRaises(
+            ValueError, worker_arguments, ['worker', '--priority', 'other']
+        )
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import time
+import threading
+import unittest
+from unittest import mock
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..config import config
+from .. import database
+from ..flask_frontend import outbox
+from ..flask_frontend.tasks import BacklogMonitor, Batcher
+
+class BacklogMonitorTest(unittest.TestCase):
+    """Tests for the background refreshing of queue backlogs."""
+    def wait_for(self, condition, timeout=5):
+        """Wait until the condition holds."""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                self.fail('Condition not met in %s seconds.' % timeout)
+            time.sleep(0.01)
+
+    def test_backlog(self):
+        """Test that lookups don't wait for the broker."""
+        broker = threading.Event()
+        measured = []
+        def measure(name):
+            broker.wait()
+            measured.append(name)
+            return 42
+        monitor = BacklogMonitor(60, measure=measure)
+
+        self.assertEqual(monitor.backlog('bulk'), 0)
+        self.assertEqual(monitor.backlog('bulk'), 0)
+        broker.set()
+        self.wait_for(lambda: monitor.backlog('bulk') == 42)
+        self.assertEqual(measured, ['bulk'])
+
+        # A new queue is measured at once, not after the interval
+        self.assertEqual(monitor.backlog('node1'), 0)
+        self.wait_for(lambda: monitor.backlog('node1') == 42)
+
+class BatcherTest(unittest.TestCase):
+    """Tests for publishing of tasks in batches."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+
+    def tearDown(self):
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def test_failed_batch(self):
+        """Test that a batch failed to publish is saved to the outbox."""
+        def publish(batch):
+            raise ConnectionError('Broker is not available.')
+        batcher = Batcher(2, 60, publish=publish)
+        with mock.patch.object(outbox, 'dispatcher') as dispatcher:
+            batcher.put('test.task', (1,), {'queue': 'q'})
+            batcher.put('test.task', (2,), {'queue': 'q'})
+            batcher.flush()
+        dispatcher.wake.assert_called_once_with()
+        ses = database.session()
+        self.assertEqual(
+            [task.send_task_arguments() for task in ses.query(
+                database.OutboxTask
+            ).order_by(database.OutboxTask.id)],
+            [('test.task', (1,), {'queue': 'q'}),
+             ('test.task', (2,), {'queue': 'q'})]
+        )
+        ses.close()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+# This file is part of Archdiffer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from ..config import config
+from .. import database
+
+class UnitOfWorkTest(unittest.TestCase):
+    """Tests for sessions of units of work."""
+    def setUp(self):
+        self.tmpdir = mkdtemp()
+        self.database_url = config['common']['DATABASE_URL']
+        config['common']['DATABASE_URL'] = 'sqlite:///%s' % os.path.join(
+            self.tmpdir, 'test.db'
+        )
+        database.Base.metadata.create_all(database.engine(force_new=True))
+
+    def tearDown(self):
+        config['common']['DATABASE_URL'] = self.database_url
+        database.SessionSingleton.deinit()
+        rmtree(self.tmpdir)
+
+    def names(self):
+        """Get names of stored comparison types."""
+        ses = database.session()
+        try:
+            return [
+                comp_type.name
+                for comp_type in database.ComparisonType.query(ses)
+            ]
+        finally:
+            ses.close()
+
+    def test_checkpoint(self):
+        """Test that checkpoint commits and empties the session."""
+        with database.UnitOfWork() as work:
+            work.session.add(database.ComparisonType(name='a'))
+            work.checkpoint()
+            self.assertEqual(list(work.session), [])
+            work.session.add(database.ComparisonType(name='b'))
+        self.assertIsNone(work.session)
+        # Work after the last checkpoint isn't committed
+        self.assertEqual(self.names(), ['a'])
+
+    def test_failure(self):
+        """Test that work is rolled back and session closed on failure."""
+        with self.assertRaises(ValueError):
+            with database.UnitOfWork() as work:
+                work.session.add(database.ComparisonType(name='a'))
+                work.checkpoint()
+                work.session.add(database.ComparisonType(name='b'))
+                work.session.flush()
+                raise ValueError()
+        self.assertIsNone(work.session)
+        self.assertEqual(self.names(), ['a'])
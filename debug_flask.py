@@ -13,8 +13,10 @@ Created on Tue Aug 15 20:58:38 2017
 import sys
 from archdiffer.flask_frontend import flask_app
 
-port = 5000
-if len(sys.argv) > 1:
-    port = int(sys.argv[1])
+# The guard is needed by the embedded mode, its processes import this module
+if __name__ == '__main__':
+    port = 5000
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
 
-flask_app.run(port=port)
+    flask_app.run(port=port)
@@ -32,7 +32,9 @@ setup(
         ('/lib/systemd/system', ['contrib/systemd/archdiffer-worker.service']),
         ('/usr/share/archdiffer', ['contrib/apache/archdiffer.wsgi']),
         ('/usr/libexec/archdiffer',
-         ['contrib/scripts/init_db', 'contrib/scripts/init_db_rpmdiff']),
+         ['contrib/scripts/init_db', 'contrib/scripts/init_db_rpmdiff',
+          'contrib/scripts/archive_rpmdiff',
+          'contrib/scripts/upgrade_db_rpmdiff']),
     ],
     install_requires=[
         'Flask',